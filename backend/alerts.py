@@ -0,0 +1,361 @@
+import math
+import threading
+import time
+
+from app_logging import get_logger
+from rollups import format_timestamp, parse_timestamp
+
+log = get_logger("alerts")
+
+# ==============================================================================
+# ALERT ENGINE (SERVER-SIDE)
+# ==============================================================================
+# Aturan bahaya dievaluasi di backend saat ingest, bukan di browser. Setiap
+# box punya state kecil di memori (alert yang sedang aktif + waktu data
+# terakhir), jadi evaluasi satu baris cukup O(1). Hanya PERUBAHAN state
+# (raised / cleared) yang disimpan ke tabel alert_events dan di-stream ke
+# client; baris yang tetap di luar batas tidak membuat alert baru.
+#
+# Hysteresis: alert naik saat nilai keluar dari [min, max], dan baru turun
+# setelah nilai kembali ke [min + h, max - h]. Nilai yang berosilasi di
+# sekitar batas tidak membuat notifikasi berulang.
+#
+# Prioritas aturan: aturan box > aturan owner (mitra) > default.
+
+DEFAULT_RULE = {
+    "temp_min": 1.0,
+    "temp_max": 4.0,
+    "temp_hysteresis": 0.5,
+    "hum_min": 20.0,
+    "hum_max": 60.0,
+    "hum_hysteresis": 2.0,
+    "stale_seconds": 300,
+    "geofence_lat": None,
+    "geofence_lon": None,
+    "geofence_radius_m": None,
+    "geofence_hysteresis_m": 50.0,
+}
+RULE_FIELDS = tuple(DEFAULT_RULE)
+RULE_SCOPES = ("box", "owner")
+
+ALERT_KINDS = ("temperature", "humidity", "geofence", "offline")
+
+CREATE_TABLES_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS alert_rules (
+        scope TEXT NOT NULL,
+        scope_id TEXT NOT NULL,
+        {", ".join(f"{field} REAL" for field in RULE_FIELDS)},
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (scope, scope_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS alert_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        box_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        state TEXT NOT NULL,
+        value REAL,
+        threshold REAL,
+        message TEXT,
+        reading_id INTEGER,
+        created_at DATETIME NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_alert_events_box ON alert_events (box_id, id)",
+]
+
+# Alert terakhir per (box, kind); yang state-nya 'raised' masih aktif
+ACTIVE_QUERY = """
+    SELECT e.* FROM alert_events e
+    JOIN (SELECT MAX(id) AS id FROM alert_events GROUP BY box_id, kind) last
+      ON e.id = last.id
+    WHERE e.state = 'raised'
+"""
+
+LAST_SEEN_QUERY = "SELECT box_id, MAX(timestamp) AS last_seen FROM smartbox_data GROUP BY box_id"
+
+
+def read_last_seen(conn) -> dict:
+    """box_id -> epoch data terakhir (satu database / shard)."""
+    last_seen = {}
+    for row in conn.execute(LAST_SEEN_QUERY):
+        try:
+            last_seen[row["box_id"]] = parse_timestamp(row["last_seen"])
+        except ValueError:
+            continue
+    return last_seen
+
+
+def create_alert_tables(conn):
+    for statement in CREATE_TABLES_SQL:
+        conn.execute(statement)
+
+
+def distance_m(lat1, lon1, lat2, lon2) -> float:
+    """Jarak haversine dalam meter."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+
+def store_alert_events(conn, events):
+    """Simpan event alert (dict) dan isi id-nya. Commit dilakukan pemanggil."""
+    for event in events:
+        cursor = conn.execute("""
+            INSERT INTO alert_events (box_id, kind, state, value, threshold, message, reading_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (event["box_id"], event["kind"], event["state"], event["value"],
+              event["threshold"], event["message"], event["reading_id"], event["created_at"]))
+        event["id"] = cursor.lastrowid
+    return events
+
+
+class AlertEngine:
+    def __init__(self, defaults=None, on_events=None, stale_check_interval=30):
+        self.defaults = {**DEFAULT_RULE, **(defaults or {})}
+        # Dipanggil dengan list event setiap ada perubahan state (simpan + stream)
+        self.on_events = on_events
+        self.stale_check_interval = stale_check_interval
+        self._lock = threading.Lock()
+        self._rules = {"box": {}, "owner": {}}
+        self._owners = {}
+        self._resolved = {}
+        self._active = {}
+        self._last_seen = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._check_stale_enabled = True
+        self._refresh = None
+        self._stats = {"evaluated": 0, "raised": 0, "cleared": 0, "stale_checks": 0}
+
+    # --- RULES & OWNERSHIP ---
+
+    def _read_rules(self, conn):
+        rules = {"box": {}, "owner": {}}
+        for row in conn.execute("SELECT * FROM alert_rules"):
+            if row["scope"] in rules:
+                rules[row["scope"]][row["scope_id"]] = {
+                    field: row[field] for field in RULE_FIELDS if row[field] is not None
+                }
+        owners = {row["box_id"]: str(row["user_id"])
+                  for row in conn.execute("SELECT box_id, user_id FROM box_ownership")}
+        return rules, owners
+
+    def load_rules(self, conn):
+        """Muat ulang aturan & kepemilikan saja (perubahan dari worker lain)."""
+        rules, owners = self._read_rules(conn)
+        with self._lock:
+            self._rules = rules
+            self._owners = owners
+            self._resolved = {}
+
+    def load(self, conn, last_seen=None):
+        """
+        Muat aturan, kepemilikan box, alert aktif dan waktu data terakhir dari DB.
+        last_seen: hasil read_last_seen yang sudah digabung dari semua shard (None = dari conn).
+        """
+        rules, owners = self._read_rules(conn)
+        active = {}
+        for row in conn.execute(ACTIVE_QUERY):
+            active.setdefault(row["box_id"], {})[row["kind"]] = dict(row)
+        if last_seen is None:
+            last_seen = read_last_seen(conn)
+        with self._lock:
+            self._rules = rules
+            self._owners = owners
+            self._resolved = {}
+            self._active = active
+            self._last_seen = last_seen
+        return sum(len(kinds) for kinds in active.values())
+
+    def set_rule(self, scope, scope_id, rule):
+        """rule: dict field -> nilai (None = ikut aturan di atasnya)."""
+        with self._lock:
+            values = {k: v for k, v in rule.items() if k in DEFAULT_RULE and v is not None}
+            if values:
+                self._rules[scope][str(scope_id)] = values
+            else:
+                self._rules[scope].pop(str(scope_id), None)
+            self._resolved = {}
+
+    def set_owner(self, box_id, user_id):
+        with self._lock:
+            self._owners[box_id] = str(user_id)
+            self._resolved.pop(box_id, None)
+
+    def rule_for(self, box_id) -> dict:
+        with self._lock:
+            return dict(self._rule_for(box_id))
+
+    def _rule_for(self, box_id):
+        rule = self._resolved.get(box_id)
+        if rule is None:
+            rule = dict(self.defaults)
+            owner = self._owners.get(box_id)
+            if owner is not None:
+                rule.update(self._rules["owner"].get(owner, {}))
+            rule.update(self._rules["box"].get(box_id, {}))
+            self._resolved[box_id] = rule
+        return rule
+
+    # --- EVALUASI ---
+
+    def process(self, rows, now=None):
+        """Evaluasi baris yang baru di-commit. Return event perubahan state."""
+        now = time.time() if now is None else now
+        events = []
+        with self._lock:
+            for row in rows:
+                self._evaluate(row, now, events)
+            self._stats["evaluated"] += len(rows)
+            self._count(events)
+        self._emit(events)
+        return events
+
+    def _evaluate(self, row, now, events):
+        box_id = row["box_id"]
+        rule = self._rule_for(box_id)
+        active = self._active.setdefault(box_id, {})
+        self._last_seen[box_id] = now
+
+        if "offline" in active:
+            self._change(events, active, row, "offline", "cleared", None, None, "Box online kembali")
+
+        self._check_range(events, active, row, "temperature", row.get("temperature"),
+                          rule["temp_min"], rule["temp_max"], rule["temp_hysteresis"], "°C")
+        self._check_range(events, active, row, "humidity", row.get("humidity"),
+                          rule["hum_min"], rule["hum_max"], rule["hum_hysteresis"], "%")
+
+        lat, lon = row.get("latitude"), row.get("longitude")
+        radius = rule["geofence_radius_m"]
+        if (radius and lat is not None and lon is not None
+                and rule["geofence_lat"] is not None and rule["geofence_lon"] is not None):
+            distance = distance_m(rule["geofence_lat"], rule["geofence_lon"], lat, lon)
+            if "geofence" not in active and distance > radius:
+                self._change(events, active, row, "geofence", "raised", round(distance, 1), radius,
+                             f"Keluar geofence ({distance:.0f} m dari pusat)")
+            elif "geofence" in active and distance <= radius - (rule["geofence_hysteresis_m"] or 0):
+                self._change(events, active, row, "geofence", "cleared", round(distance, 1), radius,
+                             "Kembali di dalam geofence")
+
+    def _check_range(self, events, active, row, kind, value, low, high, hysteresis, unit):
+        if value is None:
+            return
+        hysteresis = hysteresis or 0
+        if kind not in active:
+            if low is not None and value < low:
+                self._change(events, active, row, kind, "raised", value, low, f"{kind} {value}{unit} < {low}{unit}")
+            elif high is not None and value > high:
+                self._change(events, active, row, kind, "raised", value, high, f"{kind} {value}{unit} > {high}{unit}")
+        elif ((low is None or value >= low + hysteresis)
+              and (high is None or value <= high - hysteresis)):
+            self._change(events, active, row, kind, "cleared", value, None, f"{kind} normal ({value}{unit})")
+
+    def _change(self, events, active, row, kind, state, value, threshold, message):
+        event = {
+            "id": None,
+            "box_id": row["box_id"],
+            "kind": kind,
+            "state": state,
+            "value": value,
+            "threshold": threshold,
+            "message": message,
+            "reading_id": row.get("id"),
+            "created_at": format_timestamp(int(time.time())),
+        }
+        if state == "raised":
+            active[kind] = event
+        else:
+            active.pop(kind, None)
+        events.append(event)
+
+    def apply_events(self, events):
+        """
+        Worker non-leader: ikuti event yang disimpan leader (dari alert_events)
+        agar daftar alert aktif di proses ini tetap sama, tanpa evaluasi ulang.
+        """
+        with self._lock:
+            for event in events:
+                active = self._active.setdefault(event["box_id"], {})
+                if event["state"] == "raised":
+                    active[event["kind"]] = dict(event)
+                else:
+                    active.pop(event["kind"], None)
+
+    def check_stale(self, now=None):
+        """Naikkan alert 'offline' untuk box yang tidak mengirim data > stale_seconds."""
+        now = time.time() if now is None else now
+        events = []
+        with self._lock:
+            for box_id, last_seen in self._last_seen.items():
+                stale_seconds = self._rule_for(box_id)["stale_seconds"]
+                active = self._active.setdefault(box_id, {})
+                if stale_seconds and "offline" not in active and now - last_seen > stale_seconds:
+                    silent = int(now - last_seen)
+                    self._change(events, active, {"box_id": box_id}, "offline", "raised",
+                                 silent, stale_seconds, f"Tidak ada data selama {silent} detik")
+            self._stats["stale_checks"] += 1
+            self._count(events)
+        self._emit(events)
+        return events
+
+    def _count(self, events):
+        for event in events:
+            self._stats[event["state"]] += 1
+
+    def _emit(self, events):
+        if events and self.on_events is not None:
+            self.on_events(events)
+
+    # --- QUERY ---
+
+    def active(self, box_ids=None):
+        """Alert yang sedang aktif. box_ids None = semua box."""
+        with self._lock:
+            items = [dict(event)
+                     for box_id, kinds in self._active.items()
+                     if box_ids is None or box_id in box_ids
+                     for event in kinds.values()]
+        return sorted(items, key=lambda e: (e["id"] is None, e["id"] or 0))
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["boxes"] = len(self._last_seen)
+            data["active"] = sum(len(kinds) for kinds in self._active.values())
+            data["rules"] = {scope: len(rules) for scope, rules in self._rules.items()}
+        return data
+
+    # --- STALENESS CHECKER ---
+
+    def start(self, check_stale=True, refresh=None):
+        """
+        check_stale=False: hanya jalankan refresh() berkala (worker non-leader).
+        refresh() dipanggil setiap interval sebelum cek box offline.
+        """
+        if self.stale_check_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._check_stale_enabled = check_stale
+        self._refresh = refresh
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="alert-stale-check", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.stale_check_interval):
+            try:
+                if self._refresh is not None:
+                    self._refresh()
+                if self._check_stale_enabled:
+                    self.check_stale()
+            except Exception as e:
+                log.warning("alert stale check failed", error=str(e))
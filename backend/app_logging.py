@@ -0,0 +1,127 @@
+import json
+import logging
+import sys
+import threading
+import time
+
+# ==============================================================================
+# LOGGING BERLEVEL & RATE-LIMITED
+# ==============================================================================
+# Pengganti print(): setiap log punya level, pesan tetap (template) dan
+# field terstruktur terpisah, mis.
+#     log.warning("invalid mqtt payload", box_id=..., error=...)
+# Pesan yang sama dibatasi LOG_RATE_BURST kali per LOG_RATE_INTERVAL detik;
+# sisanya dibuang dan jumlahnya dilaporkan di log berikutnya (suppressed=N).
+#
+# LOG_FORMAT=text -> "2025-01-01 12:00:00 INFO  ingest batch written rows=500"
+# LOG_FORMAT=json -> satu objek JSON per baris
+
+ROOT_LOGGER = "smartbox"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=10, interval=60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.fields = {**getattr(record, "fields", {}), "suppressed": suppressed}
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        name = record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + ".") else record.name
+        line = f"{ts} {record.levelname:<5} {name} {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={_text_value(v)}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def _text_value(value) -> str:
+    text = str(value)
+    return f'"{text}"' if " " in text or not text else text
+
+
+class StructuredLogger:
+    """Wrapper logging.Logger: log.info("pesan", key=value, ...)."""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def is_enabled(self, level) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(name) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def setup_logging(level="INFO", fmt="text", burst=10, interval=60.0):
+    """Pasang handler stderr untuk logger 'smartbox' (idempotent)."""
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(str(level).upper())
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter(burst=burst, interval=interval))
+    logger.addHandler(handler)
+    return logger
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ==============================================================================
+# CACHE TOKEN JWT & KEPEMILIKAN BOX
+# ==============================================================================
+# Dashboard mem-polling beberapa endpoint setiap beberapa detik dengan token
+# yang sama. TokenCache menyimpan claims hasil jwt.decode (LRU + TTL, tidak
+# pernah melewati 'exp' token), OwnershipCache menyimpan set box milik user
+# (LRU + TTL, di-invalidate saat register_box menulis).
+#
+# TTL membatasi data basi jika ada proses lain (worker WSGI lain) yang
+# mengubah kepemilikan: invalidasi hanya berlaku di proses ini.
+
+
+class _LRUCache:
+    def __init__(self, max_size=10000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _get(self, key, now):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._items[key]
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return item[0]
+
+    def _put(self, key, value, expires_at):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._items),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
+
+
+class TokenCache(_LRUCache):
+    """Token mentah -> claims yang sudah diverifikasi."""
+
+    def get_or_decode(self, token, decode):
+        """decode(token) -> claims (raise jika tidak valid). Hasil gagal tidak di-cache."""
+        now = time.time()
+        claims = self._get(token, now)
+        if claims is not None:
+            return claims
+        claims = decode(token)
+        expires_at = now + self.ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        self._put(token, claims, expires_at)
+        return claims
+
+
+class OwnershipCache(_LRUCache):
+    """user_id -> frozenset box_id miliknya."""
+
+    def __init__(self, load, max_size=10000, ttl=60.0):
+        super().__init__(max_size, ttl)
+        # load(user_id) -> iterable box_id, dipanggil saat miss
+        self._load = load
+
+    def boxes(self, user_id) -> frozenset:
+        now = time.time()
+        boxes = self._get(user_id, now)
+        if boxes is None:
+            boxes = frozenset(self._load(user_id))
+            self._put(user_id, boxes, now + self.ttl)
+        return boxes
+
+    def owns(self, user_id, box_id) -> bool:
+        return box_id in self.boxes(user_id)
@@ -1,17 +1,40 @@
 import sqlite3
 import json
+import re
 import time
-import csv
-import io
 import os
 import jwt 
 import datetime 
-from threading import Thread
+import atexit
+import functools
+import hmac
+import signal
+import sys
+from threading import Lock
 from dotenv import load_dotenv 
 import paho.mqtt.client as mqtt
-from flask import Flask, jsonify, request, Response, stream_with_context
+from flask import Flask, g, has_request_context, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
+from ingest import IngestFollower, IngestPipeline, PartialWriteError, ReorderBuffer
+from leader import LeaderLock
+from db_pool import ConnectionPool, PoolTimeout
+from migrations import SHARD_MIGRATIONS, apply_migrations
+from latest_cache import LatestReadingCache
+from telemetry_stream import TelemetryBroker, format_cursor, format_sse, parse_cursor
+from rollups import RESOLUTIONS, apply_rollups, format_timestamp, parse_timestamp, query_rollups
+from export_stream import SizeCache, csv_blocks, count_bytes, gzip_blocks, iter_rows, parse_range, record_size, slice_blocks
+from retention import ChainedCursor, PartitionStore, RetentionWorker
+from alerts import RULE_FIELDS as ALERT_RULE_FIELDS, RULE_SCOPES as ALERT_RULE_SCOPES, AlertEngine, read_last_seen, store_alert_events
+from bulk_export import COLUMNS as BULK_EXPORT_COLUMNS, FORMATS as BULK_EXPORT_FORMATS, ExportStats, export_blocks, format_available
+from app_logging import get_logger, setup_logging
+from auth_cache import OwnershipCache, TokenCache
+from http_cache import CachedResponse, ResponseCache, compress, etag_matches, http_date, make_etag, negotiate_encoding
+from spatial import apply_positions, query_bbox, query_nearby, simplify_track
+from shards import LAST_ID_QUERY, IdSequence, MergedCursor, Shard, ShardRouter, existing_shard_count, shard_path
+from ingest_guard import BOX_ID_PATTERN, DEFAULT_RANGES, IngestGuard, KnownBoxes, compile_validator
+from payload_codec import PayloadError, decode_payload, is_binary as is_binary_payload
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS
 
 # ==============================================================================
 # SECTION 2: KONFIGURASI
@@ -30,14 +53,244 @@ DB_FILE_NAME = os.getenv("DB_FILE", "smartbox_data.db")
 DB_FILE = os.path.join(script_dir, DB_FILE_NAME)
 JWT_SECRET = os.getenv("JWT_SECRET", "rahasia_default_kalau_env_hilang") 
 
+# Konfigurasi Ingest (write-behind batch)
+# INGEST_MODE=embedded: MQTT diterima di proses ini (default)
+# INGEST_MODE=external: MQTT diterima ingest_service.py, proses ini membaca data baru dari DB
+INGEST_MODE = os.getenv("INGEST_MODE", "embedded")
+INGEST_FOLLOW_INTERVAL = float(os.getenv("INGEST_FOLLOW_INTERVAL", 0.5))
+# Server multi-worker (gunicorn): hanya pemegang lock file ini yang menjalankan
+# MQTT/writer ingest, alert & retention; worker lain mengikuti data dari DB.
+# Kosong = proses tunggal (selalu menjalankan semuanya)
+INGEST_LEADER_LOCK = os.getenv("INGEST_LEADER_LOCK", "")
+INGEST_LEADER_RETRY_SECONDS = float(os.getenv("INGEST_LEADER_RETRY_SECONDS", 5))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 0.5))
+# Database terkunci / pool habis: batch diulang utuh, backoff naik sampai batas ini (detik)
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", 0.5))
+INGEST_RETRY_MAX_BACKOFF = float(os.getenv("INGEST_RETRY_MAX_BACKOFF", 30))
+# Reading ber-seq yang mendahului seq yang hilang ditahan maks. N detik (0 = nonaktif)
+INGEST_REORDER_WINDOW = float(os.getenv("INGEST_REORDER_WINDOW", 2.0))
+INGEST_REORDER_MAX_PENDING = int(os.getenv("INGEST_REORDER_MAX_PENDING", 256))
+# Timestamp perangkat lebih dari N detik di depan jam server dianggap salah
+INGEST_MAX_CLOCK_SKEW = int(os.getenv("INGEST_MAX_CLOCK_SKEW", 300))
+# (box_id, seq) yang sama dianggap duplikat hanya jika timestamp-nya berselisih
+# maks. N detik; di luar itu = counter perangkat mulai ulang (reboot / reflash)
+INGEST_DEDUP_WINDOW = int(os.getenv("INGEST_DEDUP_WINDOW", 600))
+
+# Validasi & rate limit ingest (ingest_guard.py), sebelum reading masuk antrian / DB
+# INGEST_REQUIRE_KNOWN_BOX=0: terima box_id yang belum ada di box_ownership (load test)
+INGEST_REQUIRE_KNOWN_BOX = os.getenv("INGEST_REQUIRE_KNOWN_BOX", "1") != "0"
+INGEST_KNOWN_BOX_TTL = float(os.getenv("INGEST_KNOWN_BOX_TTL", 30))
+INGEST_BOX_RATE = float(os.getenv("INGEST_BOX_RATE", 5))  # reading/detik per box, 0 = nonaktif
+INGEST_BOX_BURST = float(os.getenv("INGEST_BOX_BURST", 2000))
+INGEST_MAX_READINGS_PER_MESSAGE = int(os.getenv("INGEST_MAX_READINGS_PER_MESSAGE", 2000))
+INGEST_MAX_PAYLOAD_BYTES = int(os.getenv("INGEST_MAX_PAYLOAD_BYTES", 256 * 1024))
+INGEST_TEMP_MIN = float(os.getenv("INGEST_TEMP_MIN", -40.0))
+INGEST_TEMP_MAX = float(os.getenv("INGEST_TEMP_MAX", 80.0))
+INGEST_BOX_ID_PATTERN = os.getenv("INGEST_BOX_ID_PATTERN", BOX_ID_PATTERN)
+INGEST_QUARANTINE_SIZE = int(os.getenv("INGEST_QUARANTINE_SIZE", 1000))
+
+# Konfigurasi Stream Telemetri (SSE)
+STREAM_HISTORY_SIZE = int(os.getenv("STREAM_HISTORY_SIZE", 5000))
+STREAM_CLIENT_BUFFER = int(os.getenv("STREAM_CLIENT_BUFFER", 1000))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", 15))
+STREAM_RESUME_LIMIT = int(os.getenv("STREAM_RESUME_LIMIT", 1000))
+
+# Konfigurasi Retention (data mentah lama dipindah ke partisi bulanan)
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", 90))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", 3600))
+RETENTION_CHUNK_ROWS = int(os.getenv("RETENTION_CHUNK_ROWS", 5000))
+RETENTION_COMPRESS_AFTER_MONTHS = int(os.getenv("RETENTION_COMPRESS_AFTER_MONTHS", 12))
+PARTITION_DIR = os.path.join(os.path.dirname(DB_FILE), os.getenv("PARTITION_DIR", "partitions"))
+if INGEST_LEADER_LOCK:
+    INGEST_LEADER_LOCK = os.path.join(os.path.dirname(DB_FILE), INGEST_LEADER_LOCK)
+
+# Konfigurasi Alert (aturan default, bisa ditimpa per owner / per box)
+ALERT_TEMP_MIN = float(os.getenv("ALERT_TEMP_MIN", 1.0))
+ALERT_TEMP_MAX = float(os.getenv("ALERT_TEMP_MAX", 4.0))
+ALERT_HUM_MIN = float(os.getenv("ALERT_HUM_MIN", 20.0))
+ALERT_HUM_MAX = float(os.getenv("ALERT_HUM_MAX", 60.0))
+ALERT_STALE_SECONDS = int(os.getenv("ALERT_STALE_SECONDS", 300))
+ALERT_STALE_CHECK_SECONDS = int(os.getenv("ALERT_STALE_CHECK_SECONDS", 30))
+ALERT_QUERY_LIMIT = int(os.getenv("ALERT_QUERY_LIMIT", 500))
+
+# Konfigurasi Cache Auth (claims JWT & daftar box milik user)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 300))
+OWNERSHIP_CACHE_SIZE = int(os.getenv("OWNERSHIP_CACHE_SIZE", 10000))
+OWNERSHIP_CACHE_TTL = float(os.getenv("OWNERSHIP_CACHE_TTL", 60))
+# Token URL berumur pendek untuk EventSource / link download (lihat /api/auth/url-token)
+URL_TOKEN_TTL = int(os.getenv("URL_TOKEN_TTL", 60))
+# Bearer token untuk scraper Prometheus di /metrics (kosong = hanya JWT super admin)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Konfigurasi HTTP Cache (ETag/304, cache response JSON, kompresi)
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", 5))
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", 5000))
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", 1024))
+
+# Konfigurasi Query Spasial (peta armada & track)
+SPATIAL_MAX_RESULTS = int(os.getenv("SPATIAL_MAX_RESULTS", 5000))
+TRACK_TOLERANCE_M = float(os.getenv("TRACK_TOLERANCE_M", 10))
+TRACK_MAX_POINTS = int(os.getenv("TRACK_MAX_POINTS", 2000))
+TRACK_MAX_RAW_POINTS = int(os.getenv("TRACK_MAX_RAW_POINTS", 200000))
+
+# Konfigurasi Connection Pool & PRAGMA SQLite
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", 16000))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", 256))
+DB_CHECKOUT_TIMEOUT = float(os.getenv("DB_CHECKOUT_TIMEOUT", 10))
+# Export (CSV & bulk) memakai pool read-only sendiri per shard: download yang
+# lambat tidak memakan koneksi writer ingest & endpoint lain
+EXPORT_POOL_SIZE = int(os.getenv("EXPORT_POOL_SIZE", 2))
+EXPORT_CHECKOUT_TIMEOUT = float(os.getenv("EXPORT_CHECKOUT_TIMEOUT", 2))
+
+# Konfigurasi Sharding (data sensor dibagi ke beberapa file SQLite, lihat shards.py)
+# SHARD_COUNT=1: satu file database (default). SHARD_KEY=owner (per mitra) atau box (hash box_id)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+SHARD_KEY = os.getenv("SHARD_KEY", "owner")
+SHARD_DIR = os.path.join(os.path.dirname(DB_FILE), os.getenv("SHARD_DIR", "shards"))
+SHARD_DIRECTORY_TTL = float(os.getenv("SHARD_DIRECTORY_TTL", 60))
+SHARD_FANOUT_THREADS = int(os.getenv("SHARD_FANOUT_THREADS", 0))  # 0 = satu thread per shard
+
+# Konfigurasi Logging (level, format text/json, rate limit pesan berulang)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 10))
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", 60))
+
+setup_logging(LOG_LEVEL, LOG_FORMAT, burst=LOG_RATE_BURST, interval=LOG_RATE_INTERVAL)
+log = get_logger("backend")
+
+# ==============================================================================
+# METRICS (PROMETHEUS, LIHAT /metrics)
+# ==============================================================================
+MQTT_MESSAGES = METRICS.counter(
+    "smartbox_mqtt_messages_total", "Pesan MQTT yang diterima menurut format dan hasilnya", ["format", "result"])
+MQTT_READINGS = METRICS.counter(
+    "smartbox_mqtt_readings_total", "Reading sensor hasil decode pesan MQTT", ["format"])
+MQTT_PAYLOAD_BYTES = METRICS.counter(
+    "smartbox_mqtt_payload_bytes_total", "Ukuran payload MQTT yang diterima", ["format"])
+INGEST_COMMIT_LATENCY = METRICS.histogram(
+    "smartbox_ingest_commit_latency_seconds", "Waktu dari pesan masuk antrian sampai di-commit ke DB",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+INGEST_TIMESTAMPS = METRICS.counter(
+    "smartbox_ingest_timestamps_total",
+    "Sumber timestamp reading: device, server (tidak dikirim), rejected (tidak wajar, diganti waktu server)",
+    ["source"])
+INGEST_DUPLICATES = METRICS.counter(
+    "smartbox_ingest_duplicates_total", "Reading duplikat (box_id, seq) yang dibuang saat ingest")
+INGEST_REJECTED = METRICS.counter(
+    "smartbox_ingest_rejected_total", "Reading yang ditolak ingest guard sebelum masuk antrian", ["reason"])
+INGEST_BATCH_WRITE = METRICS.histogram(
+    "smartbox_ingest_batch_write_seconds", "Durasi menulis satu batch ingest (insert + rollup + commit)")
+HTTP_REQUESTS = METRICS.counter(
+    "smartbox_http_requests_total", "Request HTTP per route, method dan status", ["route", "method", "status"])
+HTTP_DURATION = METRICS.histogram(
+    "smartbox_http_request_duration_seconds", "Durasi request HTTP per route", ["route", "method"])
+HTTP_DB_TIME = METRICS.histogram(
+    "smartbox_http_db_seconds", "Total waktu query SQLite dalam satu request HTTP", ["route"])
+JWT_FAILURES = METRICS.counter(
+    "smartbox_jwt_decode_failures_total", "Token JWT yang ditolak", ["reason"])
+EXPORT_BYTES = METRICS.counter(
+    "smartbox_export_bytes_total", "Byte yang di-stream oleh endpoint export", ["endpoint", "format"])
+
+def observe_db_time(seconds: float):
+    """Dipanggil koneksi pool setiap query selesai; diakumulasi per request."""
+    if has_request_context():
+        g.db_seconds = g.get("db_seconds", 0.0) + seconds
+
+def observe_ingest_batch(write_seconds: float, ages: list):
+    INGEST_BATCH_WRITE.observe(write_seconds)
+    for age in ages:
+        INGEST_COMMIT_LATENCY.observe(age)
+
+def count_export_bytes(blocks, endpoint: str, fmt: str):
+    """Teruskan blok export apa adanya sambil menghitung byte yang terkirim."""
+    for block in blocks:
+        EXPORT_BYTES.inc(len(block), endpoint=endpoint, format=fmt)
+        yield block
+
 # ==============================================================================
 # SECTION 3: DATABASE MANAGEMENT
 # ==============================================================================
 
+def make_pool(path, export=False):
+    return ConnectionPool(
+        path,
+        max_size=EXPORT_POOL_SIZE if export else DB_POOL_SIZE,
+        checkout_timeout=EXPORT_CHECKOUT_TIMEOUT if export else DB_CHECKOUT_TIMEOUT,
+        synchronous=DB_SYNCHRONOUS,
+        busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+        mmap_size=DB_MMAP_SIZE,
+        cache_size_kb=DB_CACHE_SIZE_KB,
+        statement_cache=DB_STATEMENT_CACHE,
+        query_observer=observe_db_time,
+        read_only=export
+    )
+
+db_pool = make_pool(DB_FILE)
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row 
-    return conn
+    """Ambil koneksi dari pool. conn.close() mengembalikannya ke pool."""
+    return db_pool.connection()
+
+# Partisi bulanan data lama (per shard)
+partition_store = PartitionStore(PARTITION_DIR)
+
+# Shard data sensor: shard 0 = database utama. File shard yang masih ada di
+# disk tetap dibuka walau SHARD_COUNT diturunkan, agar datanya tetap terbaca
+# sampai dipindah dengan shard_tool.py
+shard_total = max(SHARD_COUNT, 1, existing_shard_count(SHARD_DIR))
+_shards = [Shard(0, DB_FILE, db_pool, partition_store, make_pool(DB_FILE, export=True))]
+for _index in range(1, shard_total):
+    _path = shard_path(SHARD_DIR, _index)
+    _shards.append(Shard(_index, _path, make_pool(_path),
+                        PartitionStore(os.path.join(SHARD_DIR, f"partitions_{_index:02d}")),
+                        make_pool(_path, export=True)))
+shard_router = ShardRouter(
+    _shards,
+    db_pool,
+    key=SHARD_KEY,
+    directory_ttl=SHARD_DIRECTORY_TTL,
+    fanout_threads=SHARD_FANOUT_THREADS,
+    sequence=IdSequence(os.path.join(SHARD_DIR, "sequence.db"), DB_BUSY_TIMEOUT_MS) if shard_total > 1 else None
+)
+
+# Job retention di background, satu per shard
+retention_workers = [
+    RetentionWorker(
+        shard.path,
+        shard.partitions,
+        raw_days=RETENTION_RAW_DAYS,
+        interval=RETENTION_INTERVAL_SECONDS,
+        chunk_rows=RETENTION_CHUNK_ROWS,
+        compress_after_months=RETENTION_COMPRESS_AFTER_MONTHS
+    )
+    for shard in _shards
+]
+
+def initialize_shards():
+    """Skema file shard 1..N-1 + sequence id yang tidak tertinggal dari data yang ada."""
+    if shard_router.count == 1:
+        return
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    for shard in shard_router.shards[1:]:
+        conn = shard.pool.connection()
+        try:
+            apply_migrations(conn, migrations=SHARD_MIGRATIONS)
+        finally:
+            conn.close()
+    shard_router.sync_sequence()
+    if shard_router.count > SHARD_COUNT:
+        log.warning("more shard files than SHARD_COUNT, run shard_tool.py rebalance",
+                    shard_count=SHARD_COUNT, shard_files=shard_router.count)
+    log.info("shards initialized", shards=shard_router.count, key=SHARD_KEY, path=SHARD_DIR)
 
 def initialize_database():
     """Membuat tabel jika belum ada dan seeding super admin."""
@@ -98,7 +351,11 @@ def initialize_database():
         """)
         
         conn.commit()
-        print(f"Database '{DB_FILE}' initialized.")
+
+        # 5. Migrasi skema (index, dll) untuk file database baru maupun lama
+        schema_version = apply_migrations(conn)
+        log.info("database initialized", path=DB_FILE, schema_version=schema_version)
+        initialize_shards()
         
         # --- SEEDING SUPER ADMIN ---
         try:
@@ -109,69 +366,496 @@ def initialize_database():
                 VALUES (?, ?, ?, ?, ?)
             """, ("superadmin", "super@smartbox.id", super_pass, "super_admin", 1))
             conn.commit()
-            print("Super Admin account created.")
+            log.info("super admin account created")
         except sqlite3.IntegrityError:
             pass # Sudah ada, skip
 
     except sqlite3.Error as e:
-        print(f"Database initialization error: {e}")
+        log.error("database initialization failed", error=str(e))
     finally:
         if conn: conn.close()
 
+REAL_COLUMNS = ("temperature", "humidity", "latitude", "longitude")
+
+# Batas bawah timestamp perangkat yang wajar (2020-01-01); RTC yang belum
+# tersinkron biasanya mengirim epoch 0 / 1970
+MIN_DEVICE_EPOCH = 1577836800
+
+# (box_id, seq, timestamp) dari batch yang sudah ada di database dengan seq sama
+# dan timestamp dalam jendela dedup (index idx_smartbox_data_box_seq_ts)
+DUPLICATE_SEQ_QUERY = """
+    SELECT json_extract(j.value, '$[0]'), json_extract(j.value, '$[1]'), json_extract(j.value, '$[2]')
+    FROM json_each(:keys) j
+    WHERE EXISTS (
+        SELECT 1 FROM smartbox_data d
+        WHERE d.box_id = json_extract(j.value, '$[0]') AND d.seq = json_extract(j.value, '$[1]')
+          AND d.timestamp BETWEEN datetime(json_extract(j.value, '$[2]'), :before)
+                              AND datetime(json_extract(j.value, '$[2]'), :after)
+    )
+"""
+
+def device_timestamp(payload: dict, now: int):
+    """
+    Waktu ukur dari perangkat: 'ts' (epoch detik, payload biner) atau
+    'timestamp' (epoch / 'YYYY-MM-DD HH:MM:SS' UTC). Return (epoch, sumber).
+    """
+    value = payload.get("ts", payload.get("timestamp"))
+    if value is None:
+        return now, "server"
+    try:
+        epoch = parse_timestamp(value)
+    except (TypeError, ValueError):
+        return now, "rejected"
+    if not MIN_DEVICE_EPOCH <= epoch <= now + INGEST_MAX_CLOCK_SKEW:
+        return now, "rejected"
+    return epoch, "device"
+
+def device_seq(payload: dict):
+    seq = payload.get("seq")
+    if isinstance(seq, int) and not isinstance(seq, bool) and 0 <= seq < 2 ** 63:
+        return seq
+    return None
+
+def build_sensor_row(payload: dict, now: int, received_at: str):
+    """Payload -> (baris smartbox_data tanpa id, sumber timestamp: device/server/rejected)."""
+    epoch, source = device_timestamp(payload, now)
+    return (
+        payload.get("box_id"),
+        payload.get("temperature"),
+        payload.get("humidity"),
+        payload.get("latitude"),
+        payload.get("longitude"),
+        received_at if source != "device" else format_timestamp(epoch),
+        device_seq(payload),
+        received_at
+    ), source
+
+def store_sensor_batch(payloads: list) -> list:
+    """
+    Menyimpan banyak data sensor sekaligus, satu transaksi (executemany) per shard.
+    Return baris yang tersimpan (lengkap dengan id & timestamp) untuk cache;
+    reading duplikat (box_id, seq sudah ada dalam jendela dedup) tidak ikut disimpan.
+    """
+    now = int(time.time())
+    # Format sama dengan CURRENT_TIMESTAMP SQLite (UTC)
+    received_at = format_timestamp(now)
+    rows = []
+    sources = {}
+    for p in payloads:
+        row, source = build_sensor_row(p, now, received_at)
+        sources[source] = sources.get(source, 0) + 1
+        rows.append(row)
+    for source, count in sources.items():
+        INGEST_TIMESTAMPS.inc(count, source=source)
+    return store_sensor_rows(rows)
+
+def store_sensor_rows(rows: list) -> list:
+    """Simpan baris hasil build_sensor_row (juga dipakai import_tool.py)."""
+    # Urut waktu ukur: id mengikuti urutan pengukuran dalam satu batch
+    # (stabil, jadi reading tanpa timestamp perangkat tetap urut kedatangan)
+    rows.sort(key=lambda r: (r[5], r[6] if r[6] is not None else -1))
+
+    # Satu transaksi per shard; box baru dicatat di direktori shard lebih dulu
+    routes = shard_router.assign({row[0] for row in rows}) if rows else {}
+    groups = {}
+    for row in rows:
+        groups.setdefault(routes[row[0]], []).append(row)
+    stored = []
+    errors = {}
+    for shard in sorted(groups):
+        # Shard lain tetap ditulis walau satu shard gagal (lock / disk penuh)
+        try:
+            stored.extend(store_shard_rows(shard, groups[shard]))
+        except Exception as e:
+            errors[shard] = e
+    if errors:
+        error = next(iter(errors.values()))
+        if not stored:
+            raise error
+        raise PartialWriteError(error, stored, {row[0] for shard in errors for row in groups[shard]})
+    return stored
+
+def store_shard_rows(shard: int, rows: list) -> list:
+    """Dedup, insert, rollup & posisi untuk baris milik satu shard."""
+    conn = shard_router.connection(shard)
+    try:
+        # Write lock diambil di awal agar id batch ini berurutan
+        conn.execute("BEGIN IMMEDIATE")
+        keys = [[r[0], r[6], r[5]] for r in rows if r[6] is not None]
+        if keys:
+            # Deduplikasi di bawah write lock lewat index (box_id, seq, timestamp).
+            # Duplikat di dalam batch ini sendiri (redelivery) membawa timestamp
+            # yang sama: waktu perangkat, atau waktu terima batch yang sama
+            seen = {tuple(key) for key in conn.execute(DUPLICATE_SEQ_QUERY, {
+                "keys": json.dumps(keys),
+                "before": f"-{INGEST_DEDUP_WINDOW} seconds",
+                "after": f"+{INGEST_DEDUP_WINDOW} seconds",
+            })}
+            unique = []
+            for row in rows:
+                if row[6] is not None:
+                    key = (row[0], row[6], row[5])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                unique.append(row)
+            if len(unique) < len(rows):
+                INGEST_DUPLICATES.inc(len(rows) - len(unique))
+            rows = unique
+        if not rows:
+            conn.rollback()
+            return []
+        last_id = shard_router.allocate_ids(conn, len(rows))
+        conn.executemany("""
+        INSERT INTO smartbox_data (id, box_id, temperature, humidity, latitude, longitude, timestamp, seq, received_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """, [(last_id + i + 1, *row) for i, row in enumerate(rows)])
+
+        # Samakan tipe dengan yang dibaca dari SQLite (kolom REAL -> float)
+        columns = ("box_id", "temperature", "humidity", "latitude", "longitude", "timestamp", "seq", "received_at")
+        stored = []
+        for i, row in enumerate(rows):
+            item = dict(zip(columns, row), id=last_id + i + 1)
+            for key in REAL_COLUMNS:
+                if isinstance(item[key], int) and not isinstance(item[key], bool):
+                    item[key] = float(item[key])
+            stored.append(item)
+
+        # Rollup & index posisi diperbarui di transaksi yang sama dengan data mentahnya
+        apply_rollups(conn, stored)
+        apply_positions(conn, stored)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return stored
+
 def store_sensor_data(payload: dict):
     """Menyimpan data sensor dari MQTT ke SQLite."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO smartbox_data (box_id, temperature, humidity, latitude, longitude)
-        VALUES (?, ?, ?, ?, ?);
-        """, (
-            payload.get("box_id"),
-            payload.get("temperature"),
-            payload.get("humidity"),
-            payload.get("latitude"),
-            payload.get("longitude")
-        ))
+        store_sensor_batch([payload])
+        log.debug("sensor data stored", box_id=payload.get("box_id"))
+    except sqlite3.Error as e:
+        log.warning("failed to store sensor data", box_id=payload.get("box_id"), error=str(e))
+
+# Baris terakhir per box di memori (untuk polling limit=1 & daftar device)
+latest_cache = LatestReadingCache()
+
+# Body JSON endpoint polling (di-invalidate oleh jalur ingest per box)
+response_cache = ResponseCache(ttl=HTTP_CACHE_TTL, max_entries=HTTP_CACHE_MAX_ENTRIES)
+
+def warm_latest_cache():
+    shard_router.fan_out(lambda conn, shard: latest_cache.warm(conn))
+    log.info("latest-reading cache warmed", boxes=latest_cache.stats()["boxes"])
+
+def row_shards(rows) -> list:
+    """Shard setiap baris menurut direktori box (partisi cursor stream & fleet)."""
+    shards = shard_router.shards_for({row['box_id'] for row in rows})
+    return [shards[row['box_id']] for row in rows]
+
+# Fan-out data baru ke client SSE (cursor per shard, lihat telemetry_stream.py)
+telemetry_broker = TelemetryBroker(
+    history_size=STREAM_HISTORY_SIZE,
+    client_buffer=STREAM_CLIENT_BUFFER,
+    partition=row_shards
+)
+
+# Alert: perubahan state disimpan ke alert_events lalu di-stream ke client
+alert_broker = TelemetryBroker(
+    history_size=STREAM_HISTORY_SIZE,
+    client_buffer=STREAM_CLIENT_BUFFER
+)
+
+def record_alert_events(events: list):
+    conn = get_db_connection()
+    try:
+        store_alert_events(conn, events)
         conn.commit()
-        print(f"Data from '{payload.get('box_id')}' stored.")
     except sqlite3.Error as e:
-        print(f"Failed to store data: {e}")
+        conn.rollback()
+        log.error("failed to store alert events", events=len(events), error=str(e))
+        return
     finally:
-        if conn: conn.close()
+        conn.close()
+    alert_broker.publish(events)
+    for event in events:
+        log.info("alert " + event["state"], box_id=event["box_id"], kind=event["kind"], message=event["message"])
+
+alert_engine = AlertEngine(
+    defaults={
+        "temp_min": ALERT_TEMP_MIN,
+        "temp_max": ALERT_TEMP_MAX,
+        "hum_min": ALERT_HUM_MIN,
+        "hum_max": ALERT_HUM_MAX,
+        "stale_seconds": ALERT_STALE_SECONDS,
+    },
+    on_events=record_alert_events,
+    stale_check_interval=ALERT_STALE_CHECK_SECONDS
+)
+
+def load_alert_engine():
+    # Waktu data terakhir per box dari semua shard (box yang sedang dipindah bisa ada di dua shard)
+    last_seen = {}
+    for part in shard_router.fan_out(lambda conn, shard: read_last_seen(conn)):
+        for box_id, seen in part.items():
+            last_seen[box_id] = max(seen, last_seen.get(box_id, seen))
+    conn = get_db_connection()
+    try:
+        count = alert_engine.load(conn, last_seen)
+        log.info("alert engine loaded", active_alerts=count)
+    finally:
+        conn.close()
+
+# Peran proses ini, diisi start_services() (lihat SECTION 6).
+# owner = menjalankan tugas tunggal: evaluasi & simpan alert, retention, (embedded) MQTT.
+# Default True: skrip yang memakai modul ini langsung (mis. benchmark) tetap mengevaluasi alert
+service_state = {"started": False, "draining": False, "role": None, "owner": True}
+
+def publish_ingested_rows(rows: list):
+    """Baris yang sudah di-commit -> cache, stream SSE, alert engine."""
+    # Reading terlambat (timestamp lebih lama dari data terakhir box) tetap
+    # tersimpan & di-stream, tetapi tidak mengubah data terakhir / state alert
+    fresh = latest_cache.update_many(rows)
+    response_cache.invalidate({row['box_id'] for row in rows})
+    telemetry_broker.publish(rows)
+    if not service_state["owner"] or not fresh:
+        # Alert dievaluasi & disimpan leader; worker ini mengikuti alert_events
+        return
+    try:
+        # Batch sudah tersimpan: error di alert tidak boleh membuat batch diulang
+        alert_engine.process(fresh)
+    except Exception:
+        log.exception("alert evaluation failed", rows=len(rows))
+
+def publish_committed_rows(rows: list):
+    """publish_ingested_rows untuk baris yang sudah di-commit writer ingest."""
+    try:
+        publish_ingested_rows(rows)
+    except Exception:
+        # Jangan sampai ke retry pipeline: baris tanpa seq akan di-insert dua kali
+        log.exception("publishing ingested rows failed", rows=len(rows))
+
+def write_ingest_batch(payloads: list):
+    """Dipanggil writer ingest: simpan batch lalu teruskan ke cache / stream / alert."""
+    try:
+        rows = store_sensor_batch(payloads)
+    except PartialWriteError as e:
+        # Baris shard yang sudah commit tetap diteruskan; sisanya diulang pipeline
+        publish_committed_rows(e.stored)
+        raise
+    publish_committed_rows(rows)
+
+# Reading ber-seq diurutkan per box sebelum ditulis (celah seq ditunggu sebentar)
+ingest_reorder = ReorderBuffer(
+    window=INGEST_REORDER_WINDOW,
+    max_pending=INGEST_REORDER_MAX_PENDING
+) if INGEST_REORDER_WINDOW > 0 else None
+
+# Validasi skema/rentang, box terdaftar & rate limit per box sebelum enqueue
+def load_known_boxes():
+    conn = get_db_connection()
+    try:
+        return [row['box_id'] for row in conn.execute("SELECT box_id FROM box_ownership")]
+    finally:
+        conn.close()
+
+# Pola yang sama dipakai register_box: box yang terdaftar pasti lolos guard
+box_id_re = re.compile(INGEST_BOX_ID_PATTERN)
+validate_reading = compile_validator(
+    {**DEFAULT_RANGES, "temperature": (INGEST_TEMP_MIN, INGEST_TEMP_MAX)},
+    box_id_pattern=box_id_re
+)
+ingest_guard = IngestGuard(
+    validate_reading,
+    known_boxes=KnownBoxes(load_known_boxes, ttl=INGEST_KNOWN_BOX_TTL) if INGEST_REQUIRE_KNOWN_BOX else None,
+    rate=INGEST_BOX_RATE,
+    burst=INGEST_BOX_BURST,
+    max_readings=INGEST_MAX_READINGS_PER_MESSAGE,
+    max_payload_bytes=INGEST_MAX_PAYLOAD_BYTES,
+    quarantine_size=INGEST_QUARANTINE_SIZE
+)
+
+# Pipeline ingest: on_message hanya enqueue, writer thread yang menulis ke DB
+ingest_pipeline = IngestPipeline(
+    write_ingest_batch,
+    max_queue=INGEST_QUEUE_SIZE,
+    batch_size=INGEST_BATCH_SIZE,
+    flush_interval=INGEST_FLUSH_INTERVAL,
+    on_batch=observe_ingest_batch,
+    reorder=ingest_reorder,
+    retry_backoff=INGEST_RETRY_BACKOFF,
+    max_retry_backoff=INGEST_RETRY_MAX_BACKOFF
+)
+
+# Mode external: ikuti baris baru yang ditulis ingest_service.py (dari semua shard).
+# Id hanya berurutan sesuai commit di dalam satu shard, jadi cursor-nya per shard
+def fetch_rows_after(cursors: dict, limit: int) -> dict:
+    def fetch(conn, shard):
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM smartbox_data WHERE id > ? ORDER BY id LIMIT ?",
+                       (cursors.get(shard.index, 0), limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+    return dict(enumerate(shard_router.fan_out(fetch)))
+
+def current_max_ids() -> list:
+    """Id terbesar yang sudah di-commit, per shard."""
+    return shard_router.fan_out(
+        lambda conn, shard: conn.execute("SELECT IFNULL(MAX(id), 0) FROM smartbox_data").fetchone()[0]
+    )
+
+ingest_follower = IngestFollower(
+    fetch_rows_after,
+    publish_ingested_rows,
+    interval=INGEST_FOLLOW_INTERVAL
+)
+
+# Worker non-leader: ikuti alert_events yang disimpan leader
+# (satu tabel di database utama: satu partisi)
+def fetch_alert_events_after(cursors: dict, limit: int) -> dict:
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM alert_events WHERE id > ? ORDER BY id LIMIT ?", (cursors.get(0, 0), limit))
+        return {0: [dict(row) for row in cursor.fetchall()]}
+    finally:
+        conn.close()
+
+def current_max_alert_event_id() -> int:
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT IFNULL(MAX(id), 0) FROM alert_events").fetchone()[0]
+    finally:
+        conn.close()
+
+def publish_alert_events(events: list):
+    alert_engine.apply_events(events)
+    alert_broker.publish(events)
+
+alert_follower = IngestFollower(
+    fetch_alert_events_after,
+    publish_alert_events,
+    interval=INGEST_FOLLOW_INTERVAL
+)
 
 # ==============================================================================
 # SECTION 4: MQTT CLIENT
 # ==============================================================================
+mqtt_client = None
+mqtt_state = {"connected": False}
+
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("Connected to MQTT Broker!")
+        mqtt_state["connected"] = True
+        log.info("connected to mqtt broker", broker=MQTT_BROKER, topic=MQTT_TOPIC)
         client.subscribe(MQTT_TOPIC)
     else:
-        print(f"Failed to connect to MQTT: {rc}")
+        log.error("mqtt connect failed", rc=rc)
+
+def on_disconnect(client, userdata, rc):
+    mqtt_state["connected"] = False
+    if rc != 0:
+        log.warning("mqtt connection lost, reconnecting", rc=rc)
 
 def on_message(client, userdata, msg):
+    # Payload JSON atau biner (lihat payload_codec.py), satu pesan bisa berisi batch reading
+    fmt = "binary" if is_binary_payload(msg.payload) else "json"
+    MQTT_PAYLOAD_BYTES.inc(len(msg.payload), format=fmt)
+    if ingest_guard.check_size(len(msg.payload)):
+        MQTT_MESSAGES.inc(format=fmt, result="rejected")
+        INGEST_REJECTED.inc(reason="oversize")
+        return
     try:
-        payload = json.loads(msg.payload.decode())
-        store_sensor_data(payload)
-    except Exception as e:
-        print(f"Error processing message: {e}")
+        readings = decode_payload(msg.payload)
+    except PayloadError as e:
+        # Pesan rusak bisa datang beruntun: log dibatasi oleh rate limiter
+        MQTT_MESSAGES.inc(format=fmt, result="invalid")
+        log.warning("invalid mqtt payload", topic=msg.topic, format=fmt, error=str(e))
+        return
+    MQTT_READINGS.inc(len(readings), format=fmt)
+    # Sampah / box tak dikenal / banjir dari satu box berhenti di sini, tanpa kerja DB
+    readings, rejected = ingest_guard.filter(readings)
+    for reason, count in rejected.items():
+        INGEST_REJECTED.inc(count, reason=reason)
+    if not readings:
+        MQTT_MESSAGES.inc(format=fmt, result="rejected")
+        return
+    dropped = 0
+    for payload in readings:
+        if not ingest_pipeline.submit(payload):
+            dropped += 1
+    if dropped:
+        MQTT_MESSAGES.inc(format=fmt, result="dropped")
+        log.warning("ingest queue full, readings dropped", box_id=readings[0].get("box_id"), dropped=dropped)
+    else:
+        MQTT_MESSAGES.inc(format=fmt, result="queued")
 
 def start_mqtt_listener():
-    client = mqtt.Client(client_id=f"smartbox-backend-{int(time.time())}")
+    """Client MQTT di thread network paho (reconnect otomatis, termasuk koneksi pertama)."""
+    global mqtt_client
+    if mqtt_client is not None:
+        return
+    client = mqtt.Client(client_id=f"smartbox-backend-{os.getpid()}-{int(time.time())}")
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
     client.on_message = on_message
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_forever()
-    except Exception as e:
-        print(f"MQTT Listener Error: {e}")
+    client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+    mqtt_client = client
+
+def stop_mqtt_listener():
+    """Berhenti menerima pesan baru (langkah pertama graceful shutdown)."""
+    global mqtt_client
+    client, mqtt_client = mqtt_client, None
+    if client is None:
+        return
+    client.disconnect()
+    client.loop_stop()
+    mqtt_state["connected"] = False
 
 # ==============================================================================
 # SECTION 5: API SERVER (FLASK)
 # ==============================================================================
 app = Flask(__name__)
-CORS(app)
+# ETag/Last-Modified perlu dibaca apiFetch (cross-origin) untuk request berikutnya
+CORS(app, expose_headers=["ETag", "Last-Modified"])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_seconds = 0.0
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        # Label route = pola URL (/api/data/<box_id>), bukan path mentah,
+        # agar jumlah seri metrics tidak bertambah per box
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        HTTP_DURATION.observe(time.perf_counter() - started, route=route, method=request.method)
+        HTTP_DB_TIME.observe(g.get("db_seconds", 0.0), route=route)
+    return response
+
+# Claims token yang sudah diverifikasi di-cache sampai TTL / exp token
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+def load_owned_boxes(user_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT box_id FROM box_ownership WHERE user_id = ?", (user_id,))
+        return [row['box_id'] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+# Box milik user; di-invalidate oleh register_box
+ownership_cache = OwnershipCache(load_owned_boxes, max_size=OWNERSHIP_CACHE_SIZE, ttl=OWNERSHIP_CACHE_TTL)
+
+def verify_token(token):
+    return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
 
 # Helper untuk memvalidasi token dan ambil user_id
 def decode_token(auth_header):
@@ -179,25 +863,219 @@ def decode_token(auth_header):
         return None
     try:
         token = auth_header.split(" ")[1] # Format: "Bearer <token>"
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload 
+        payload = token_cache.get_or_decode(token, verify_token)
+    except jwt.ExpiredSignatureError:
+        JWT_FAILURES.inc(reason="expired")
+        return None
     except Exception:
+        JWT_FAILURES.inc(reason="invalid")
         return None
+    # Token URL (punya claim purpose) tidak berlaku sebagai token sesi
+    if payload.get('purpose'):
+        JWT_FAILURES.inc(reason="invalid")
+        return None
+    return payload
+
+def decode_request_token(purpose=None, box_id=None):
+    """
+    Header Authorization (token sesi). EventSource / link download tidak bisa
+    mengirim header: untuk `purpose` tersebut ?token= berisi token URL berumur
+    pendek dari /api/auth/url-token, bukan token sesi (URL tercatat di log,
+    proxy dan riwayat browser).
+    """
+    auth_header = request.headers.get('Authorization')
+    token = request.args.get('token')
+    if auth_header or purpose is None or not token:
+        return decode_token(auth_header)
+    try:
+        payload = verify_token(token)
+    except jwt.ExpiredSignatureError:
+        JWT_FAILURES.inc(reason="expired")
+        return None
+    except Exception:
+        JWT_FAILURES.inc(reason="invalid")
+        return None
+    if payload.get('purpose') != purpose or payload.get('box_id') != box_id:
+        JWT_FAILURES.inc(reason="invalid")
+        return None
+    return payload
+
+def admin_error():
+    """None jika request membawa JWT super admin, selain itu response 401 / 403."""
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+    if user_data.get('role') != 'super_admin':
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+def admin_required(view):
+    """Endpoint statistik / operasional: hanya super admin."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        error = admin_error()
+        if error is not None:
+            return error
+        return view(*args, **kwargs)
+    return wrapper
+
+def metrics_token_valid(auth_header) -> bool:
+    if not METRICS_TOKEN or not auth_header:
+        return False
+    return hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+def owned_boxes(user_data) -> frozenset:
+    return ownership_cache.boxes(user_data['user_id'])
+
+def can_access_box(user_data, box_id) -> bool:
+    return user_data.get('role') == 'super_admin' or box_id in owned_boxes(user_data)
+
+def authorize_box(box_id, purpose=None):
+    """Return (user_data, None) jika boleh, atau (None, response error) untuk di-return route."""
+    user_data = decode_request_token(purpose, box_id if purpose else None)
+    if not user_data:
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    if not can_access_box(user_data, box_id):
+        return None, (jsonify({"error": "Forbidden"}), 403)
+    return user_data, None
+
+def encode_response(response, body: bytes, encode=compress):
+    """Isi body, terkompresi (br/gzip) jika cukup besar dan diterima client."""
+    encoding = None
+    if len(body) >= HTTP_COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        response.set_data(body)
+    else:
+        response.set_data(encode(body, encoding))
+        response.headers.set("Content-Encoding", encoding)
+    return response
+
+def cached_json(key, version, build, tags=()):
+    """
+    Response JSON dengan ETag dari versi data (id baris terakhir, dst).
+    If-None-Match cocok -> 304 tanpa body. Body (dan versi terkompresinya)
+    disimpan di response_cache; build() hanya dipanggil saat cache miss.
+    version: (max_id, timestamp terbaru, jumlah box) dari latest_cache.
+    """
+    max_id, latest, count = version
+    etag = make_etag(max_id, count)
+    last_modified = None
+    if latest:
+        try:
+            last_modified = parse_timestamp(latest)
+        except ValueError:
+            pass
+
+    if_none_match = request.headers.get('If-None-Match')
+    not_modified = etag_matches(if_none_match, etag)
+    if not if_none_match and last_modified is not None and request.if_modified_since is not None:
+        not_modified = last_modified <= request.if_modified_since.timestamp()
+
+    if not_modified:
+        response_cache.count_not_modified()
+        response = Response(status=304)
+    else:
+        entry = response_cache.get(key, etag)
+        if entry is None:
+            entry = CachedResponse(app.json.dumps(build()).encode(), etag, last_modified)
+            response_cache.put(key, entry, tags)
+        response = encode_response(Response(mimetype='application/json'), entry.body,
+                                   lambda body, encoding: entry.encoded(encoding))
+    response.headers.set("ETag", etag)
+    if last_modified is not None:
+        response.headers.set("Last-Modified", http_date(last_modified))
+    # Data per user: jangan disimpan cache bersama; browser wajib revalidasi
+    response.headers.set("Cache-Control", "private, no-cache")
+    response.vary.add("Authorization")
+    return response
+
+@app.after_request
+def compress_json_response(response):
+    """Kompresi response JSON besar lain yang tidak lewat cached_json."""
+    if (response.status_code == 200 and response.mimetype == 'application/json'
+            and not response.is_streamed and not response.direct_passthrough
+            and 'Accept-Encoding' not in response.vary):
+        body = response.get_data()
+        if len(body) >= HTTP_COMPRESS_MIN_BYTES:
+            response = encode_response(response, body)
+    return response
 
 # --- ENDPOINT DATA UMUM ---
 
 @app.route('/api/data/<string:box_id>', methods=['GET'])
 def get_data_by_box_id(box_id: str):
+    _, error = authorize_box(box_id)
+    if error:
+        return error
     limit = request.args.get('limit', 100, type=int)
-    conn = None
+
+    # Polling dashboard (limit=1) dilayani dari cache tanpa menyentuh SQLite
+    if limit == 1:
+        cached = latest_cache.get(box_id)
+        if cached is not None:
+            return cached_json(f"data:{box_id}:1", latest_cache.version([box_id]), lambda: [cached], tags=[box_id])
+
+    if latest_cache.is_warm:
+        # ETag dari id baris terakhir box: polling tanpa data baru -> 304
+        try:
+            return cached_json(f"data:{box_id}:{limit}", latest_cache.version([box_id]),
+                               lambda: query_box_data(box_id, limit), tags=[box_id])
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    try:
+        data = query_box_data(box_id, limit)
+        if limit == 1 and data:
+            latest_cache.update_many(data)
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def query_box_data(box_id: str, limit: int) -> list:
+    conn, shard = shard_router.connection_for(box_id)
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
             "SELECT * FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC LIMIT ?",
             (box_id, limit)
         )
         data = [dict(row) for row in cursor.fetchall()]
+
+        # Data panas kurang dari limit: lanjutkan ke partisi lama (terbaru dulu)
+        if len(data) < limit and shard.partitions.has_partitions():
+            data.extend(shard.partitions.query_newest_first(
+                "SELECT * FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (box_id,), limit - len(data)
+            ))
+        return data
+    finally:
+        conn.close()
+
+@app.route('/api/history/<string:box_id>', methods=['GET'])
+def get_history_by_box_id(box_id: str):
+    """
+    Riwayat teragregasi per bucket waktu dari tabel rollup.
+    ?resolution=1m|15m|1h|1d, ?start= & ?end= (epoch atau 'YYYY-MM-DD HH:MM:SS' UTC).
+    Default: 24 jam terakhir.
+    """
+    _, error = authorize_box(box_id)
+    if error:
+        return error
+    resolution = request.args.get('resolution', '15m')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"error": f"resolution harus salah satu dari: {', '.join(RESOLUTIONS)}"}), 400
+    try:
+        end = parse_timestamp(request.args['end']) if request.args.get('end') else int(time.time())
+        start = parse_timestamp(request.args['start']) if request.args.get('start') else end - 24 * 60 * 60
+    except ValueError:
+        return jsonify({"error": "Format start/end tidak valid"}), 400
+
+    conn = None
+    try:
+        conn, _ = shard_router.connection_for(box_id)
+        data = query_rollups(conn, box_id, resolution, start, end)
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -290,6 +1168,36 @@ def login_user():
     finally:
         if conn: conn.close()
 
+@app.route('/api/auth/url-token', methods=['POST'])
+def issue_url_token():
+    """
+    Token berumur pendek (URL_TOKEN_TTL detik) untuk URL yang dibuka tanpa
+    header Authorization. Body: {"purpose": "stream"} untuk EventSource, atau
+    {"purpose": "export", "box_id": ...} untuk link download satu box.
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    purpose = data.get('purpose')
+    box_id = data.get('box_id') if purpose == 'export' else None
+    if purpose not in ('stream', 'export') or (purpose == 'export' and not isinstance(box_id, str)):
+        return jsonify({"error": "purpose harus 'stream' atau 'export' (dengan box_id)"}), 400
+    if box_id is not None and not can_access_box(user_data, box_id):
+        return jsonify({"error": "Forbidden"}), 403
+
+    token_payload = {
+        'user_id': user_data['user_id'],
+        'username': user_data.get('username'),
+        'role': user_data.get('role'),
+        'purpose': purpose,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=URL_TOKEN_TTL),
+    }
+    if box_id is not None:
+        token_payload['box_id'] = box_id
+    token = jwt.encode(token_payload, JWT_SECRET, algorithm="HS256")
+    return jsonify({"token": token, "expires_in": URL_TOKEN_TTL})
+
 # --- ENDPOINT MITRA (NEW: BOX REGISTRATION & DASHBOARD) ---
 
 @app.route('/api/register-box', methods=['POST'])
@@ -305,6 +1213,9 @@ def register_box():
 
     if not box_id:
         return jsonify({"error": "Box ID is required"}), 400
+    # Box ID yang ditolak ingest guard (invalid_box_id) tidak akan pernah menerima data
+    if not isinstance(box_id, str) or box_id_re.fullmatch(box_id) is None:
+        return jsonify({"error": f"Box ID tidak valid, harus sesuai pola {INGEST_BOX_ID_PATTERN}"}), 400
 
     conn = None
     try:
@@ -324,6 +1235,12 @@ def register_box():
             (user_data['user_id'], box_id, label)
         )
         conn.commit()
+        ownership_cache.invalidate(user_data['user_id'])
+        alert_engine.set_owner(box_id, user_data['user_id'])
+        # Shard box yang belum punya data kini mengikuti owner barunya
+        shard_router.invalidate([box_id])
+        if ingest_guard.known_boxes is not None:
+            ingest_guard.known_boxes.add(box_id)
         
         return jsonify({"message": f"SmartBox {box_id} berhasil didaftarkan!"}), 201
 
@@ -332,6 +1249,13 @@ def register_box():
     finally:
         if conn: conn.close()
 
+DASHBOARD_QUERY = """
+    SELECT * FROM smartbox_data
+    WHERE box_id IN (SELECT value FROM json_each(?))
+    ORDER BY timestamp DESC
+    LIMIT 100
+"""
+
 @app.route('/api/my-dashboard-data', methods=['GET'])
 def get_my_dashboard_data():
     # 1. Cek Login
@@ -339,40 +1263,525 @@ def get_my_dashboard_data():
     if not user_data:
         return jsonify({"error": "Unauthorized"}), 401
     
+    try:
+        # 2. Ambil daftar Box ID milik user ini (dari cache kepemilikan)
+        box_ids = sorted(owned_boxes(user_data))
+        
+        if not box_ids:
+            return jsonify([]) # Belum punya box
+
+        # 3. Query data sensor HANYA dari box_ids tersebut (per shard, paralel).
+        # Daftar box dikirim sebagai satu parameter JSON: SQL konstan, prepared statement di-cache
+        def query(conn, shard, shard_box_ids):
+            cursor = conn.cursor()
+            cursor.execute(DASHBOARD_QUERY, (json.dumps(shard_box_ids),))
+            return [dict(row) for row in cursor.fetchall()]
+
+        def build():
+            rows = [row for part in shard_router.fan_out_boxes(box_ids, query) for row in part]
+            rows.sort(key=lambda row: row['timestamp'] or '', reverse=True)
+            return rows[:100]
+
+        if not latest_cache.is_warm:
+            return jsonify(build())
+        # ETag berubah jika salah satu box menerima data baru atau box bertambah
+        max_id, latest, _ = latest_cache.version(box_ids)
+        return cached_json(f"dashboard:{user_data['user_id']}", (max_id, latest, len(box_ids)),
+                           build, tags=box_ids)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Baris terakhir per box untuk daftar box (dikirim sebagai satu parameter
+# JSON agar SQL-nya konstan dan prepared statement-nya bisa di-cache)
+LATEST_PER_BOX_QUERY = """
+    SELECT d.* FROM json_each(?) AS b
+    JOIN smartbox_data d ON d.id = (
+        SELECT id FROM smartbox_data
+        WHERE box_id = b.value
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    )
+"""
+FLEET_MAX_BOXES = 1000
+
+@app.route('/api/fleet/latest', methods=['GET'])
+def get_fleet_latest():
+    """
+    Data terakhir semua box milik user (atau ?box_ids=A,B,C) dalam satu response.
+    ?since=<cursor> hanya mengembalikan box yang punya data baru setelah cursor
+    (id terakhir per shard, format sama dengan event id stream telemetry).
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    since = parse_cursor(request.args.get('since'), shard_router.count) or [0] * shard_router.count
+    box_ids_param = request.args.get('box_ids')
+
+    try:
+        if box_ids_param:
+            box_ids = list(dict.fromkeys(b.strip() for b in box_ids_param.split(',') if b.strip()))
+            if user_data.get('role') != 'super_admin':
+                owned = owned_boxes(user_data)
+                box_ids = [b for b in box_ids if b in owned]
+        else:
+            box_ids = sorted(owned_boxes(user_data))
+
+        if len(box_ids) > FLEET_MAX_BOXES:
+            return jsonify({"error": f"Maksimal {FLEET_MAX_BOXES} box per request"}), 400
+
+        # 1. Ambil dari cache; sisanya (miss) dari DB dalam satu query
+        latest = {}
+        missing = []
+        for box_id in box_ids:
+            row = latest_cache.get(box_id)
+            if row is not None:
+                latest[box_id] = row
+            else:
+                missing.append(box_id)
+
+        if missing:
+            parts = shard_router.fan_out_boxes(missing, lambda conn, shard, shard_box_ids: [
+                dict(row) for row in conn.execute(LATEST_PER_BOX_QUERY, (json.dumps(shard_box_ids),))
+            ])
+            rows = [row for part in parts for row in part]
+            latest_cache.update_many(rows)
+            for row in rows:
+                latest[row['box_id']] = row
+
+        # 2. Cursor = id terbesar per shard dari semua data terakhir yang diketahui
+        # (id hanya berurutan di dalam satu shard, lihat telemetry_stream.py)
+        rows = [latest[b] for b in box_ids if b in latest]
+        next_cursor = list(since)
+        data = []
+        for row, shard in zip(rows, row_shards(rows)):
+            if row['id'] > since[shard]:
+                data.append(row)
+            next_cursor[shard] = max(next_cursor[shard], row['id'])
+
+        return jsonify({"data": data, "cursor": format_cursor(next_cursor)})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- ENDPOINT SPASIAL (PETA ARMADA) ---
+
+def parse_bbox(value):
+    """'min_lon,min_lat,max_lon,max_lat' (urutan Leaflet toBBoxString) -> tuple float."""
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox harus 4 angka")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise ValueError("bbox di luar jangkauan")
+    return min_lat, min_lon, max_lat, max_lon
+
+def with_latest_readings(rows):
+    """Lengkapi posisi dengan suhu/kelembapan terakhir dari cache (untuk popup peta)."""
+    for row in rows:
+        cached = latest_cache.get(row['box_id'])
+        if cached is not None:
+            row['temperature'] = cached.get('temperature')
+            row['humidity'] = cached.get('humidity')
+    return rows
+
+def spatial_scope(user_data):
+    """Filter query spasial: ?box_ids= (opsional) + kepemilikan box untuk mitra."""
+    owner_id = None if user_data.get('role') == 'super_admin' else user_data['user_id']
+    allowed = parse_box_ids_param()
+    if owner_id is not None and shard_router.count > 1:
+        # box_ownership hanya ada di database utama: file shard difilter lewat daftar box milik user
+        owned = owned_boxes(user_data)
+        return {"allowed": owned & allowed if allowed is not None else owned, "owner_id": None}
+    return {"allowed": allowed, "owner_id": owner_id}
+
+def query_positions(query):
+    """query(conn) di semua shard; satu posisi per box (yang terbaru jika box sedang dipindah)."""
+    latest = {}
+    for part in shard_router.fan_out(lambda conn, shard: query(conn)):
+        for row in part:
+            current = latest.get(row['box_id'])
+            if current is None or (row['timestamp'] or '', row['reading_id']) > (current['timestamp'] or '', current['reading_id']):
+                latest[row['box_id']] = row
+    return list(latest.values())
+
+@app.route('/api/fleet/positions', methods=['GET'])
+def get_fleet_positions():
+    """
+    Posisi terakhir box (milik user) di dalam viewport peta.
+    ?bbox=min_lon,min_lat,max_lon,max_lat, opsional ?box_ids=A,B,C & ?limit=.
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        bbox = parse_bbox(request.args.get('bbox', ''))
+    except ValueError as e:
+        return jsonify({"error": f"bbox tidak valid: {e}"}), 400
+    limit = min(request.args.get('limit', SPATIAL_MAX_RESULTS, type=int), SPATIAL_MAX_RESULTS)
+
+    try:
+        scope = spatial_scope(user_data)
+        rows = query_positions(lambda conn: query_bbox(conn, *bbox, **scope, limit=limit + 1))
+        rows.sort(key=lambda row: row['box_id'])
+        return jsonify({"data": with_latest_readings(rows[:limit]), "truncated": len(rows) > limit})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/fleet/nearby', methods=['GET'])
+def get_fleet_nearby():
+    """Box dalam radius dari satu titik, terdekat dulu. ?lat= & ?lon= & ?radius_m= (default 1000)."""
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_m = request.args.get('radius_m', 1000, type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat/lon wajib diisi dan harus valid"}), 400
+    if radius_m is None or not 0 < radius_m <= 1000000:
+        return jsonify({"error": "radius_m harus 0 - 1000000"}), 400
+    limit = min(request.args.get('limit', 100, type=int), SPATIAL_MAX_RESULTS)
+
+    try:
+        scope = spatial_scope(user_data)
+        rows = query_positions(lambda conn: query_nearby(conn, lat, lon, radius_m, **scope, limit=limit))
+        rows.sort(key=lambda row: row['distance_m'])
+        return jsonify({"data": with_latest_readings(rows[:limit])})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/track/<string:box_id>', methods=['GET'])
+def get_track(box_id: str):
+    """
+    Polyline perjalanan box yang sudah disederhanakan (Douglas-Peucker).
+    ?start= & ?end= (default 24 jam terakhir), ?tolerance_m=, ?max_points=.
+    """
+    _, error = authorize_box(box_id)
+    if error:
+        return error
+    try:
+        end = parse_timestamp(request.args['end']) if request.args.get('end') else int(time.time())
+        start = parse_timestamp(request.args['start']) if request.args.get('start') else end - 24 * 60 * 60
+    except ValueError:
+        return jsonify({"error": "Format start/end tidak valid"}), 400
+    tolerance_m = max(0.0, request.args.get('tolerance_m', TRACK_TOLERANCE_M, type=float))
+    max_points = min(max(2, request.args.get('max_points', TRACK_MAX_POINTS, type=int)), TRACK_MAX_POINTS)
+
+    query = """
+        SELECT latitude, longitude, timestamp FROM smartbox_data
+        WHERE box_id = ? AND timestamp >= ? AND timestamp <= ?
+          AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY timestamp, id
+    """
+    params = [box_id, format_timestamp(start), format_timestamp(end)]
+
+    conn = None
+    cursor = None
+    try:
+        conn, shard = shard_router.connection_for(box_id)
+        hot_cursor = conn.cursor()
+        hot_cursor.row_factory = None
+        hot_cursor.execute(query, params)
+        # Partisi lama dulu (terlama -> terbaru), lalu data panas
+        cursor = ChainedCursor(
+            shard.partitions.cursor_factories(query, params, newest_first=False) + [lambda: (hot_cursor, None)],
+            row_factory=None
+        )
+        points = []
+        for row in iter_rows(cursor):
+            points.append(tuple(row))
+            if len(points) >= TRACK_MAX_RAW_POINTS:
+                break
+        truncated = len(points) >= TRACK_MAX_RAW_POINTS
+        simplified, tolerance_m = simplify_track(points, tolerance_m, max_points)
+        return jsonify({
+            "box_id": box_id,
+            "points": [{"latitude": lat, "longitude": lon, "timestamp": ts} for lat, lon, ts in simplified],
+            "raw_points": len(points),
+            "tolerance_m": tolerance_m,
+            "truncated": truncated,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cursor is not None: cursor.close()
+        if conn: conn.close()
+
+# --- ENDPOINT STREAM (SERVER-SENT EVENTS) ---
+
+def parse_last_event_id(partitions=1):
+    """Last-Event-ID -> list id terakhir per partisi (shard), None jika tidak ada."""
+    return parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'), partitions)
+
+def resolve_allowed_boxes(user_data, requested):
+    """Super admin: semua box (None) atau yang diminta; mitra: hanya box miliknya."""
+    if user_data.get('role') == 'super_admin':
+        return requested
+    owned = set(owned_boxes(user_data))
+    return owned & requested if requested is not None else owned
+
+def sse_response(broker, sub, backlog, position, allowed, event):
+    """
+    backlog & event broker berupa (partisi, baris). position = id terakhir
+    per partisi yang sudah dimiliki client; event id = position setelah baris itu.
+    """
+    def generate():
+        last = list(position)
+        # Baris resume dari DB bisa juga muncul di antrian live (dibaca setelah subscribe)
+        sent = {row['id'] for _, row in backlog}
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse({"box_ids": sorted(allowed) if allowed is not None else None}, event="ready")
+            for key, row in backlog:
+                last[key] = max(last[key], row['id'])
+                yield format_sse(row, event=event, event_id=format_cursor(last))
+            while True:
+                events = sub.wait(STREAM_KEEPALIVE_SECONDS)
+                if sub.evicted or sub.closed:
+                    # Client terlalu lambat / worker shutdown: tutup stream, EventSource
+                    # akan reconnect otomatis (ke worker lain) dengan Last-Event-ID
+                    yield format_sse({"reason": "slow_consumer" if sub.evicted else "shutdown"}, event="evicted")
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                chunk = []
+                for key, row in events:
+                    # Bukan filter id > posisi: baris shard lain boleh datang dengan id lebih kecil
+                    if sent and row['id'] in sent:
+                        sent.discard(row['id'])
+                        continue
+                    last[key] = max(last[key], row['id'])
+                    chunk.append(format_sse(row, event=event, event_id=format_cursor(last)))
+                if chunk:
+                    yield "".join(chunk)
+        finally:
+            broker.unsubscribe(sub)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers.set("Cache-Control", "no-cache")
+    response.headers.set("X-Accel-Buffering", "no")
+    return response
+
+def query_resume_rows(conn, table, allowed, last_event_id):
+    """Baris id > last_event_id dari DB (satu partisi) untuk client yang reconnect."""
+    cursor = conn.cursor()
+    if allowed is None:
+        cursor.execute(
+            f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_event_id, STREAM_RESUME_LIMIT)
+        )
+    else:
+        cursor.execute(
+            f"SELECT * FROM {table} WHERE id > ? AND box_id IN (SELECT value FROM json_each(?)) ORDER BY id LIMIT ?",
+            (last_event_id, json.dumps(sorted(allowed)), STREAM_RESUME_LIMIT)
+        )
+    return [dict(row) for row in cursor.fetchall()]
+
+def resume_from_db(from_db, backlog):
+    """Gabungkan backlog broker dengan event (partisi, baris) dari DB, dedup per id."""
+    return sorted({event[1]['id']: event for event in from_db + backlog}.values(), key=lambda e: e[1]['id'])
+
+def parse_box_ids_param():
+    box_ids_param = request.args.get('box_ids')
+    return {b.strip() for b in box_ids_param.split(',') if b.strip()} if box_ids_param else None
+
+@app.route('/api/stream/telemetry', methods=['GET'])
+def stream_telemetry():
+    """
+    Stream data baru secara push (SSE). Filter ?box_ids=A,B opsional.
+    Super admin menerima semua box; mitra hanya box miliknya (box_ownership).
+    """
+    user_data = decode_request_token("stream")
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    requested = parse_box_ids_param()
+    cursor = parse_last_event_id(shard_router.count)
+
+    try:
+        allowed = resolve_allowed_boxes(user_data, requested)
+
+        # Daftar dulu ke broker, baru baca DB: data yang masuk di antaranya
+        # akan muncul di dua tempat dan di-dedup lewat id, tidak ada yang hilang
+        sub, backlog, missing = telemetry_broker.subscribe(allowed, cursor)
+        if cursor is None:
+            # Client baru: posisi awal per shard = data yang sudah di-commit
+            cursor = current_max_ids() if shard_router.count > 1 else [0]
+        elif missing and (allowed is None or allowed):
+            # Hanya shard yang tidak tercakup history broker yang dibaca dari DB
+            parts = shard_router.fan_out(
+                lambda conn, shard: [(shard.index, row) for row in
+                                     query_resume_rows(conn, "smartbox_data", allowed, cursor[shard.index])],
+                missing)
+            from_db = sorted((event for part in parts for event in part), key=lambda e: e[1]['id'])
+            backlog = resume_from_db(from_db[:STREAM_RESUME_LIMIT], backlog)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return sse_response(telemetry_broker, sub, backlog, cursor, allowed, "reading")
+
+@app.route('/api/admin/stream-stats', methods=['GET'])
+@admin_required
+def get_stream_stats():
+    return jsonify(telemetry_broker.stats())
+
+# --- ENDPOINT ALERT ---
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """
+    ?active=1 -> alert yang sedang aktif (dari memori engine).
+    Tanpa active -> riwayat perubahan state, ?since=<id> untuk polling inkremental.
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    requested = parse_box_ids_param()
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), ALERT_QUERY_LIMIT)
+
     conn = None
     try:
         conn = get_db_connection()
+        allowed = resolve_allowed_boxes(user_data, requested)
+
+        if request.args.get('active') in ('1', 'true'):
+            data = alert_engine.active(allowed)
+            cursor_id = max([since] + [e['id'] for e in data if e['id'] is not None])
+            return jsonify({"data": data, "cursor": cursor_id})
+
         cursor = conn.cursor()
+        if allowed is None:
+            cursor.execute(
+                "SELECT * FROM alert_events WHERE id > ? ORDER BY id LIMIT ?",
+                (since, limit)
+            )
+        else:
+            cursor.execute(
+                "SELECT * FROM alert_events WHERE id > ? AND box_id IN (SELECT value FROM json_each(?)) ORDER BY id LIMIT ?",
+                (since, json.dumps(sorted(allowed)), limit)
+            )
+        data = [dict(row) for row in cursor.fetchall()]
+        cursor_id = data[-1]['id'] if data else since
+        return jsonify({"data": data, "cursor": cursor_id})
 
-        # 2. Ambil daftar Box ID milik user ini
-        cursor.execute("SELECT box_id, label FROM box_ownership WHERE user_id = ?", (user_data['user_id'],))
-        my_boxes = cursor.fetchall()
-        
-        if not my_boxes:
-            return jsonify([]) # Belum punya box
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: conn.close()
 
-        # List of box_ids: ['SMARTBOX-001', 'SMARTBOX-002']
-        box_ids = [row['box_id'] for row in my_boxes]
-        
-        # 3. Query data sensor HANYA dari box_ids tersebut
-        placeholders = ','.join('?' for _ in box_ids)
-        query = f"""
-            SELECT * FROM smartbox_data 
-            WHERE box_id IN ({placeholders}) 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-        """
-        
-        cursor.execute(query, tuple(box_ids))
-        sensor_data = [dict(row) for row in cursor.fetchall()]
+@app.route('/api/stream/alerts', methods=['GET'])
+def stream_alerts():
+    """Stream perubahan state alert (SSE), pola sama dengan /api/stream/telemetry."""
+    user_data = decode_request_token("stream")
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    requested = parse_box_ids_param()
+    cursor = parse_last_event_id()
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        allowed = resolve_allowed_boxes(user_data, requested)
+        sub, backlog, missing = alert_broker.subscribe(allowed, cursor)
+        if missing and (allowed is None or allowed):
+            from_db = [(0, row) for row in query_resume_rows(conn, "alert_events", allowed, cursor[0])]
+            backlog = resume_from_db(from_db, backlog)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: conn.close()
+
+    return sse_response(alert_broker, sub, backlog, cursor or [0], allowed, "alert")
+
+@app.route('/api/alert-rules', methods=['GET'])
+def get_alert_rules():
+    """Aturan alert efektif per box milik user (default < owner < box)."""
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    # Aturan dibaca dari cache alert_engine, tanpa koneksi DB
+    try:
+        allowed = resolve_allowed_boxes(user_data, parse_box_ids_param())
+        box_ids = sorted(allowed) if allowed is not None else latest_cache.box_ids()
+        return jsonify({
+            "defaults": alert_engine.defaults,
+            "boxes": {box_id: alert_engine.rule_for(box_id) for box_id in box_ids},
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/alert-rules', methods=['PUT'])
+def put_alert_rule():
+    """
+    Body: {"scope": "box"|"owner", "scope_id": ..., "temp_max": 5, ...}.
+    Nilai null = ikut aturan owner/default. Mitra hanya boleh mengatur box
+    miliknya dan aturan owner untuk dirinya sendiri.
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
 
-        return jsonify(sensor_data)
+    data = request.json or {}
+    scope = data.get('scope')
+    if scope not in ALERT_RULE_SCOPES:
+        return jsonify({"error": "scope harus 'box' atau 'owner'"}), 400
 
+    is_super = user_data.get('role') == 'super_admin'
+    scope_id = data.get('scope_id')
+    if scope == 'owner' and not is_super:
+        scope_id = user_data['user_id']
+    if scope_id is None or scope_id == '':
+        return jsonify({"error": "scope_id is required"}), 400
+    scope_id = str(scope_id)
+
+    try:
+        rule = {field: (float(data[field]) if data[field] is not None else None)
+                for field in ALERT_RULE_FIELDS if field in data}
+    except (TypeError, ValueError):
+        return jsonify({"error": "Nilai aturan harus berupa angka"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if scope == 'box' and not is_super and not can_access_box(user_data, scope_id):
+            return jsonify({"error": "Forbidden"}), 403
+
+        cursor.execute("SELECT * FROM alert_rules WHERE scope = ? AND scope_id = ?", (scope, scope_id))
+        existing = cursor.fetchone()
+        merged = {field: (existing[field] if existing else None) for field in ALERT_RULE_FIELDS}
+        merged.update(rule)
+
+        columns = ", ".join(ALERT_RULE_FIELDS)
+        placeholders = ", ".join("?" for _ in ALERT_RULE_FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in ALERT_RULE_FIELDS)
+        cursor.execute(f"""
+            INSERT INTO alert_rules (scope, scope_id, {columns}) VALUES (?, ?, {placeholders})
+            ON CONFLICT (scope, scope_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+        """, (scope, scope_id, *[merged[field] for field in ALERT_RULE_FIELDS]))
+        conn.commit()
+        alert_engine.set_rule(scope, scope_id, merged)
+
+        return jsonify({"scope": scope, "scope_id": scope_id, "rule": merged})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
 
+@app.route('/api/admin/alert-stats', methods=['GET'])
+@admin_required
+def get_alert_stats():
+    data = alert_engine.stats()
+    data["stream"] = alert_broker.stats()
+    return jsonify(data)
+
 # --- ENDPOINT SUPER ADMIN ---
 
 @app.route('/api/admin/users', methods=['GET'])
@@ -412,72 +1821,548 @@ def approve_user(user_id):
 
 @app.route('/api/admin/devices', methods=['GET'])
 def get_all_active_devices():
+    if latest_cache.is_warm:
+        # Daftar hanya berubah saat ada box baru: ETag dari jumlah box
+        _, _, count = latest_cache.version()
+        return cached_json("devices", (0, None, count), latest_cache.box_ids)
+
+    latest_cache.count_miss()
+    try:
+        # Scan index tiap shard paralel, lalu digabung
+        parts = shard_router.fan_out(lambda conn, shard: [
+            row['box_id'] for row in conn.execute("SELECT DISTINCT box_id FROM smartbox_data")
+        ])
+        device_ids = sorted({box_id for part in parts for box_id in part})
+        return jsonify(device_ids)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/ingest-stats', methods=['GET'])
+@admin_required
+def get_ingest_stats():
+    data = {"mode": INGEST_MODE, "role": service_state["role"]}
+    if ingest_follower.is_running():
+        return jsonify({**data, **ingest_follower.stats()})
+    return jsonify({**data, **ingest_pipeline.stats(), "guard": ingest_guard.stats()})
+
+@app.route('/api/admin/ingest-quarantine', methods=['GET'])
+@admin_required
+def get_ingest_quarantine():
+    """Box yang reading-nya ditolak (belum terdaftar / melebihi rate limit), terbaru dulu."""
+    limit = min(max(request.args.get('limit', 100, type=int), 0), INGEST_QUARANTINE_SIZE)
+    return jsonify({**ingest_guard.stats(), "boxes": ingest_guard.quarantine(limit)})
+
+@app.route('/api/admin/db-pool-stats', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    return jsonify({**db_pool.stats(), "export": shard_router.shards[0].export_pool.stats()})
+
+@app.route('/api/admin/shard-stats', methods=['GET'])
+@admin_required
+def get_shard_stats():
+    """Direktori & fan-out shard, jumlah box dan pool koneksi per shard."""
     conn = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT box_id FROM smartbox_data")
-        rows = cursor.fetchall()
-        device_ids = [row['box_id'] for row in rows]
-        return jsonify(device_ids)
+        boxes = dict(conn.execute("SELECT shard, COUNT(*) FROM box_shards GROUP BY shard").fetchall())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
+    data = shard_router.stats()
+    data["items"] = [
+        {"index": shard.index, "path": shard.path, "boxes": boxes.get(shard.index, 0), "pool": shard.pool.stats(),
+         "export_pool": shard.export_pool.stats()}
+        for shard in shard_router.shards
+    ]
+    return jsonify(data)
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    return jsonify(latest_cache.stats())
+
+@app.route('/api/admin/http-cache-stats', methods=['GET'])
+@admin_required
+def get_http_cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/api/admin/auth-cache-stats', methods=['GET'])
+@admin_required
+def get_auth_cache_stats():
+    return jsonify({"tokens": token_cache.stats(), "ownership": ownership_cache.stats()})
+
+EXPORT_HEADER = ('Waktu', 'Suhu (°C)', 'Kelembapan (%)', 'Latitude', 'Longitude')
+# Total byte export per snapshot, untuk header Content-Range request resume
+export_sizes = SizeCache()
+
+def export_busy_response():
+    """Semua koneksi export sedang dipakai download lain."""
+    response = jsonify({"error": "Terlalu banyak export berjalan, coba lagi sebentar"})
+    response.status_code = 503
+    response.headers.set("Retry-After", "5")
+    return response
+EXPORT_COLUMNS = ('timestamp', 'temperature', 'humidity', 'latitude', 'longitude')
 
 @app.route('/api/export/<string:box_id>', methods=['GET'])
 def export_box_data_csv(box_id):
+    """
+    Export CSV seluruh riwayat box secara streaming (memori tetap datar).
+    Opsional: ?start= & ?end= (rentang waktu), ?compress=gzip (.csv.gz),
+    header Range (bytes=N-) untuk melanjutkan download yang terputus.
+    Link download dibuka langsung oleh browser: ?token= berisi token URL
+    purpose "export" untuk box ini (/api/auth/url-token).
+    """
+    _, error = authorize_box(box_id, "export")
+    if error:
+        return error
+    compress = request.args.get('compress') == 'gzip'
+    try:
+        start = parse_timestamp(request.args['start']) if request.args.get('start') else None
+        end = parse_timestamp(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "Format start/end tidak valid"}), 400
+
     conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT timestamp, temperature, humidity, latitude, longitude FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC",
-            (box_id,)
-        )
-        rows = cursor.fetchall()
+        # Hanya shard box ini yang dibaca: export panjang tidak menahan shard mitra lain.
+        # Koneksi dari pool export, bukan pool yang dipakai writer ingest & API
+        shard = shard_router.shards[shard_router.shard_for(box_id)]
+        conn = shard.export_pool.connection()
 
-        def generate():
-            data = io.StringIO()
-            w = csv.writer(data)
+        # Snapshot: id terbesar saat export dimulai. Resume (Range) memakai
+        # snapshot yang sama lewat If-Range/ETag, jadi isi file tetap identik
+        # walaupun data baru terus masuk.
+        snapshot = None
+        if_range = request.headers.get('If-Range', '')
+        if_range = (if_range[2:] if if_range.startswith('W/') else if_range).strip('"')
+        if if_range.startswith('export-'):
+            try:
+                snapshot = int(if_range.rsplit('-', 1)[1])
+            except ValueError:
+                snapshot = None
+        if snapshot is None:
+            # sqlite_sequence = id terbesar yang pernah dipakai, termasuk baris
+            # yang sudah dipindah ke partisi
+            snapshot = conn.execute(LAST_ID_QUERY).fetchone()[0]
 
-            # Tulis Header CSV
-            w.writerow(('Waktu', 'Suhu (°C)', 'Kelembapan (%)', 'Latitude', 'Longitude'))
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
+        query = "SELECT timestamp, temperature, humidity, latitude, longitude FROM smartbox_data WHERE box_id = ? AND id <= ?"
+        params = [box_id, snapshot]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(format_timestamp(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(format_timestamp(end))
+        query += " ORDER BY timestamp DESC, id DESC"
 
-            for row in rows:
-                w.writerow((
-                    row['timestamp'],
-                    row['temperature'],
-                    row['humidity'],
-                    row['latitude'],
-                    row['longitude']
-                ))
-                yield data.getvalue()
-                data.seek(0)
-                data.truncate(0)
-
-        response = Response(stream_with_context(generate()), mimetype='text/csv')
-        response.headers.set("Content-Disposition", "attachment", filename=f"{box_id}_report.csv")
+        open_cursors = []
+
+        def make_blocks():
+            hot_cursor = conn.cursor()
+            hot_cursor.execute(query, params)
+            # Data panas dulu, lalu partisi bulanan dari yang terbaru
+            # (urutan tetap timestamp DESC secara keseluruhan)
+            cursor = ChainedCursor(
+                [lambda: (hot_cursor, None)] + shard.partitions.cursor_factories(query, params)
+            )
+            open_cursors.append(cursor)
+            blocks = csv_blocks(iter_rows(cursor), EXPORT_HEADER, EXPORT_COLUMNS)
+            return gzip_blocks(blocks) if compress else blocks
+
+        etag = f"export-{snapshot}"
+        status = 200
+        headers = {"Accept-Ranges": "bytes", "ETag": f'"{etag}"'}
+        body = make_blocks()
+        size_key = (box_id, snapshot, request.args.get('start'), request.args.get('end'), compress)
+
+        byte_range = parse_range(request.headers.get('Range'))
+        if byte_range is None:
+            # Download utuh mencatat ukurannya untuk resume berikutnya
+            body = record_size(body, lambda total: export_sizes.put(size_key, total))
+        else:
+            total = export_sizes.get(size_key)
+            if total is None:
+                # Belum diketahui (mis. worker lain yang melayani download awal):
+                # satu pass streaming tambahan tanpa menampung data, lalu di-cache
+                total = count_bytes(make_blocks())
+                export_sizes.put(size_key, total)
+            range_start, range_end = byte_range
+            if range_end is None or range_end >= total:
+                range_end = total - 1
+            if range_start >= total or range_start > range_end:
+                conn.close()
+                return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+            status = 206
+            body = slice_blocks(body, range_start, range_end)
+            headers["Content-Range"] = f"bytes {range_start}-{range_end}/{total}"
+            headers["Content-Length"] = str(range_end - range_start + 1)
+
+        filename = f"{box_id}_report.csv" + (".gz" if compress else "")
+        mimetype = 'application/gzip' if compress else 'text/csv'
+        body = count_export_bytes(body, "csv", "csv.gz" if compress else "csv")
+        response = Response(body, status=status, mimetype=mimetype, headers=headers)
+        response.headers.set("Content-Disposition", "attachment", filename=filename)
+        # Koneksi hidup selama response di-stream, dikembalikan ke pool setelahnya
+        for chained in open_cursors:
+            response.call_on_close(chained.close)
+        response.call_on_close(conn.close)
+        conn = None
         return response
 
+    except PoolTimeout:
+        return export_busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
 
+export_stats = ExportStats()
+
+@app.route('/api/bulk-export', methods=['GET'])
+def bulk_export_fleet():
+    """
+    Export lintas box untuk analitik: ?format=ndjson|arrow|parquet,
+    ?box_ids=A,B (opsional), ?start= & ?end= (opsional).
+    Super admin boleh semua box; mitra hanya box miliknya.
+    """
+    user_data = decode_token(request.headers.get('Authorization'))
+    if not user_data:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in BULK_EXPORT_FORMATS:
+        return jsonify({"error": f"format harus salah satu dari: {', '.join(BULK_EXPORT_FORMATS)}"}), 400
+    if not format_available(fmt):
+        return jsonify({"error": f"Format {fmt} membutuhkan paket pyarrow di server"}), 501
+    try:
+        start = parse_timestamp(request.args['start']) if request.args.get('start') else None
+        end = parse_timestamp(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "Format start/end tidak valid"}), 400
+
+    box_ids_param = request.args.get('box_ids')
+    requested = sorted({b.strip() for b in box_ids_param.split(',') if b.strip()}) if box_ids_param else None
+
+    conns = []
+    try:
+        if user_data.get('role') == 'super_admin':
+            box_ids = requested
+        else:
+            owned = owned_boxes(user_data)
+            box_ids = sorted(owned & set(requested)) if requested is not None else sorted(owned)
+
+        query = f"SELECT {', '.join(BULK_EXPORT_COLUMNS)} FROM smartbox_data WHERE 1 = 1"
+        params = []
+        if box_ids is not None:
+            query += " AND box_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(box_ids))
+        if start is not None:
+            query += " AND timestamp >= ?"
+            params.append(format_timestamp(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            params.append(format_timestamp(end))
+        query += " ORDER BY id"
+
+        # Cursor mentah (tanpa sqlite3.Row) agar chunk berupa tuple biasa.
+        # Urutan id per shard: partisi bulanan dari yang terlama, lalu data
+        # panas; hasil beberapa shard digabung urut id.
+        targets = (sorted(shard_router.group(box_ids)) or [0]) if box_ids is not None else range(shard_router.count)
+        cursors = []
+        for index in targets:
+            shard = shard_router.shards[index]
+            conn = shard.export_pool.connection()
+            conns.append(conn)
+            hot_cursor = conn.cursor()
+            hot_cursor.row_factory = None
+            hot_cursor.execute(query, params)
+            cursors.append(ChainedCursor(
+                shard.partitions.cursor_factories(query, params, newest_first=False)
+                + [lambda hot_cursor=hot_cursor: (hot_cursor, None)],
+                row_factory=None
+            ))
+        cursor = cursors[0] if len(cursors) == 1 else MergedCursor(cursors)
+
+        mimetype, extension = BULK_EXPORT_FORMATS[fmt]
+        label = f"user:{user_data.get('username')}"
+        blocks = count_export_bytes(export_blocks(cursor, fmt, export_stats, label), "bulk", fmt)
+        response = Response(blocks, mimetype=mimetype)
+        response.headers.set("Content-Disposition", "attachment", filename=f"smartbox_export.{extension}")
+        response.call_on_close(cursor.close)
+        for conn in conns:
+            response.call_on_close(conn.close)
+        conns = []
+        return response
+
+    except PoolTimeout:
+        return export_busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        for conn in conns:
+            conn.close()
+
+@app.route('/api/admin/export-stats', methods=['GET'])
+@admin_required
+def get_export_stats():
+    return jsonify(export_stats.stats())
+
+@app.route('/api/admin/retention-stats', methods=['GET'])
+@admin_required
+def get_retention_stats():
+    data = retention_workers[0].stats()
+    if len(retention_workers) > 1:
+        data["shards"] = [worker.stats() for worker in retention_workers]
+    return jsonify(data)
+
+# --- PROMETHEUS ---
+# Statistik yang sudah ada di tiap komponen dibaca saat scrape (tanpa dihitung ulang)
+
+def _stat_collector(name, help_text, kind, source, key):
+    METRICS.collector(name, help_text, kind, lambda: [({}, source().get(key))])
+
+for _key, _kind in (("enqueued", "counter"), ("written", "counter"), ("batches", "counter"),
+                    ("dropped", "counter"), ("failed", "counter"), ("retries", "counter"), ("queue_depth", "gauge"),
+                    ("queue_capacity", "gauge")):
+    _stat_collector(f"smartbox_ingest_{_key}" + ("_total" if _kind == "counter" else ""),
+                    f"Ingest pipeline: {_key}", _kind, ingest_pipeline.stats, _key)
+if ingest_reorder is not None:
+    for _key in ("held", "late", "gaps_skipped", "duplicates", "restarts"):
+        _stat_collector(f"smartbox_ingest_reorder_{_key}_total", f"Reorder buffer ingest: {_key}", "counter",
+                        ingest_reorder.stats, _key)
+    _stat_collector("smartbox_ingest_reorder_pending", "Reading yang sedang ditahan reorder buffer", "gauge",
+                    ingest_reorder.stats, "pending")
+for _key in ("accepted", "tracked_boxes", "quarantined_boxes"):
+    _stat_collector(f"smartbox_ingest_guard_{_key}" + ("_total" if _key == "accepted" else ""),
+                    f"Ingest guard: {_key}", "counter" if _key == "accepted" else "gauge", ingest_guard.stats, _key)
+_stat_collector("smartbox_ingest_follower_rows_total", "Baris yang dibaca ingest follower (mode external)",
+                "counter", ingest_follower.stats, "rows")
+for _key in ("open_connections", "idle_connections", "max_size"):
+    _stat_collector(f"smartbox_db_pool_{_key}", f"Connection pool: {_key}", "gauge", db_pool.stats, _key)
+for _key in ("hits", "misses", "assigned"):
+    _stat_collector(f"smartbox_shard_directory_{_key}_total", f"Direktori box -> shard: {_key}", "counter",
+                    shard_router.stats, _key)
+_stat_collector("smartbox_shard_fan_outs_total", "Query yang dijalankan paralel di beberapa shard", "counter",
+                shard_router.stats, "fan_outs")
+_stat_collector("smartbox_shards", "Jumlah shard data sensor", "gauge", shard_router.stats, "shards")
+METRICS.collector("smartbox_db_pool_wait_seconds_total", "Total waktu menunggu koneksi pool", "counter",
+                  lambda: [({}, db_pool.stats()["wait_time_ms"] / 1000.0)])
+for _key in ("hits", "misses"):
+    _stat_collector(f"smartbox_latest_cache_{_key}_total", f"Latest-reading cache: {_key}", "counter",
+                    latest_cache.stats, _key)
+_stat_collector("smartbox_latest_cache_boxes", "Jumlah box di latest-reading cache", "gauge", latest_cache.stats, "boxes")
+for _name, _cache in (("token", token_cache), ("ownership", ownership_cache)):
+    for _key in ("hits", "misses", "evictions"):
+        _stat_collector(f"smartbox_{_name}_cache_{_key}_total", f"Cache {_name}: {_key}", "counter", _cache.stats, _key)
+    _stat_collector(f"smartbox_{_name}_cache_entries", f"Isi cache {_name}", "gauge", _cache.stats, "entries")
+for _key in ("hits", "misses", "invalidated", "not_modified"):
+    _stat_collector(f"smartbox_http_cache_{_key}_total", f"Cache response HTTP: {_key}", "counter",
+                    response_cache.stats, _key)
+_stat_collector("smartbox_http_cache_entries", "Isi cache response HTTP", "gauge", response_cache.stats, "entries")
+for _name, _broker in (("telemetry", telemetry_broker), ("alerts", alert_broker)):
+    _stat_collector(f"smartbox_stream_{_name}_subscribers", f"Client SSE aktif ({_name})", "gauge",
+                    _broker.stats, "subscribers")
+METRICS.collector("smartbox_alerts_active", "Alert yang sedang aktif", "gauge",
+                  lambda: [({}, alert_engine.stats()["active"])])
+METRICS.collector("smartbox_alert_transitions_total", "Perubahan state alert", "counter",
+                  lambda: [({"state": state}, alert_engine.stats()[state]) for state in ("raised", "cleared")],
+                  labelnames=["state"])
+METRICS.collector("smartbox_ingest_leader", "1 jika proses ini pemegang tugas tunggal (MQTT/alert/retention)", "gauge",
+                  lambda: [({}, 1 if service_state["owner"] else 0)])
+METRICS.collector("smartbox_mqtt_connected", "1 jika client MQTT proses ini terhubung ke broker", "gauge",
+                  lambda: [({}, 1 if mqtt_state["connected"] else 0)])
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Scraper memakai METRICS_TOKEN (Authorization: Bearer ...), selain itu JWT super admin."""
+    if not metrics_token_valid(request.headers.get('Authorization')):
+        error = admin_error()
+        if error is not None:
+            return error
+    return Response(METRICS.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
 # ==============================================================================
-# MAIN EXECUTION
+# SECTION 6: SERVICE LIFECYCLE (DEV SERVER & WSGI MULTI-WORKER)
 # ==============================================================================
+# Peran proses:
+#   standalone : INGEST_LEADER_LOCK kosong, proses tunggal menjalankan semuanya
+#   leader     : pemegang lock; MQTT + writer ingest (embedded), evaluasi &
+#                penyimpanan alert, cek box offline, retention
+#   follower   : worker lain; mengikuti baris baru & alert_events dari DB agar
+#                cache, ETag dan stream SSE di proses ini tetap terkini, dan
+#                mengambil alih tugas leader jika leader berhenti
+# Dengan INGEST_MODE=external, MQTT diterima ingest_service.py dan semua peran
+# mengikuti baris baru dari DB.
+
+_services_lock = Lock()
+
+def reload_alert_rules():
+    """Aturan alert bisa diubah lewat worker lain: muat ulang berkala dari DB."""
+    conn = get_db_connection()
+    try:
+        alert_engine.load_rules(conn)
+    finally:
+        conn.close()
+
+def start_leader_duties():
+    """Tugas yang hanya boleh jalan di satu proses."""
+    service_state["owner"] = True
+    if INGEST_MODE != "external":
+        # Writer batch harus jalan sebelum MQTT mulai menerima pesan
+        ingest_pipeline.start()
+        start_mqtt_listener()
+    # Alert engine: cek box offline berkala
+    alert_engine.start(refresh=reload_alert_rules if leader_lock else None)
+    # Pindahkan data lama ke partisi bulanan secara berkala (background, per shard)
+    for worker in retention_workers:
+        worker.start()
+
+def promote_to_leader():
+    """Dipanggil thread LeaderLock saat leader sebelumnya berhenti."""
+    with _services_lock:
+        if service_state["draining"]:
+            return
+        # Tutup celah: ambil sisa data & event yang ditulis leader lama
+        alert_engine.stop()
+        alert_follower.stop()
+        alert_follower.poll_once()
+        if INGEST_MODE != "external":
+            ingest_follower.stop()
+            ingest_follower.poll_once()
+        # State alert aktif & waktu data terakhir dimuat ulang sebelum mulai mengevaluasi
+        load_alert_engine()
+        start_leader_duties()
+        service_state["role"] = "leader"
+    log.info("promoted to leader", mode=INGEST_MODE, pid=os.getpid())
+
+leader_lock = LeaderLock(
+    INGEST_LEADER_LOCK,
+    retry_interval=INGEST_LEADER_RETRY_SECONDS,
+    on_elected=promote_to_leader
+) if INGEST_LEADER_LOCK else None
+
+def start_services():
+    """Siapkan DB & cache lalu jalankan thread background sesuai peran proses (idempotent)."""
+    with _services_lock:
+        if service_state["started"]:
+            return
+        initialize_database()
+        # Posisi per shard dibaca sebelum cache diisi: baris yang masuk di
+        # antaranya diteruskan ulang oleh follower, tidak ada yang terlewat
+        start_ids = current_max_ids()
+        warm_latest_cache()
+        # Aturan & alert aktif dimuat sebelum ingest mulai mengevaluasi data
+        load_alert_engine()
+
+        leader = leader_lock is None or leader_lock.try_acquire()
+        service_state["owner"] = leader
+        if INGEST_MODE == "external" or not leader:
+            ingest_follower.start(dict(enumerate(start_ids)))
+        if leader:
+            start_leader_duties()
+        else:
+            alert_follower.start({0: current_max_alert_event_id()})
+            alert_engine.start(check_stale=False, refresh=reload_alert_rules)
+            leader_lock.start()
+
+        service_state["started"] = True
+        service_state["role"] = "standalone" if leader_lock is None else ("leader" if leader else "follower")
+    log.info("services started", mode=INGEST_MODE, role=service_state["role"], pid=os.getpid())
+
+def begin_drain():
+    """
+    Langkah awal shutdown: readiness jadi 503, berhenti menerima MQTT dan
+    tutup stream SSE (client reconnect ke worker lain). Request biasa yang
+    sedang berjalan tetap diselesaikan server.
+    """
+    with _services_lock:
+        if service_state["draining"]:
+            return
+        service_state["draining"] = True
+    if leader_lock is not None:
+        # Jangan ambil alih peran leader saat sedang berhenti
+        leader_lock.stop()
+    streams = telemetry_broker.close_all() + alert_broker.close_all()
+    stop_mqtt_listener()
+    log.info("draining", role=service_state["role"], streams_closed=streams)
+
+def stop_services(timeout=SHUTDOWN_DRAIN_TIMEOUT):
+    """Graceful shutdown: flush antrian ingest ke DB, hentikan thread, tutup koneksi."""
+    if not service_state["started"]:
+        return
+    begin_drain()
+    with _services_lock:
+        if not service_state["started"]:
+            return
+        service_state["started"] = False
+    ingest_pipeline.stop(timeout=timeout)
+    pending = ingest_pipeline.stats()["queue_depth"]
+    if pending:
+        log.warning("ingest queue not fully flushed", pending=pending, timeout=timeout)
+    ingest_follower.stop()
+    alert_follower.stop()
+    alert_engine.stop()
+    for worker in retention_workers:
+        worker.stop()
+    if leader_lock is not None:
+        # Dilepas setelah flush agar leader baru tidak menulis bersamaan
+        leader_lock.release()
+    shard_router.close()
+    service_state["owner"] = False
+    log.info("services stopped", written=ingest_pipeline.stats()["written"])
+
+def create_app():
+    """App factory untuk server WSGI (wsgi.py): service dijalankan sekali per proses worker."""
+    start_services()
+    return app
+
+@app.route('/healthz', methods=['GET'])
+def get_health():
+    """Liveness: proses hidup dan bisa melayani request (tanpa menyentuh DB)."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def get_readiness():
+    """Readiness: DB bisa dibaca, thread background sesuai peran hidup, tidak sedang shutdown."""
+    checks = {
+        "services": service_state["started"] and not service_state["draining"],
+        "latest_cache": latest_cache.is_warm,
+    }
+    conn = None
+    try:
+        conn = get_db_connection()
+        conn.execute("SELECT 1").fetchone()
+        checks["database"] = True
+    except sqlite3.Error:
+        checks["database"] = False
+    finally:
+        if conn: conn.close()
+    if service_state["owner"] and INGEST_MODE != "external":
+        checks["ingest_writer"] = ingest_pipeline.is_running()
+    else:
+        checks["ingest_follower"] = ingest_follower.is_running()
+
+    ready = all(checks.values())
+    data = {
+        "status": "ready" if ready else "not_ready",
+        "mode": INGEST_MODE,
+        "role": service_state["role"],
+        "checks": checks,
+        # Informasi saja: broker putus tidak membuat API berhenti melayani
+        "mqtt_connected": mqtt_state["connected"] if mqtt_client is not None else None,
+    }
+    return jsonify(data), 200 if ready else 503
+
+# ==============================================================================
+# MAIN EXECUTION (DEVELOPMENT SERVER)
+# ==============================================================================
+# Produksi: gunicorn -c gunicorn.conf.py wsgi:app (lihat wsgi.py)
 if __name__ == '__main__':
-    initialize_database()
-    
-    print("Starting MQTT listener...")
-    mqtt_thread = Thread(target=start_mqtt_listener)
-    mqtt_thread.daemon = True
-    mqtt_thread.start()
-    
-    print(f"Starting Flask API on port {API_PORT}...")
-    app.run(host='0.0.0.0', port=API_PORT)
\ No newline at end of file
+    start_services()
+    atexit.register(stop_services)
+    # SIGTERM (docker stop / systemd) -> SystemExit agar atexit tetap flush ingest
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    log.info("starting flask api (development server)", port=API_PORT)
+    app.run(host='0.0.0.0', port=API_PORT, threaded=True)
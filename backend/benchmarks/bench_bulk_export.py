@@ -0,0 +1,103 @@
+"""
+Benchmark bulk export: CSV (csv.writer per baris) vs NDJSON / Arrow IPC /
+Parquet untuk seluruh armada, termasuk puncak memori Python.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_bulk_export.py --rows 2000000 --boxes 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bulk_export import COLUMNS, export_blocks, format_available  # noqa: E402
+from export_stream import csv_blocks, iter_rows  # noqa: E402
+from benchmarks.bench_indexes import SCHEMA  # noqa: E402
+
+QUERY = f"SELECT {', '.join(COLUMNS)} FROM smartbox_data ORDER BY id"
+
+
+def seed(conn, rows, boxes, chunk=100000):
+    base = int(time.time()) - rows
+    written = 0
+    while written < rows:
+        n = min(chunk, rows - written)
+        conn.executemany(
+            "INSERT INTO smartbox_data (box_id, temperature, humidity, latitude, longitude, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            [(
+                f"SMARTBOX-{i % boxes:03d}",
+                round(random.uniform(2.0, 9.0), 2),
+                round(random.uniform(45.0, 65.0), 2),
+                random.uniform(-6.65, -6.10),
+                random.uniform(106.50, 107.15),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i)),
+            ) for i in range(written, written + n)]
+        )
+        conn.commit()
+        written += n
+
+
+def run(name, make_blocks, memory):
+    start = time.perf_counter()
+    size = sum(len(block) for block in make_blocks())
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        # Pass terpisah: tracemalloc memperlambat eksekusi secara signifikan
+        tracemalloc.start()
+        for _ in make_blocks():
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return name, size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk export SmartBox")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--memory", action="store_true", help="ukur juga puncak memori (tracemalloc)")
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix="smartbox-bench-"), "bench.db")
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+    seed(conn, args.rows, args.boxes)
+
+    def csv_export():
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(QUERY)
+        return csv_blocks(iter_rows(cursor), COLUMNS, COLUMNS)
+
+    def bulk(fmt):
+        def make():
+            cursor = conn.cursor()
+            cursor.execute(QUERY)
+            return export_blocks(cursor, fmt, label="bench")
+        return make
+
+    results = [run("csv", csv_export, args.memory)]
+    for fmt in ("ndjson", "arrow", "parquet"):
+        if format_available(fmt):
+            results.append(run(fmt, bulk(fmt), args.memory))
+        else:
+            print(f"skip {fmt}: pyarrow tidak terpasang")
+
+    csv_time = results[0][2]
+    print(f"\n{'format':<10}{'MiB':>10}{'seconds':>10}{'rows/s':>12}{'vs csv':>9}{'peak MiB':>10}")
+    for name, size, elapsed, peak in results:
+        peak_text = f"{peak / 2**20:.1f}" if peak is not None else "-"
+        print(f"{name:<10}{size / 2**20:>10.1f}{elapsed:>10.2f}{args.rows / elapsed:>12.0f}"
+              f"{csv_time / elapsed:>8.1f}x{peak_text:>10}")
+
+
+if __name__ == "__main__":
+    main()
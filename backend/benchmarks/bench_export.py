@@ -0,0 +1,93 @@
+"""
+Benchmark export CSV streaming: throughput dan puncak memori Python
+(tracemalloc) untuk beberapa ukuran export. Puncak memori harus tetap
+datar walaupun jumlah baris bertambah.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_export.py --sizes 10000 100000 1000000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(backend, box_id, rows, chunk=20000):
+    written = 0
+    while written < rows:
+        n = min(chunk, rows - written)
+        backend.store_sensor_batch([{
+            "box_id": box_id,
+            "temperature": 4.5,
+            "humidity": 55.0,
+            "latitude": -6.2,
+            "longitude": 106.8,
+        } for _ in range(n)])
+        written += n
+
+
+def admin_headers(backend):
+    # Export butuh token; super admin boleh mengakses semua box
+    import jwt
+    token = jwt.encode({"user_id": 1, "username": "superadmin", "role": "super_admin",
+                        "exp": int(time.time()) + 3600}, backend.JWT_SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+def measure(client, url, headers):
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, headers=headers, buffered=False)
+    size = 0
+    for block in response.response:
+        size += len(block)
+    response.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark export CSV SmartBox")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--max-peak-mb", type=float, default=8.0,
+                        help="gagal (exit 1) jika puncak memori melebihi batas ini")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="smartbox-bench-")
+    os.environ["DB_FILE"] = os.path.join(tmpdir, "bench.db")
+    # Log startup backend tidak ikut mengotori output benchmark
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backend
+        backend.initialize_database()
+    client = backend.app.test_client()
+    headers = admin_headers(backend)
+
+    print(f"{'rows':>10}{'bytes':>14}{'seconds':>10}{'rows/s':>12}{'peak MiB':>10}")
+    peaks = []
+    for i, rows in enumerate(args.sizes):
+        box_id = f"EXPORT-{i}"
+        seed(backend, box_id, rows)
+        url = f"/api/export/{box_id}" + ("?compress=gzip" if args.gzip else "")
+        size, elapsed, peak = measure(client, url, headers)
+        peaks.append(peak)
+        print(f"{rows:>10}{size:>14}{elapsed:>10.2f}{rows / elapsed:>12.0f}{peak / 2**20:>10.2f}")
+
+    if max(peaks) / 2**20 > args.max_peak_mb:
+        print(f"FAIL: peak memory above {args.max_peak_mb} MiB")
+        sys.exit(1)
+    print("OK: peak memory stays flat")
+
+
+if __name__ == "__main__":
+    main()
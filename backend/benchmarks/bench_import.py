@@ -0,0 +1,81 @@
+"""
+Benchmark bulk import (import_tool.py): rows/s untuk NDJSON & CSV,
+dengan dan tanpa --defer-indexes.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_import.py --rows 1000000
+    python benchmarks/bench_import.py --rows 200000 --batch-rows 50000
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SUMMARY_RE = re.compile(r"Tersimpan\s*:\s*(\d+) dalam ([\d.]+)s")
+
+
+def write_inputs(tmpdir, rows, boxes):
+    """NDJSON (gzip, dengan seq) + CSV format export per box (tanpa seq)."""
+    base = int(time.time()) - 60 * 86400
+    ndjson = os.path.join(tmpdir, "readings.ndjson.gz")
+    with gzip.open(ndjson, "wt", compresslevel=1) as f:
+        for i in range(rows):
+            f.write(json.dumps({
+                "box_id": f"SMARTBOX-{i % boxes:03d}",
+                "temperature": round(random.uniform(2.0, 9.0), 2),
+                "humidity": round(random.uniform(45.0, 65.0), 2),
+                "latitude": round(random.uniform(-6.65, -6.10), 6),
+                "longitude": round(random.uniform(106.50, 107.15), 6),
+                "ts": base + (i // boxes) * 60,
+                "seq": i // boxes,
+            }) + "\n")
+    csv_path = os.path.join(tmpdir, "SMARTBOX-CSV_report.csv")
+    with open(csv_path, "w") as f:
+        f.write("Waktu,Suhu (°C),Kelembapan (%),Latitude,Longitude\n")
+        for i in range(rows):
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i * 5))
+            f.write(f"{stamp},{random.uniform(2.0, 9.0):.2f},{random.uniform(45.0, 65.0):.2f},-6.2,106.8\n")
+    return ndjson, csv_path
+
+
+def run_import(db_file, files, extra):
+    env = dict(os.environ, DB_FILE=db_file, LOG_LEVEL="WARNING")
+    argv = [sys.executable, os.path.join(BACKEND_DIR, "import_tool.py"), "load", *files,
+            "--progress", "3600", "--checkpoint", db_file + ".checkpoint.json", *extra]
+    output = subprocess.run(argv, env=env, check=True, capture_output=True, text=True).stdout
+    stored, seconds = SUMMARY_RE.search(output).groups()
+    return int(stored), float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk import SmartBox")
+    parser.add_argument("--rows", type=int, default=500000, help="Baris per file input")
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--batch-rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="smartbox-import-")
+    ndjson, csv_path = write_inputs(tmpdir, args.rows, args.boxes)
+    print(f"Input: {args.rows} baris per file, {args.boxes} box, batch {args.batch_rows}")
+
+    for label, files in (("ndjson.gz", [ndjson]), ("csv", [csv_path])):
+        for defer in (False, True):
+            db_file = os.path.join(tmpdir, f"{label}-{'defer' if defer else 'live'}.db")
+            extra = ["--batch-rows", str(args.batch_rows)] + (["--defer-indexes"] if defer else [])
+            stored, seconds = run_import(db_file, files, extra)
+            mode = "--defer-indexes" if defer else "index aktif    "
+            print(f"{label:<10} {mode}: {stored / seconds:10,.0f} rows/s "
+                  f"({stored * 60 / seconds / 1e6:.2f} juta baris/menit, {seconds:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
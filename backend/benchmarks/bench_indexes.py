@@ -0,0 +1,139 @@
+"""
+Benchmark index smartbox_data: isi database sintetis berukuran besar lalu
+ukur latensi query endpoint sebelum dan sesudah migrasi index.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_indexes.py --rows 2000000 --boxes 500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from migrations import apply_migrations  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE smartbox_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    box_id TEXT NOT NULL,
+    temperature REAL,
+    humidity REAL,
+    latitude REAL,
+    longitude REAL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE box_ownership (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    box_id TEXT NOT NULL,
+    label TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(box_id)
+);
+"""
+
+
+def seed(conn, rows, boxes, chunk=100000):
+    base = time.time() - rows  # satu detik per baris, mundur dari sekarang
+    written = 0
+    while written < rows:
+        n = min(chunk, rows - written)
+        batch = []
+        for i in range(written, written + n):
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i))
+            batch.append((
+                f"SMARTBOX-{i % boxes:03d}",
+                round(random.uniform(2.0, 9.0), 2),
+                round(random.uniform(45.0, 65.0), 2),
+                random.uniform(-6.65, -6.10),
+                random.uniform(106.50, 107.15),
+                ts
+            ))
+        conn.executemany(
+            "INSERT INTO smartbox_data (box_id, temperature, humidity, latitude, longitude, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            batch
+        )
+        conn.commit()
+        written += n
+    conn.executemany(
+        "INSERT INTO box_ownership (user_id, box_id, label) VALUES (?, ?, ?)",
+        [(b % 50, f"SMARTBOX-{b:03d}", None) for b in range(boxes)]
+    )
+    conn.commit()
+
+
+def queries(boxes):
+    owned = [f"SMARTBOX-{b:03d}" for b in range(0, boxes, 50)][:10]
+    placeholders = ",".join("?" for _ in owned)
+    return [
+        ("latest by box (limit 1)",
+         "SELECT * FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC LIMIT ?",
+         ("SMARTBOX-007", 1)),
+        ("history by box (limit 100)",
+         "SELECT * FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC LIMIT ?",
+         ("SMARTBOX-007", 100)),
+        ("dashboard IN (...)",
+         f"SELECT * FROM smartbox_data WHERE box_id IN ({placeholders}) ORDER BY timestamp DESC LIMIT 100",
+         tuple(owned)),
+        ("distinct box_id",
+         "SELECT DISTINCT box_id FROM smartbox_data",
+         ()),
+        ("export one box",
+         "SELECT timestamp, temperature, humidity, latitude, longitude FROM smartbox_data WHERE box_id = ? ORDER BY timestamp DESC",
+         ("SMARTBOX-007",)),
+        ("owned boxes by user",
+         "SELECT box_id, label FROM box_ownership WHERE user_id = ?",
+         (7,)),
+    ]
+
+
+def measure(conn, sql, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index smartbox_data")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--boxes", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix="smartbox-bench-"), "bench.db")
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+
+    start = time.perf_counter()
+    seed(conn, args.rows, args.boxes)
+    print(f"Seeded {args.rows} rows / {args.boxes} boxes in {time.perf_counter() - start:.1f}s")
+
+    qs = queries(args.boxes)
+    before = {name: measure(conn, sql, params, args.repeat) for name, sql, params in qs}
+
+    start = time.perf_counter()
+    apply_migrations(conn)
+    print(f"Migrations applied in {time.perf_counter() - start:.1f}s\n")
+
+    after = {name: measure(conn, sql, params, args.repeat) for name, sql, params in qs}
+
+    print(f"{'query':<28}{'no index (ms)':>16}{'indexed (ms)':>16}{'speedup':>10}")
+    for name, _, _ in qs:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<28}{before[name]:>16.2f}{after[name]:>16.2f}{speedup:>9.1f}x")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
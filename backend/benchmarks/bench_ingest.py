@@ -0,0 +1,86 @@
+"""
+Benchmark ingest: insert per-baris (satu koneksi + commit per pesan)
+vs IngestPipeline (antrian + executemany per batch).
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_ingest.py --messages 20000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def make_payloads(n, boxes):
+    return [{
+        "box_id": f"SMARTBOX-{random.randint(1, boxes):03d}",
+        "temperature": round(random.uniform(2.0, 9.0), 2),
+        "humidity": round(random.uniform(45.0, 65.0), 2),
+        "latitude": random.uniform(-6.65, -6.10),
+        "longitude": random.uniform(106.50, 107.15),
+    } for _ in range(n)]
+
+
+def bench_per_row(backend, payloads):
+    start = time.perf_counter()
+    # store_sensor_data mencetak satu baris per pesan; buang output-nya
+    with contextlib.redirect_stdout(io.StringIO()):
+        for p in payloads:
+            backend.store_sensor_data(p)
+    return time.perf_counter() - start
+
+
+def bench_pipeline(backend, payloads, batch_size, flush_interval):
+    from ingest import IngestPipeline
+    pipeline = IngestPipeline(
+        backend.store_sensor_batch,
+        max_queue=len(payloads) + 1,
+        batch_size=batch_size,
+        flush_interval=flush_interval
+    )
+    start = time.perf_counter()
+    pipeline.start()
+    for p in payloads:
+        pipeline.submit(p)
+    pipeline.stop(timeout=None)
+    elapsed = time.perf_counter() - start
+    return elapsed, pipeline.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest SmartBox")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="smartbox-bench-")
+    os.environ["DB_FILE"] = os.path.join(tmpdir, "bench.db")
+    # Log startup backend tidak ikut mengotori output benchmark
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backend
+        backend.initialize_database()
+
+    payloads = make_payloads(args.messages, args.boxes)
+
+    t_row = bench_per_row(backend, payloads)
+    t_batch, stats = bench_pipeline(backend, payloads, args.batch_size, args.flush_interval)
+
+    print(f"Messages        : {args.messages}")
+    print(f"Per-row insert  : {args.messages / t_row:10.0f} msg/s ({t_row:.2f}s)")
+    print(f"Batched pipeline: {args.messages / t_batch:10.0f} msg/s ({t_batch:.2f}s)")
+    print(f"Speedup         : {t_row / t_batch:10.1f}x")
+    print(f"Pipeline stats  : {stats}")
+
+
+if __name__ == "__main__":
+    main()
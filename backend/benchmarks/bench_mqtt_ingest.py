@@ -0,0 +1,129 @@
+"""
+Benchmark throughput ingest_service.py (end-to-end lewat broker MQTT).
+
+Untuk setiap jumlah worker: jalankan ingest_service.py dengan database
+sementara, kirim N pesan dari generator mqtt_simulator.py secepat mungkin
+(QoS 1), lalu ukur waktu sampai semua pesan tersimpan di SQLite.
+
+Butuh broker lokal, misalnya mosquitto (MQTT v5, untuk mode shared):
+    mosquitto -p 1883
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_mqtt_ingest.py --broker localhost --messages 50000 --workers 1 2 4
+    python benchmarks/bench_mqtt_ingest.py --broker localhost --mode dispatch
+"""
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import paho.mqtt.client as mqtt
+
+from mqtt_simulator import generate_sensor_data
+from ingest_service import make_client
+
+
+def count_rows(db_file):
+    try:
+        conn = sqlite3.connect(db_file, timeout=30)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM smartbox_data").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return 0
+
+
+def publish(broker, port, topic, messages, boxes):
+    client = make_client(f"bench-publisher-{os.getpid()}", mqtt.MQTTv311)
+    client.max_inflight_messages_set(1000)
+    client.connect(broker, port, 60)
+    client.loop_start()
+    payloads = [json.dumps(generate_sensor_data(i % boxes + 1)) for i in range(messages)]
+    start = time.perf_counter()
+    infos = [client.publish(topic, payload, qos=1) for payload in payloads]
+    for info in infos:
+        info.wait_for_publish()
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    client.loop_stop()
+    return start, elapsed
+
+
+def run_case(args, workers, tmp):
+    db_file = os.path.join(tmp, f"bench_{args.mode}_{workers}.db")
+    topic = f"smartbox/bench/{os.getpid()}-{workers}/data"
+    # Box simulasi tidak didaftarkan di box_ownership
+    env = dict(os.environ, DB_FILE=db_file, INGEST_REQUIRE_KNOWN_BOX="0")
+    service = subprocess.Popen(
+        [sys.executable, "ingest_service.py",
+         "--workers", str(workers), "--mode", args.mode,
+         "--broker", args.broker, "--port", str(args.port),
+         "--topic", topic, "--qos", "1", "--stats-interval", "3600",
+         "--batch-size", str(args.batch_size)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        # Tunggu worker connect & subscribe
+        time.sleep(args.warmup)
+        start, publish_s = publish(args.broker, args.port, topic, args.messages, args.boxes)
+        deadline = time.monotonic() + args.timeout
+        stored = 0
+        while time.monotonic() < deadline:
+            stored = count_rows(db_file)
+            if stored >= args.messages:
+                break
+            time.sleep(0.05)
+        total_s = time.perf_counter() - start
+    finally:
+        service.send_signal(signal.SIGINT)
+        service.wait(timeout=60)
+    return {
+        "workers": workers,
+        "mode": args.mode,
+        "messages": args.messages,
+        "stored": stored,
+        "publish_s": round(publish_s, 3),
+        "total_s": round(total_s, 3),
+        "msg_per_sec": round(stored / total_s),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest_service.py lewat broker MQTT")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--mode", choices=["shared", "dispatch"], default="shared")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="Cetak hasil sebagai JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            result = run_case(args, workers, tmp)
+            results.append(result)
+            if not args.json:
+                print(f"workers={result['workers']:<3} stored={result['stored']}/{result['messages']} "
+                      f"publish={result['publish_s']:.2f}s total={result['total_s']:.2f}s "
+                      f"-> {result['msg_per_sec']} msg/s")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark payload telemetri: JSON vs format biner (payload_codec.py).
+Membandingkan byte per reading dan throughput decode (reading/detik),
+untuk satu reading per pesan dan batch beberapa reading per pesan.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_payload.py --readings 100000 --batch 1 10 60
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from payload_codec import decode_payload, encode_readings  # noqa: E402
+
+
+def make_readings(n, box_id):
+    base = int(time.time())
+    return [{
+        "box_id": box_id,
+        "temperature": round(random.uniform(2.0, 9.0), 2),
+        "humidity": round(random.uniform(45.0, 65.0), 2),
+        "latitude": round(random.uniform(-6.65, -6.10), 7),
+        "longitude": round(random.uniform(106.50, 107.15), 7),
+        "ts": base + i,
+    } for i in range(n)]
+
+
+def encode_messages(readings, fmt, batch, with_ts):
+    messages = []
+    for i in range(0, len(readings), batch):
+        chunk = readings[i:i + batch]
+        if fmt == "binary":
+            messages.append(encode_readings(chunk[0]["box_id"], chunk,
+                                            base_ts=chunk[0]["ts"] if with_ts else None))
+        else:
+            items = chunk if with_ts else [{k: v for k, v in r.items() if k != "ts"} for r in chunk]
+            data = items[0] if batch == 1 else items
+            messages.append(json.dumps(data, separators=(",", ":")).encode())
+    return messages
+
+
+def bench_decode(messages, repeat):
+    best = None
+    decoded = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoded = 0
+        for raw in messages:
+            decoded += len(decode_payload(raw))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return decoded, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark payload JSON vs biner")
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 10, 60],
+                        help="Jumlah reading per pesan MQTT")
+    parser.add_argument("--box-id", default="SMARTBOX-001")
+    parser.add_argument("--no-ts", action="store_true", help="Tanpa timestamp perangkat")
+    parser.add_argument("--repeat", type=int, default=3, help="Ambil waktu terbaik dari N ulangan")
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings, args.box_id)
+    with_ts = not args.no_ts
+
+    print(f"{'format':<8}{'batch':>6}{'msgs':>9}{'B/reading':>11}{'B/msg':>9}{'decode r/s':>13}")
+    for batch in args.batch:
+        results = {}
+        for fmt in ("json", "binary"):
+            messages = encode_messages(readings, fmt, batch, with_ts)
+            total_bytes = sum(len(m) for m in messages)
+            decoded, elapsed = bench_decode(messages, args.repeat)
+            assert decoded == len(readings)
+            results[fmt] = (total_bytes, decoded / elapsed)
+            print(f"{fmt:<8}{batch:>6}{len(messages):>9}{total_bytes / len(readings):>11.1f}"
+                  f"{total_bytes / len(messages):>9.0f}{decoded / elapsed:>13.0f}")
+        (json_bytes, json_rate), (bin_bytes, bin_rate) = results["json"], results["binary"]
+        print(f"{'':<8}{'':>6}{'':>9}{json_bytes / bin_bytes:>10.1f}x{'':>9}{bin_rate / json_rate:>12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
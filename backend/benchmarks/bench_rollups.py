@@ -0,0 +1,123 @@
+"""
+Benchmark rollup: agregasi langsung dari data mentah vs membaca tabel
+smartbox_rollup untuk riwayat jangka panjang satu box.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_rollups.py --boxes 20 --days 7 --interval 5
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from rollups import RESOLUTIONS, add_last_ts, apply_rollups, query_rollups, CREATE_TABLE_SQL  # noqa: E402
+from benchmarks.bench_indexes import SCHEMA  # noqa: E402
+from migrations import MIGRATIONS  # noqa: E402
+
+RAW_QUERY = """
+    SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ? AS bucket,
+           MIN(temperature), MAX(temperature), AVG(temperature),
+           MIN(humidity), MAX(humidity), AVG(humidity), COUNT(*)
+    FROM smartbox_data
+    WHERE box_id = ? AND timestamp >= ? AND timestamp < ?
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+
+def seed(conn, boxes, days, interval, chunk=50000):
+    """Isi data mentah + rollup secara incremental, seperti jalur ingest."""
+    end = int(time.time())
+    start = end - days * 86400
+    next_id = 1
+    batch = []
+    apply_time = 0.0
+    for ts in range(start, end, interval):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+        for b in range(boxes):
+            batch.append({
+                "id": next_id,
+                "box_id": f"SMARTBOX-{b:03d}",
+                "temperature": round(random.uniform(2.0, 9.0), 2),
+                "humidity": round(random.uniform(45.0, 65.0), 2),
+                "latitude": random.uniform(-6.65, -6.10),
+                "longitude": random.uniform(106.50, 107.15),
+                "timestamp": stamp,
+            })
+            next_id += 1
+        if len(batch) >= chunk:
+            apply_time += flush(conn, batch)
+            batch = []
+    if batch:
+        apply_time += flush(conn, batch)
+    return next_id - 1, start, end, apply_time
+
+
+def flush(conn, batch):
+    conn.executemany(
+        "INSERT INTO smartbox_data (id, box_id, temperature, humidity, latitude, longitude, timestamp) "
+        "VALUES (:id, :box_id, :temperature, :humidity, :latitude, :longitude, :timestamp)",
+        batch
+    )
+    t0 = time.perf_counter()
+    apply_rollups(conn, batch)
+    elapsed = time.perf_counter() - t0
+    conn.commit()
+    return elapsed
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rollup SmartBox")
+    parser.add_argument("--boxes", type=int, default=20)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=5, help="detik antar pembacaan per box")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix="smartbox-bench-"), "bench.db")
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+    for _, _, statements in MIGRATIONS:
+        for statement in statements:
+            if isinstance(statement, str):
+                conn.execute(statement)
+    conn.execute(CREATE_TABLE_SQL)
+    add_last_ts(conn)
+
+    t0 = time.perf_counter()
+    rows, start, end, apply_time = seed(conn, args.boxes, args.days, args.interval)
+    print(f"Seeded {rows} rows in {time.perf_counter() - t0:.1f}s "
+          f"(rollup maintenance {apply_time:.1f}s, {rows / apply_time:.0f} rows/s)\n")
+
+    box_id = "SMARTBOX-001"
+    start_s = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start))
+    end_s = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end))
+
+    print(f"{'resolution':<12}{'buckets':>9}{'raw (ms)':>12}{'rollup (ms)':>14}{'speedup':>10}")
+    for name, seconds in RESOLUTIONS.items():
+        raw = measure(lambda: conn.execute(RAW_QUERY, (seconds, seconds, box_id, start_s, end_s)).fetchall(), args.repeat)
+        buckets = query_rollups(conn, box_id, name, start, end)
+        rolled = measure(lambda: query_rollups(conn, box_id, name, start, end), args.repeat)
+        print(f"{name:<12}{len(buckets):>9}{raw:>12.2f}{rolled:>14.2f}{raw / rolled:>9.1f}x")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmark sharding: throughput ingest & latency query fan-out per jumlah shard.
+
+Untuk setiap SHARD_COUNT (--shards 1 2 4 8) dibuat database baru di folder
+sementara, lalu:
+  ingest : W proses writer (satu per mitra/owner, seperti beberapa
+           ingest_service) memanggil store_sensor_batch terus-menerus selama
+           --duration detik. Dengan 1 shard semua writer berebut satu write
+           lock; dengan N shard mitra yang berbeda shard menulis paralel.
+  fanout : query seluruh armada setelah ingest (daftar device DISTINCT per
+           shard dan scan penuh ter-merge urut id seperti bulk export).
+
+Setiap SHARD_COUNT dijalankan di proses terpisah karena konfigurasi shard
+dibaca saat backend di-import. Hasil dicetak sebagai tabel dan disimpan JSON.
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_shards.py --writers 8 --duration 10
+    python benchmarks/bench_shards.py --shards 1 4 --writers 4 --batch-size 200 --out /tmp/shards.json
+
+Catatan: scaling ingest dibatasi jumlah core & disk. Di mesin 1 core writer
+bergantian di CPU yang sama, jadi selisih antar SHARD_COUNT kecil; yang
+terlihat terutama berkurangnya waktu tunggu lock (p99 batch).
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def import_backend():
+    # Log & print startup backend tidak ikut mengotori output benchmark
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backend
+    return backend
+
+
+# ==============================================================================
+# WRITER (PROSES TERPISAH)
+# ==============================================================================
+
+def writer(owner, boxes, batch_size, deadline, results):
+    backend = import_backend()
+    box_ids = [f"SB-{owner:02d}-{i:03d}" for i in range(boxes)]
+    latencies = []
+    rows = 0
+    seq = 0
+    while time.time() < deadline:
+        now = int(time.time())
+        payloads = []
+        for i in range(batch_size):
+            payloads.append({
+                "box_id": box_ids[i % boxes],
+                "temperature": 4.0 + (i % 50) * 0.1,
+                "humidity": 55.0,
+                "latitude": -6.2 + owner * 0.01,
+                "longitude": 106.8 + (i % boxes) * 0.001,
+                "ts": now,
+                "seq": seq + i // boxes,
+            })
+        seq += batch_size // boxes + 1
+        start = time.perf_counter()
+        stored = backend.store_sensor_batch(payloads)
+        latencies.append(time.perf_counter() - start)
+        rows += len(stored)
+    backend.shard_router.close()
+    results.put({"owner": owner, "rows": rows, "batches": len(latencies), "latencies": latencies})
+
+
+# ==============================================================================
+# SATU SHARD_COUNT (PROSES ANAK)
+# ==============================================================================
+
+def run_shard_count(args):
+    backend = import_backend()
+    backend.initialize_database()
+    conn = backend.get_db_connection()
+    for owner in range(args.writers):
+        user_id = 100 + owner
+        conn.execute("INSERT INTO users (id, username, password_hash, role, is_approved) VALUES (?, ?, 'x', 'mitra', 1)",
+                     (user_id, f"bench_owner_{owner}"))
+        conn.executemany("INSERT INTO box_ownership (user_id, box_id) VALUES (?, ?)",
+                         [(user_id, f"SB-{owner:02d}-{i:03d}") for i in range(args.boxes)])
+    conn.commit()
+    conn.close()
+    spread = backend.shard_router.assign([f"SB-{o:02d}-000" for o in range(args.writers)])
+    backend.shard_router.close()
+
+    # Writer memakai konteks spawn: koneksi SQLite tidak boleh diwariskan lewat fork
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    deadline = time.time() + args.duration + 2.0  # + waktu import backend di proses writer
+    procs = [ctx.Process(target=writer, args=(owner, args.boxes, args.batch_size, deadline, results))
+             for owner in range(args.writers)]
+    for p in procs:
+        p.start()
+    per_writer = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    rows = sum(w["rows"] for w in per_writer)
+    latencies = [lat for w in per_writer for lat in w["latencies"]]
+    # Durasi efektif = total waktu batch per writer (tanpa waktu import)
+    elapsed = max(sum(w["latencies"]) for w in per_writer)
+
+    backend = import_backend()
+    backend.initialize_database()
+    router = backend.shard_router
+    fanout = {}
+    for name, fn in (
+        ("devices", lambda: router.fan_out(lambda conn, shard: [
+            row[0] for row in conn.execute("SELECT DISTINCT box_id FROM smartbox_data")])),
+        ("count_per_box", lambda: router.fan_out(lambda conn, shard: conn.execute(
+            "SELECT box_id, COUNT(*) FROM smartbox_data GROUP BY box_id").fetchall())),
+    ):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        fanout[name] = {"p50_ms": round(percentile(timings, 50) * 1000, 2),
+                        "max_ms": round(max(timings) * 1000, 2)}
+
+    # Scan penuh ter-merge urut id (jalur bulk export)
+    from shards import MergedCursor
+    conns = [router.connection(shard.index) for shard in router.shards]
+    start = time.perf_counter()
+    cursor = MergedCursor([c.execute("SELECT * FROM smartbox_data ORDER BY id") for c in conns])
+    scanned = 0
+    while True:
+        chunk = cursor.fetchmany(5000)
+        if not chunk:
+            break
+        scanned += len(chunk)
+    scan_seconds = time.perf_counter() - start
+    cursor.close()
+    for c in conns:
+        c.close()
+    router.close()
+
+    return {
+        "shards": args.shard_count,
+        "owners_per_shard": [list(spread.values()).count(i) for i in range(args.shard_count)],
+        "rows": rows,
+        "batches": len(latencies),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else 0.0,
+        "batch_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "batch_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "fanout": fanout,
+        "merged_scan": {"rows": scanned, "rows_per_s": round(scanned / scan_seconds, 1) if scan_seconds else 0.0},
+    }
+
+
+# ==============================================================================
+# MAIN
+# ==============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharding SmartBox")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--writers", type=int, default=8, help="Jumlah proses writer (satu owner per writer)")
+    parser.add_argument("--boxes", type=int, default=25, help="Box per owner")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--repeat", type=int, default=20, help="Pengulangan query fan-out")
+    parser.add_argument("--out", help="File JSON hasil (default: benchmarks/results/shards-<waktu>.json)")
+    parser.add_argument("--shard-count", type=int, help=argparse.SUPPRESS)  # mode proses anak
+    args = parser.parse_args()
+
+    if args.shard_count is not None:
+        print(json.dumps(run_shard_count(args)))
+        return
+
+    results = []
+    for count in args.shards:
+        tmpdir = tempfile.mkdtemp(prefix=f"smartbox-shards-{count}-")
+        env = dict(os.environ, DB_FILE=os.path.join(tmpdir, "bench.db"), SHARD_COUNT=str(count),
+                   SHARD_DIR=os.path.join(tmpdir, "shards"), PARTITION_DIR=os.path.join(tmpdir, "partitions"),
+                   LOG_LEVEL="WARNING")
+        argv = [sys.executable, os.path.abspath(__file__), "--shard-count", str(count),
+                "--writers", str(args.writers), "--boxes", str(args.boxes), "--batch-size", str(args.batch_size),
+                "--duration", str(args.duration), "--repeat", str(args.repeat)]
+        output = subprocess.run(argv, env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"SHARD_COUNT={count:<2} owner/shard={result['owners_per_shard']} "
+              f"ingest={result['rows_per_s']:>9.0f} rows/s  batch p50={result['batch_p50_ms']:>7.1f}ms "
+              f"p99={result['batch_p99_ms']:>7.1f}ms  devices={result['fanout']['devices']['p50_ms']:>6.1f}ms  "
+              f"scan={result['merged_scan']['rows_per_s']:>9.0f} rows/s")
+
+    base = results[0]["rows_per_s"] or 1.0
+    for result in results:
+        result["speedup"] = round(result["rows_per_s"] / base, 2)
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "params": {k: v for k, v in vars(args).items() if k not in ("shard_count", "out")},
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"shards-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Speedup ingest vs {args.shards[0]} shard: " + ", ".join(f"{r['shards']}={r['speedup']}x" for r in results))
+    print(f"Hasil: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""
+Benchmark end-to-end backend SmartBox.
+
+1. Seed database sintetis (boxes x riwayat) sekali, bisa dipakai ulang (--db).
+2. Jalankan fase beban lewat Flask test client dengan N thread:
+     api     : request API saja
+     ingest  : ingest saja (IngestPipeline, rate tertentu)
+     mixed   : API + ingest bersamaan -> kelihatan efek lock contention SQLite
+3. Simpan hasil (latency p50/p90/p99, throughput per endpoint, statistik pool
+   & ingest) sebagai JSON untuk dibandingkan antar run (--compare).
+4. Opsional: --profile (cProfile per fase, .prof) dan --flame (sampling
+   stack ala py-spy, format "folded" untuk flamegraph.pl / speedscope).
+
+Cara menjalankan (dari folder backend):
+    python benchmarks/bench_suite.py --boxes 200 --days 2 --threads 8 --duration 15
+    python benchmarks/bench_suite.py --db /tmp/bench.db --compare benchmarks/results/suite-old.json
+    python benchmarks/bench_suite.py --phases mixed --profile /tmp/prof --flame /tmp/prof
+"""
+import argparse
+import cProfile
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import pstats
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+BENCH_USER = "bench_mitra"
+FLEET_SAMPLE = 50
+
+# nama -> (bobot, butuh token)
+ENDPOINTS = {
+    "data_latest": (40, True),
+    "data_100": (20, True),
+    "fleet_latest": (15, True),
+    "fleet_bbox": (8, True),
+    "history_1h": (10, True),
+    "alerts_active": (8, True),
+    "dashboard": (5, True),
+    "export_6h": (2, True),
+}
+
+
+# ==============================================================================
+# SEED DATABASE
+# ==============================================================================
+
+def seed_database(backend, boxes, days, interval, seed):
+    """Isi smartbox_data dengan riwayat sintetis yang berakhir 'sekarang'."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(backend.DB_FILE)
+    end = int(time.time())
+    start = end - days * 86400
+    steps = range(start, end, interval)
+    total = 0
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        for b in range(1, boxes + 1):
+            box_id = f"BENCH-{b:05d}"
+            lat, lon = rng.uniform(-6.65, -6.10), rng.uniform(106.50, 107.15)
+            rows = []
+            for ts in steps:
+                lat += rng.uniform(-0.0005, 0.0005)
+                lon += rng.uniform(-0.0005, 0.0005)
+                rows.append((box_id, round(rng.uniform(2.0, 9.0), 2), round(rng.uniform(45.0, 65.0), 2),
+                             lat, lon, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))))
+            conn.executemany("""
+                INSERT INTO smartbox_data (box_id, temperature, humidity, latitude, longitude, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            total += len(rows)
+        # Satu mitra pemilik semua box (untuk endpoint yang butuh token)
+        conn.execute("""
+            INSERT OR IGNORE INTO users (username, email, password_hash, role, is_approved)
+            VALUES (?, 'bench@smartbox.id', 'x', 'admin', 1)
+        """, (BENCH_USER,))
+        user_id = conn.execute("SELECT id FROM users WHERE username = ?", (BENCH_USER,)).fetchone()[0]
+        conn.executemany(
+            "INSERT OR IGNORE INTO box_ownership (user_id, box_id, label) VALUES (?, ?, ?)",
+            [(user_id, f"BENCH-{b:05d}", f"Bench {b}") for b in range(1, boxes + 1)]
+        )
+        from rollups import backfill_rollups
+        from spatial import backfill_positions
+        backfill_rollups(conn)
+        backfill_positions(conn)
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return total
+
+
+def bench_token(backend):
+    conn = sqlite3.connect(backend.DB_FILE)
+    try:
+        user_id = conn.execute("SELECT id FROM users WHERE username = ?", (BENCH_USER,)).fetchone()[0]
+    finally:
+        conn.close()
+    import jwt
+    return jwt.encode({"user_id": user_id, "username": BENCH_USER, "role": "admin",
+                       "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=12)},
+                      backend.JWT_SECRET, algorithm="HS256")
+
+
+def list_boxes(backend):
+    conn = sqlite3.connect(backend.DB_FILE)
+    try:
+        return [r[0] for r in conn.execute("SELECT DISTINCT box_id FROM smartbox_data")]
+    finally:
+        conn.close()
+
+
+# ==============================================================================
+# PROFILING
+# ==============================================================================
+
+class StackSampler:
+    """Sampling stack thread tertentu (mirip py-spy), hasil dalam format folded."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread_ids = set()
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in self.thread_ids:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# ==============================================================================
+# BEBAN
+# ==============================================================================
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def pick(pct):
+        return round(values[min(len(values) - 1, int(pct / 100 * len(values)))] * 1000, 2)
+
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": round(values[-1] * 1000, 2)}
+
+
+def make_url(name, box_id, boxes, rng, now):
+    if name == "data_latest":
+        return f"/api/data/{box_id}?limit=1"
+    if name == "data_100":
+        return f"/api/data/{box_id}?limit=100"
+    if name == "fleet_latest":
+        return "/api/fleet/latest?box_ids=" + ",".join(rng.sample(boxes, min(FLEET_SAMPLE, len(boxes))))
+    if name == "fleet_bbox":
+        # Viewport peta ~5 x 5 km di area seed
+        lat, lon = rng.uniform(-6.65, -6.15), rng.uniform(106.50, 107.10)
+        return f"/api/fleet/positions?bbox={lon},{lat},{lon + 0.045},{lat + 0.045}"
+    if name == "history_1h":
+        return f"/api/history/{box_id}?resolution=1h&start={now - 86400}"
+    if name == "alerts_active":
+        return "/api/alerts?active=1"
+    if name == "dashboard":
+        return "/api/my-dashboard-data"
+    if name == "export_6h":
+        return f"/api/export/{box_id}?start={now - 6 * 3600}"
+    raise ValueError(name)
+
+
+def api_worker(index, backend, args, boxes, token, deadline, results, profilers, sampler):
+    rng = random.Random(args.seed + index)
+    names = [n for n in args.endpoints]
+    weights = [ENDPOINTS[n][0] for n in names]
+    client = backend.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = defaultdict(list)
+    errors = Counter()
+    locked = 0
+    profiler = cProfile.Profile() if args.profile else None
+    if sampler:
+        sampler.thread_ids.add(threading.get_ident())
+    if profiler:
+        profiler.enable()
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        url = make_url(name, rng.choice(boxes), boxes, rng, int(time.time()))
+        start = time.perf_counter()
+        response = client.get(url, headers=headers if ENDPOINTS[name][1] else None)
+        body = response.get_data()
+        response.close()
+        latencies[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors[name] += 1
+            if b"locked" in body:
+                locked += 1
+    if profiler:
+        profiler.disable()
+        profilers.append(profiler)
+    results.append((latencies, errors, locked))
+
+
+def make_payload(rng, boxes):
+    return {
+        "box_id": rng.choice(boxes),
+        "temperature": round(rng.uniform(2.0, 9.0), 2),
+        "humidity": round(rng.uniform(45.0, 65.0), 2),
+        "latitude": rng.uniform(-6.65, -6.10),
+        "longitude": rng.uniform(106.50, 107.15),
+    }
+
+
+def run_ingest(backend, args, boxes, deadline, sampler, profilers):
+    """Kirim payload ke IngestPipeline dengan rate tetap; ukur latency per batch."""
+    from ingest import IngestPipeline
+    batch_times = []
+
+    def timed_write(payloads):
+        if sampler:
+            sampler.thread_ids.add(threading.get_ident())
+        start = time.perf_counter()
+        backend.write_ingest_batch(payloads)
+        batch_times.append(time.perf_counter() - start)
+
+    pipeline = IngestPipeline(
+        timed_write,
+        max_queue=backend.INGEST_QUEUE_SIZE,
+        batch_size=backend.INGEST_BATCH_SIZE,
+        flush_interval=backend.INGEST_FLUSH_INTERVAL
+    )
+    rng = random.Random(args.seed)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    pipeline.start()
+    start = time.monotonic()
+    submitted = 0
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        due = int((now - start) * args.ingest_rate) - submitted
+        if due <= 0:
+            time.sleep(0.002)
+            continue
+        for _ in range(min(due, 1000)):
+            pipeline.submit(make_payload(rng, boxes))
+            submitted += 1
+    pipeline.stop(timeout=None)
+    elapsed = time.monotonic() - start
+    if profiler:
+        profiler.disable()
+        profilers.append(profiler)
+    stats = pipeline.stats()
+    return {
+        "target_rate": args.ingest_rate,
+        "submitted": submitted,
+        "written": stats["written"],
+        "dropped": stats["dropped"],
+        "failed": stats["failed"],
+        "backpressure_waits": stats["backpressure_waits"],
+        "rows_per_sec": round(stats["written"] / elapsed) if elapsed else 0,
+        "batches": stats["batches"],
+        "batch_write_ms": percentiles(batch_times),
+    }
+
+
+def diff_stats(before, after):
+    return {k: round(after[k] - before[k], 3) for k in after
+            if isinstance(after[k], (int, float)) and not isinstance(after[k], bool) and k in before}
+
+
+def run_phase(phase, backend, args, boxes, token):
+    with_api = phase in ("api", "mixed")
+    with_ingest = phase in ("ingest", "mixed")
+    sampler = StackSampler() if args.flame else None
+    profilers = []
+    results = []
+    pool_before = backend.db_pool.stats()
+    deadline = time.monotonic() + args.duration
+
+    threads = []
+    if with_api:
+        threads = [threading.Thread(target=api_worker, name=f"bench-api-{i}",
+                                    args=(i, backend, args, boxes, token, deadline, results, profilers, sampler))
+                   for i in range(args.threads)]
+    if sampler:
+        sampler.start()
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    ingest = run_ingest(backend, args, boxes, deadline, sampler, profilers) if with_ingest else None
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    if sampler:
+        sampler.stop()
+
+    endpoints = {}
+    if with_api:
+        merged = defaultdict(list)
+        errors = Counter()
+        locked = 0
+        for latencies, errs, lock_errors in results:
+            for name, values in latencies.items():
+                merged[name].extend(values)
+            errors.update(errs)
+            locked += lock_errors
+        for name in args.endpoints:
+            values = merged.get(name, [])
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": errors[name],
+                "rps": round(len(values) / elapsed, 1),
+                "latency_ms": percentiles(values),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        endpoints["_total"] = {"requests": total, "rps": round(total / elapsed, 1), "locked_errors": locked}
+
+    result = {
+        "duration_s": round(elapsed, 2),
+        "endpoints": endpoints,
+        "ingest": ingest,
+        "db_pool": diff_stats(pool_before, backend.db_pool.stats()),
+    }
+
+    if args.profile and profilers:
+        os.makedirs(args.profile, exist_ok=True)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        path = os.path.join(args.profile, f"{phase}.prof")
+        stats.dump_stats(path)
+        result["profile"] = path
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(args.profile_top)
+        result["profile_top"] = out.getvalue()
+    if sampler:
+        os.makedirs(args.flame, exist_ok=True)
+        path = os.path.join(args.flame, f"{phase}.folded")
+        sampler.write(path)
+        result["flame"] = path
+    return result
+
+
+# ==============================================================================
+# OUTPUT
+# ==============================================================================
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_phase(phase, result, baseline=None):
+    print(f"\n== {phase} ({result['duration_s']}s) ==")
+    if result["endpoints"]:
+        print(f"{'endpoint':<16}{'req':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, e in result["endpoints"].items():
+            if name == "_total":
+                continue
+            lat = e["latency_ms"]
+            line = (f"{name:<16}{e['requests']:>8}{e['errors']:>6}{e['rps']:>9}"
+                    f"{lat['p50'] or 0:>10}{lat['p90'] or 0:>10}{lat['p99'] or 0:>10}{lat['max'] or 0:>10}")
+            old = (baseline or {}).get("endpoints", {}).get(name)
+            if old and old["latency_ms"]["p50"] and lat["p50"]:
+                change = (lat["p50"] - old["latency_ms"]["p50"]) / old["latency_ms"]["p50"] * 100
+                line += f"   p50 {change:+.0f}% vs baseline"
+            print(line)
+        total = result["endpoints"]["_total"]
+        print(f"{'total':<16}{total['requests']:>8}{'':>6}{total['rps']:>9}   locked errors: {total['locked_errors']}")
+    if result["ingest"]:
+        i = result["ingest"]
+        b = i["batch_write_ms"]
+        line = (f"ingest: {i['written']}/{i['submitted']} rows, {i['rows_per_sec']} rows/s, "
+                f"dropped={i['dropped']} batch p50={b['p50']}ms p99={b['p99']}ms")
+        old = (baseline or {}).get("ingest")
+        if old and old["batch_write_ms"]["p99"] and b["p99"]:
+            line += f" (baseline p99={old['batch_write_ms']['p99']}ms)"
+        print(line)
+    pool = result["db_pool"]
+    print(f"db pool: checkouts={pool.get('checkouts')} waits={pool.get('waits')} "
+          f"wait_time_ms={pool.get('wait_time_ms')} timeouts={pool.get('timeouts')}")
+    if result.get("profile_top"):
+        print(result["profile_top"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end backend SmartBox")
+    parser.add_argument("--db", help="File database bench (dipakai ulang jika sudah ada)")
+    parser.add_argument("--boxes", type=int, default=100)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--interval", type=int, default=60, help="Detik antar data per box saat seed")
+    parser.add_argument("--phases", nargs="+", choices=["api", "ingest", "mixed"], default=["api", "ingest", "mixed"])
+    parser.add_argument("--threads", type=int, default=8, help="Thread client API")
+    parser.add_argument("--duration", type=float, default=10.0, help="Detik per fase")
+    parser.add_argument("--ingest-rate", type=float, default=2000, help="Target baris/detik ingest")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help=f"Endpoint yang diuji (pisahkan koma): {','.join(ENDPOINTS)}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="File hasil JSON (default: benchmarks/results/suite-<waktu>.json)")
+    parser.add_argument("--compare", help="File JSON hasil run sebelumnya sebagai baseline")
+    parser.add_argument("--profile", metavar="DIR", help="Simpan cProfile per fase (.prof)")
+    parser.add_argument("--profile-top", type=int, default=20)
+    parser.add_argument("--flame", metavar="DIR", help="Simpan sampling stack per fase (.folded)")
+    args = parser.parse_args()
+    args.endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in args.endpoints if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f"endpoint tidak dikenal: {', '.join(unknown)}")
+
+    db_file = args.db or os.path.join(tempfile.mkdtemp(prefix="smartbox-suite-"), "bench.db")
+    fresh = not os.path.exists(db_file)
+    os.environ["DB_FILE"] = os.path.abspath(db_file)
+    # Log startup backend tidak ikut mengotori output benchmark
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backend
+        backend.initialize_database()
+
+    if fresh:
+        start = time.perf_counter()
+        rows = seed_database(backend, args.boxes, args.days, args.interval, args.seed)
+        print(f"Seeded {rows} rows ({args.boxes} boxes x {args.days} days) in {time.perf_counter() - start:.1f}s -> {db_file}")
+    else:
+        print(f"Reusing {db_file}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        backend.warm_latest_cache()
+        backend.load_alert_engine()
+    boxes = list_boxes(backend)
+    token = bench_token(backend)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = {
+        "meta": {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("compare",)},
+        },
+        "phases": {},
+    }
+    conn = sqlite3.connect(backend.DB_FILE)
+    report["meta"]["db_rows"] = conn.execute("SELECT COUNT(*) FROM smartbox_data").fetchone()[0]
+    conn.close()
+
+    for phase in args.phases:
+        # Output print per batch/alert dari backend tidak ikut diukur ke terminal
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_phase(phase, backend, args, boxes, token)
+        report["phases"][phase] = result
+        print_phase(phase, result, (baseline or {}).get("phases", {}).get(phase))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"suite-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from collections import deque
+
+from app_logging import get_logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow opsional, hanya untuk format arrow/parquet
+    pa = None
+    pq = None
+
+log = get_logger("export")
+
+# ==============================================================================
+# BULK EXPORT (NDJSON / ARROW IPC / PARQUET)
+# ==============================================================================
+# Export lintas box untuk kebutuhan analitik. Data dibaca dari SQLite dalam
+# chunk besar (fetchmany), lalu setiap chunk diubah sekaligus menjadi satu
+# blok output: satu record batch Arrow / row group Parquet, atau satu blok
+# NDJSON. Memori dibatasi oleh ukuran chunk, bukan total baris.
+
+COLUMNS = ("id", "box_id", "timestamp", "temperature", "humidity", "latitude", "longitude")
+CHUNK_ROWS = 32768
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def format_available(fmt) -> bool:
+    return fmt == "ndjson" or (fmt in FORMATS and pa is not None)
+
+
+def iter_chunks(cursor, chunk_rows=CHUNK_ROWS):
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+
+class _Sink:
+    """File-like minimal untuk writer pyarrow; byte yang ditulis diambil per blok."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("box_id", pa.string()),
+        ("timestamp", pa.string()),
+        ("temperature", pa.float64()),
+        ("humidity", pa.float64()),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+    ])
+
+
+def _record_batch(schema, rows):
+    # Transpose chunk baris -> kolom sekali jalan, lalu bangun array per kolom
+    columns = list(zip(*rows))
+    arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def ndjson_blocks(chunks, counter):
+    # Baris JSON dirakit dengan template, bukan json.dumps(dict) per baris.
+    # String (box_id, timestamp) sangat berulang, jadi hasil escape-nya di-cache.
+    quoted = {}
+
+    def q(value):
+        if value is None:
+            return "null"
+        text = quoted.get(value)
+        if text is None:
+            if len(quoted) > 100000:
+                quoted.clear()
+            text = quoted[value] = json.dumps(value)
+        return text
+
+    def n(value):
+        return "null" if value is None else repr(float(value))
+
+    for rows in chunks:
+        counter(len(rows))
+        lines = [
+            f'{{"id":{r[0]},"box_id":{q(r[1])},"timestamp":{q(r[2])},'
+            f'"temperature":{n(r[3])},"humidity":{n(r[4])},'
+            f'"latitude":{n(r[5])},"longitude":{n(r[6])}}}'
+            for r in rows
+        ]
+        lines.append("")
+        yield "\n".join(lines).encode("utf-8")
+
+
+def arrow_blocks(chunks, counter):
+    schema = _arrow_schema()
+    sink = _Sink()
+    writer = pa.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        counter(len(rows))
+        writer.write_batch(_record_batch(schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def parquet_blocks(chunks, counter):
+    schema = _arrow_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for rows in chunks:
+        counter(len(rows))
+        # Satu chunk = satu row group
+        writer.write_table(pa.Table.from_batches([_record_batch(schema, rows)]))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    "ndjson": ndjson_blocks,
+    "arrow": arrow_blocks,
+    "parquet": parquet_blocks,
+}
+
+
+class ExportStats:
+    """Catat throughput export terakhir (rows/s, bytes/s)."""
+
+    def __init__(self, keep=20):
+        self._recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._totals = {"exports": 0, "rows": 0, "bytes": 0}
+
+    def record(self, entry):
+        with self._lock:
+            self._recent.append(entry)
+            self._totals["exports"] += 1
+            self._totals["rows"] += entry["rows"]
+            self._totals["bytes"] += entry["bytes"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._totals, "recent": list(self._recent)}
+
+
+def export_blocks(cursor, fmt, stats=None, label=None, chunk_rows=CHUNK_ROWS):
+    """Generator blok output untuk cursor yang sudah di-execute (kolom = COLUMNS)."""
+    counts = {"rows": 0, "bytes": 0}
+
+    def count_rows(n):
+        counts["rows"] += n
+
+    start = time.perf_counter()
+    try:
+        for block in WRITERS[fmt](iter_chunks(cursor, chunk_rows), count_rows):
+            counts["bytes"] += len(block)
+            yield block
+    finally:
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        entry = {
+            "label": label,
+            "format": fmt,
+            "rows": counts["rows"],
+            "bytes": counts["bytes"],
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(counts["rows"] / elapsed),
+            "mb_per_sec": round(counts["bytes"] / elapsed / 2**20, 2),
+        }
+        if stats is not None:
+            stats.record(entry)
+        log.info("bulk export finished", label=label, format=fmt, rows=entry["rows"],
+                 bytes=entry["bytes"], rows_per_sec=entry["rows_per_sec"])
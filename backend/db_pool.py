@@ -0,0 +1,242 @@
+import queue
+import sqlite3
+import threading
+import time
+
+# ==============================================================================
+# SQLITE CONNECTION POOL
+# ==============================================================================
+# Koneksi dipakai ulang antar request (tidak connect/close setiap kali),
+# dengan PRAGMA yang di-tuning sekali saat koneksi dibuat. Statement yang
+# sama otomatis dipakai ulang lewat cache prepared statement milik sqlite3
+# (parameter `cached_statements`) selama koneksinya tetap hidup.
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Semua koneksi sedang dipakai selama checkout_timeout (error sementara)."""
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor yang melaporkan waktu execute/fetch ke query_observer pool."""
+
+    def _observe(self, started):
+        observer = self.connection.query_observer
+        if observer is not None:
+            observer(time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._observe(started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._observe(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._observe(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Koneksi yang semua cursor-nya TimedCursor (termasuk conn.execute)."""
+
+    query_observer = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class PooledConnection:
+    """Proxy koneksi sqlite3: close() mengembalikan koneksi ke pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    def __init__(self, db_file, max_size=8, checkout_timeout=10.0,
+                 synchronous="NORMAL", busy_timeout_ms=5000,
+                 mmap_size=256 * 1024 * 1024, cache_size_kb=16000,
+                 statement_cache=256, journal_mode="WAL", query_observer=None, read_only=False):
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {synchronous}")
+        self.db_file = db_file
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache = statement_cache
+        self.journal_mode = journal_mode
+        # read_only: pool khusus pembaca panjang (export); PRAGMA query_only
+        self.read_only = read_only
+        # query_observer(detik) dipanggil setiap execute/fetch (untuk metrics)
+        self.query_observer = query_observer
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {
+            "checkouts": 0,
+            "reuse_hits": 0,
+            "created": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+            factory=TimedConnection if self.query_observer else sqlite3.Connection
+        )
+        if self.query_observer:
+            conn.query_observer = self.query_observer
+        conn.row_factory = sqlite3.Row
+        if self.read_only:
+            # journal_mode diatur pool penulis; koneksi ini tidak boleh menulis
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        # Nilai negatif = ukuran dalam KiB, bukan jumlah halaman
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def acquire(self):
+        """Ambil koneksi dari pool (buat baru jika pool belum penuh)."""
+        self._count("checkouts")
+        try:
+            conn = self._idle.get_nowait()
+            self._count("reuse_hits")
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._count("created")
+            return conn
+
+        # Pool penuh: tunggu koneksi dikembalikan
+        self._count("waits")
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            self._count("timeouts")
+            raise PoolTimeout("Timed out waiting for a database connection")
+        finally:
+            self._count("wait_time_ms", (time.perf_counter() - start) * 1000.0)
+        self._count("reuse_hits")
+        return conn
+
+    def release(self, conn):
+        """Kembalikan koneksi ke pool; transaksi yang masih terbuka di-rollback."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Koneksi rusak, jangan dipakai ulang
+            self._count("discarded")
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+    def connection(self):
+        return PooledConnection(self, self.acquire())
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["open_connections"] = self._created
+        data["wait_time_ms"] = round(data["wait_time_ms"], 3)
+        data["idle_connections"] = self._idle.qsize()
+        data["max_size"] = self.max_size
+        data["checkout_timeout"] = self.checkout_timeout
+        data["synchronous"] = self.synchronous
+        return data
@@ -0,0 +1,116 @@
+import csv
+import io
+import threading
+import zlib
+from collections import OrderedDict
+
+# ==============================================================================
+# STREAMING EXPORT
+# ==============================================================================
+# Baris dibaca dari cursor per chunk (fetchmany) dan ditulis ke CSV dalam blok
+# besar, jadi pemakaian memori tetap datar berapa pun jumlah baris export.
+
+FETCH_SIZE = 2000
+BLOCK_SIZE = 64 * 1024
+
+
+def iter_rows(cursor, fetch_size=FETCH_SIZE):
+    """Iterasi cursor yang sudah di-execute, chunk demi chunk."""
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def csv_blocks(rows, header, columns, block_size=BLOCK_SIZE):
+    """Tulis rows sebagai CSV (UTF-8) dan yield per blok ~block_size byte."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+        if buffer.tell() >= block_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_blocks(blocks, level=6):
+    """Kompres aliran blok menjadi satu file gzip (output deterministik)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for block in blocks:
+        out = compressor.compress(block)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def slice_blocks(blocks, start, end=None):
+    """Ambil byte [start, end] (inklusif) dari aliran blok, untuk request Range."""
+    position = 0
+    for block in blocks:
+        block_end = position + len(block)
+        if block_end > start:
+            lo = max(start - position, 0)
+            hi = len(block) if end is None else min(end + 1 - position, len(block))
+            if hi > lo:
+                yield block[lo:hi]
+        position = block_end
+        if end is not None and position > end:
+            return
+
+
+def count_bytes(blocks) -> int:
+    return sum(len(block) for block in blocks)
+
+
+def record_size(blocks, on_complete):
+    """Teruskan blok; on_complete(total byte) dipanggil jika aliran selesai utuh."""
+    total = 0
+    for block in blocks:
+        total += len(block)
+        yield block
+    on_complete(total)
+
+
+class SizeCache:
+    """
+    Ukuran file export per snapshot (LRU kecil). Isi export dengan snapshot
+    yang sama selalu identik, jadi request Range tidak perlu merender ulang
+    seluruh export hanya untuk mengetahui total ukurannya.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._sizes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            size = self._sizes.get(key)
+            if size is not None:
+                self._sizes.move_to_end(key)
+            return size
+
+    def put(self, key, size):
+        with self._lock:
+            self._sizes[key] = size
+            self._sizes.move_to_end(key)
+            while len(self._sizes) > self.max_entries:
+                self._sizes.popitem(last=False)
+
+
+def parse_range(header):
+    """'bytes=START-[END]' -> (start, end|None). Selain itu (multi-range, suffix) -> None."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    start, _, end = spec.partition("-")
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    return int(start), (int(end) if end else None)
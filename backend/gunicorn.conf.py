@@ -0,0 +1,50 @@
+"""
+Konfigurasi gunicorn untuk SmartBox API.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Lebih dari satu worker: INGEST_LEADER_LOCK diisi otomatis sehingga hanya satu
+worker (leader) yang subscribe MQTT, menulis ingest, menyimpan alert dan
+menjalankan retention. Worker lain mengikuti data baru dari DB dan mengambil
+alih jika leader berhenti.
+"""
+import os
+import signal
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'))
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '5000')}"
+workers = int(os.getenv("WEB_WORKERS", min(4, (os.cpu_count() or 1) * 2)))
+# gthread: stream SSE memegang satu thread selama client terhubung
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 32))
+# Tanpa preload: thread background & koneksi SQLite dibuat di tiap worker setelah fork
+preload_app = False
+# Waktu untuk flush antrian ingest sebelum worker dipaksa berhenti
+graceful_timeout = int(float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30))) + 10
+keepalive = 5
+
+if workers > 1:
+    os.environ.setdefault("INGEST_LEADER_LOCK", "smartbox_ingest.lock")
+
+
+def post_worker_init(worker):
+    import backend
+
+    stop_worker = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        # Readiness langsung 503, MQTT berhenti dan stream SSE ditutup;
+        # tanpa ini worker menunggu client SSE sampai graceful_timeout
+        backend.begin_drain()
+        stop_worker(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    # Setelah request terakhir selesai: flush ingest, lepas lock leader, tutup koneksi
+    import backend
+    backend.stop_services()
@@ -0,0 +1,163 @@
+import gzip
+import threading
+import time
+from email.utils import formatdate
+
+try:
+    import brotli
+except ImportError:  # brotli opsional; tanpa modul ini hanya gzip yang ditawarkan
+    brotli = None
+
+# ==============================================================================
+# CONDITIONAL REQUEST & CACHE RESPONSE JSON
+# ==============================================================================
+# Endpoint polling (data box, dashboard, daftar device) memberi ETag yang
+# diturunkan dari id baris terakhir yang sudah di-ingest. Polling tanpa data
+# baru cukup dijawab 304 tanpa body. Body JSON yang sudah dibuat (plus versi
+# terkompresinya) disimpan sebentar di ResponseCache dan dibuang oleh jalur
+# ingest saat box terkait menerima data baru.
+
+# Tag untuk entry yang bergantung pada semua box (mis. daftar device)
+ALL_BOXES = "*"
+
+
+def make_etag(*parts) -> str:
+    """ETag weak: isi sama walau encoding (gzip/br) berbeda."""
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Perbandingan weak: abaikan prefix W/
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == wanted:
+            return True
+    return False
+
+
+def http_date(epoch) -> str:
+    return formatdate(epoch, usegmt=True)
+
+
+def negotiate_encoding(accept_encoding) -> str:
+    """Pilih 'br', 'gzip' atau None dari header Accept-Encoding (q=0 = ditolak)."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip().lower()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=5)
+
+
+class CachedResponse:
+    def __init__(self, body, etag, last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding) -> bytes:
+        """Body terkompresi; dihitung sekali per encoding lalu dipakai ulang."""
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                data = self._encoded[encoding] = compress(self.body, encoding)
+            return data
+
+
+class ResponseCache:
+    def __init__(self, ttl=5.0, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidated": 0, "not_modified": 0}
+
+    def get(self, key, etag=None):
+        """Entry yang masih berlaku (dan ETag-nya sama jika diberikan), atau None."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > now and (etag is None or item[0].etag == etag):
+                self._stats["hits"] += 1
+                return item[0]
+            if item is not None:
+                self._drop(key)
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, entry, tags=()):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._evict_expired()
+                if len(self._entries) >= self.max_entries:
+                    self._drop(next(iter(self._entries)))
+            self._drop(key)
+            self._entries[key] = (entry, time.monotonic() + self.ttl, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, box_ids):
+        """Dipanggil jalur ingest: buang entry milik box tersebut + entry lintas box."""
+        with self._lock:
+            keys = set(self._tags.get(ALL_BOXES, ()))
+            for box_id in box_ids:
+                keys.update(self._tags.get(box_id, ()))
+            for key in keys:
+                self._drop(key)
+            self._stats["invalidated"] += len(keys)
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats["not_modified"] += 1
+
+    def _drop(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, item in self._entries.items() if item[1] <= now]:
+            self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["entries"] = len(self._entries)
+            lookups = data["hits"] + data["misses"]
+            data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else 0.0
+            data["encodings"] = ["br", "gzip"] if brotli is not None else ["gzip"]
+        return data
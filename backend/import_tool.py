@@ -0,0 +1,526 @@
+"""
+SmartBox Import Tool
+
+Import data historis secara massal: backfill data yang tertahan di perangkat,
+migrasi dari database lama, atau replay rekaman MQTT. Validasi, deduplikasi
+(box_id, seq), rollup, posisi peta dan routing shard sama dengan ingest live;
+bedanya baris ditulis dalam transaksi besar dan input dibaca secara streaming.
+
+Format input (dideteksi dari ekstensi, boleh .gz):
+    .ndjson / .jsonl / .json : satu reading JSON per baris (payload MQTT atau output /api/bulk-export)
+    .csv                     : header wajib; format /api/export/<box_id> didukung
+                               (box_id dari --box-id atau nama file <box_id>_report.csv)
+    .cap / .capture / .txt   : rekaman MQTT "<epoch> <topic> <payload hex>",
+                               hasil `import_tool.py record` atau `mosquitto_sub -F "%U %t %x"`
+
+Cara menjalankan (dari folder backend, dengan konfigurasi DB/SHARD_* yang sama dengan server):
+    python import_tool.py load data_2024.ndjson.gz SMARTBOX-001_report.csv
+    python import_tool.py load old_export.csv --box-id SMARTBOX-007 --batch-rows 50000
+    python import_tool.py load dump/*.ndjson --defer-indexes   # migrasi awal, server sebaiknya mati
+    python import_tool.py load capture.cap --dry-run           # validasi saja, tanpa menulis
+    python import_tool.py record --out capture.cap             # rekam topic MQTT untuk replay nanti
+
+Progres per file disimpan di checkpoint (default import_checkpoints.json di
+folder database) setelah setiap batch tersimpan. Jika import terhenti, jalankan
+perintah yang sama lagi: file dilanjutkan dari batch terakhir (--restart untuk
+mengulang dari awal). File yang checkpoint-nya sudah selesai dilewati.
+
+Reading tanpa seq (mis. CSV /api/export) tidak punya kunci idempotensi, jadi
+dibuang jika (box_id, timestamp)-nya sudah ada di database: tabel data dan
+partisi bulanan yang belum dikompres (.db.gz tidak dicek). Import ulang file
+yang sama (juga dengan --restart atau checkpoint lain) tidak menggandakan
+riwayat.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# Konfigurasi (DB_FILE, SHARD_*, MQTT_*) dan jalur simpan sama persis dengan server
+import backend
+from migrations import DEFERRABLE_INDEXES
+from payload_codec import decode_payload
+from retention import month_key
+from rollups import format_timestamp
+
+FORMATS = ("ndjson", "csv", "capture")
+EXTENSIONS = {
+    ".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "ndjson",
+    ".csv": "csv",
+    ".cap": "capture", ".capture": "capture", ".txt": "capture",
+}
+NUMERIC_FIELDS = ("temperature", "humidity", "latitude", "longitude")
+
+# Header CSV -> field payload. Termasuk header export per box (Waktu, Suhu (°C), ...)
+CSV_FIELDS = dict(zip((h.lower() for h in backend.EXPORT_HEADER), backend.EXPORT_COLUMNS))
+CSV_FIELDS.update({name: name for name in ("box_id", "timestamp", "ts", "seq") + NUMERIC_FIELDS})
+
+EXPORT_FILE_RE = re.compile(r"^(?P<box_id>.+)_report\.csv(\.gz)?$")
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(backend.DB_FILE), "import_checkpoints.json")
+
+
+def open_input(path):
+    """File biner (offset = byte hasil dekompresi, jadi bisa di-seek untuk resume)."""
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    return gzip.open(path, "rb") if magic == b"\x1f\x8b" else open(path, "rb")
+
+
+def detect_format(path):
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return EXTENSIONS.get(os.path.splitext(name)[1])
+
+
+# ==============================================================================
+# PARSER (STREAMING) -> (payload, received_at) / alasan ditolak
+# ==============================================================================
+
+class Rejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def number(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise Rejected("bad_value")
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise Rejected("bad_value") from None
+
+
+def parse_ndjson(line, received_at):
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise Rejected("invalid_json") from None
+    items = data if isinstance(data, list) else [data]
+    if not items or not all(isinstance(item, dict) for item in items):
+        raise Rejected("invalid_json")
+    return [(item, received_at) for item in items]
+
+
+def csv_parser(header, box_id):
+    """Parser satu baris CSV untuk header tertentu (kolom dipetakan sekali)."""
+    fields = [CSV_FIELDS.get(name.strip().lower()) for name in header]
+    if "box_id" not in fields and box_id is None:
+        raise SystemExit("CSV tanpa kolom box_id: gunakan --box-id atau nama file <box_id>_report.csv")
+    if "timestamp" not in fields and "ts" not in fields:
+        raise SystemExit("CSV tanpa kolom waktu (timestamp / ts / Waktu)")
+    columns = [(i, field) for i, field in enumerate(fields) if field is not None]
+
+    def parse(line, received_at):
+        # Export tidak memakai quote: split biasa jauh lebih cepat dari modul csv
+        values = next(csv.reader([line])) if '"' in line else line.rstrip("\r\n").split(",")
+        payload = {"box_id": box_id}
+        for i, field in columns:
+            value = values[i] if i < len(values) else ""
+            if field == "seq":
+                payload[field] = int(value) if value.isdigit() else None
+            elif field in NUMERIC_FIELDS:
+                payload[field] = number(value)
+            else:
+                payload[field] = value or None
+        return [(payload, received_at)]
+
+    return parse
+
+
+def parse_capture(line, received_at):
+    parts = line.split(None, 2)
+    try:
+        captured = float(parts[0])
+        raw = bytes.fromhex(parts[2].strip())
+        readings = decode_payload(raw)
+    except (IndexError, ValueError):
+        # PayloadError juga turunan ValueError
+        raise Rejected("invalid_payload") from None
+    epoch = int(captured)
+    for reading in readings:
+        # Reading tanpa waktu ukur: pakai waktu diterima broker saat direkam
+        if reading.get("ts") is None and reading.get("timestamp") is None:
+            reading["ts"] = epoch
+    stamp = format_timestamp(epoch)
+    return [(reading, stamp) for reading in readings]
+
+
+def validate(payload, received_at, now):
+    """
+    Validasi skema & rentang sama dengan ingest live (ingest_guard) + reading
+    historis wajib membawa waktu ukur. Box tak terdaftar & rate limit tidak
+    berlaku: import dijalankan operator, bukan publisher MQTT.
+    """
+    if not payload.get("box_id"):
+        raise Rejected("no_box_id")
+    reason = backend.validate_reading(payload)
+    if reason is not None:
+        raise Rejected(reason)
+    row, source = backend.build_sensor_row(payload, now, received_at)
+    if source == "server":
+        raise Rejected("no_timestamp")
+    if source == "rejected":
+        raise Rejected("bad_timestamp")
+    return row
+
+
+# ==============================================================================
+# READER THREAD: parse + validasi sambil writer menulis batch sebelumnya
+# ==============================================================================
+
+class Batch:
+    def __init__(self):
+        self.rows = []
+        self.rejected = Counter()
+        self.lines = 0
+        self.end_offset = 0
+
+
+def read_batches(path, fmt, start_offset, options, out):
+    """Isi antrian `out` dengan Batch; None = selesai, Exception = gagal."""
+    try:
+        now = int(time.time())
+        received_at = format_timestamp(now)
+        box_id = options.box_id
+        if box_id is None:
+            match = EXPORT_FILE_RE.match(os.path.basename(path))
+            box_id = match.group("box_id") if match else None
+
+        with open_input(path) as f:
+            offset = 0
+            if fmt == "csv":
+                header_line = f.readline()
+                offset = len(header_line)
+                header = next(csv.reader([header_line.decode("utf-8-sig")]))
+                parse = csv_parser(header, box_id)
+            else:
+                parse = parse_ndjson if fmt == "ndjson" else parse_capture
+            if start_offset > offset:
+                f.seek(start_offset)
+                offset = start_offset
+
+            batch = Batch()
+            for raw in f:
+                offset += len(raw)
+                batch.lines += 1
+                line = raw.decode("utf-8", errors="replace")
+                if line.strip():
+                    try:
+                        for payload, stamp in parse(line, received_at):
+                            try:
+                                batch.rows.append(validate(payload, stamp, now))
+                            except Rejected as e:
+                                batch.rejected[e.reason] += 1
+                    except Rejected as e:
+                        batch.rejected[e.reason] += 1
+                if len(batch.rows) >= options.batch_rows:
+                    batch.end_offset = offset
+                    out.put(batch)
+                    batch = Batch()
+            batch.end_offset = offset
+            out.put(batch)
+        out.put(None)
+    except BaseException as e:
+        out.put(e)
+
+
+# ==============================================================================
+# CHECKPOINT
+# ==============================================================================
+
+class Checkpoints:
+    """
+    {path: {size, mtime, offset, rows, done}} di satu file JSON (ditulis atomik).
+    Jika tool mati di tengah batch, batch itu diulang; baris yang sudah
+    tersimpan dibuang dedup (box_id, seq) / (box_id, timestamp).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def get(self, source):
+        stat = os.stat(source)
+        entry = self.data.get(source)
+        if entry and (entry["size"], entry["mtime"]) != (stat.st_size, stat.st_mtime):
+            print(f"[WARN] {source} berubah sejak checkpoint terakhir, import diulang dari awal")
+            entry = None
+        return entry
+
+    def put(self, source, **fields):
+        stat = os.stat(source)
+        entry = self.data.setdefault(source, {"offset": 0, "rows": 0, "done": False})
+        entry.update(fields, size=stat.st_size, mtime=stat.st_mtime, updated_at=int(time.time()))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+# ==============================================================================
+# WRITER
+# ==============================================================================
+
+# (box_id, timestamp) yang sudah tersimpan di rentang waktu batch: lewat index
+# (box_id, timestamp), atau satu scan per batch saat index di-drop (--defer-indexes)
+EXISTING_READING_QUERY = """
+    SELECT box_id, timestamp FROM smartbox_data
+    WHERE box_id IN (SELECT value FROM json_each(?)) AND timestamp BETWEEN ? AND ?
+"""
+
+
+def existing_readings(conn, shard, box_ids, start, end) -> set:
+    """(box_id, timestamp) di shard: tabel data + partisi bulanan (belum dikompres) di rentang tersebut."""
+    params = (json.dumps(box_ids), start, end)
+    found = {tuple(row) for row in conn.execute(EXISTING_READING_QUERY, params)}
+    for key, path in shard.partitions.list_partitions():
+        if not month_key(start) <= key <= month_key(end):
+            continue
+        part = shard.partitions.connect(path)
+        try:
+            found.update(tuple(row) for row in part.execute(EXISTING_READING_QUERY, params))
+        except sqlite3.OperationalError:
+            continue  # partisi sedang dikompres / dihapus
+        finally:
+            part.close()
+    return found
+
+
+def drop_existing(rows) -> list:
+    """
+    Baris tanpa seq tidak tersaring dedup (box_id, seq): buang yang
+    (box_id, timestamp)-nya sudah tersimpan atau muncul lebih dulu di batch
+    ini, sehingga import ulang / resume tidak menggandakan riwayat.
+    """
+    keys = [(row[0], row[5]) for row in rows if row[6] is None]
+    if not keys:
+        return rows
+    start = min(timestamp for _, timestamp in keys)
+    end = max(timestamp for _, timestamp in keys)
+    seen = set()
+    for found in backend.shard_router.fan_out_boxes(
+        {box_id for box_id, _ in keys},
+        lambda conn, shard, box_ids: existing_readings(conn, shard, box_ids, start, end),
+    ):
+        seen.update(found)
+    kept = []
+    for row in rows:
+        if row[6] is None:
+            key = (row[0], row[5])
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(row)
+    return kept
+
+
+def set_indexes(deferred):
+    """Drop (deferred=True) atau bangun ulang index sekunder di semua shard."""
+    def apply(conn, shard):
+        for name, sql in DEFERRABLE_INDEXES.items():
+            conn.execute(f"DROP INDEX IF EXISTS {name}" if deferred else sql)
+        conn.commit()
+    backend.shard_router.fan_out(apply)
+
+
+def import_file(path, fmt, checkpoints, options, totals):
+    entry = None if options.restart or options.dry_run else checkpoints.get(path)
+    if entry and entry["done"]:
+        print(f"[SKIP] {path}: sudah diimport ({entry['rows']} baris), --restart untuk mengulang")
+        return
+    start_offset = entry["offset"] if entry else 0
+    file_rows = entry["rows"] if entry else 0
+    if start_offset:
+        print(f"[RESUME] {path} dari byte {start_offset} ({file_rows} baris sudah tersimpan)")
+
+    batches = queue.Queue(maxsize=2)
+    reader = threading.Thread(target=read_batches, args=(path, fmt, start_offset, options, batches),
+                              name="import-reader", daemon=True)
+    reader.start()
+    started = time.monotonic()
+    last_report = started
+    file_stored = 0
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        if isinstance(batch, BaseException):
+            raise batch
+        totals["lines"] += batch.lines
+        totals["rejected"].update(batch.rejected)
+        rows = batch.rows
+        totals["valid"] += len(rows)
+        if not options.dry_run:
+            kept = drop_existing(rows)
+            totals["existing"] += len(rows) - len(kept)
+            rows = kept
+            stored = backend.store_sensor_rows(rows) if rows else []
+            totals["duplicates"] += len(rows) - len(stored)
+            file_stored += len(stored)
+            totals["stored"] += len(stored)
+            checkpoints.put(path, offset=batch.end_offset, rows=file_rows + file_stored)
+            if options.pause:
+                # Beri kesempatan writer ingest live mengambil write lock
+                time.sleep(options.pause)
+        now = time.monotonic()
+        if now - last_report >= options.progress:
+            rate = (file_stored if not options.dry_run else totals["valid"]) / (now - started)
+            print(f"[IMPORT] {path}: {file_rows + file_stored} baris, {rate:,.0f} rows/s")
+            last_report = now
+    reader.join()
+    if not options.dry_run:
+        checkpoints.put(path, rows=file_rows + file_stored, done=True)
+    elapsed = time.monotonic() - started
+    print(f"[DONE] {path}: {file_stored} baris tersimpan dalam {elapsed:.1f}s "
+          f"({file_stored / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+def cmd_load(options):
+    files = []
+    for path in options.files:
+        fmt = options.format or detect_format(path)
+        if fmt is None:
+            raise SystemExit(f"Format {path} tidak dikenali, gunakan --format {'/'.join(FORMATS)}")
+        files.append((os.path.abspath(path), fmt))
+
+    checkpoints = Checkpoints(options.checkpoint)
+    totals = {"lines": 0, "valid": 0, "stored": 0, "duplicates": 0, "existing": 0, "rejected": Counter()}
+    started = time.monotonic()
+    rebuild_seconds = 0.0
+    if options.defer_indexes and not options.dry_run:
+        print("[INDEX] index sekunder di-drop sampai import selesai")
+        set_indexes(deferred=True)
+    try:
+        for path, fmt in files:
+            import_file(path, fmt, checkpoints, options, totals)
+    finally:
+        if not options.dry_run:
+            # Selalu dipastikan ada, juga setelah run --defer-indexes yang terhenti
+            rebuild_started = time.monotonic()
+            set_indexes(deferred=False)
+            rebuild_seconds = time.monotonic() - rebuild_started
+            if options.defer_indexes:
+                print(f"[INDEX] index dibangun ulang dalam {rebuild_seconds:.1f}s")
+
+    elapsed = time.monotonic() - started
+    rejected = sum(totals["rejected"].values())
+    print(f"Baris input : {totals['lines']}")
+    print(f"Valid       : {totals['valid']}")
+    print(f"Ditolak     : {rejected} {dict(totals['rejected'].most_common())}")
+    if options.dry_run:
+        print(f"Dry run     : {totals['valid'] / elapsed if elapsed else 0:,.0f} rows/s (parse + validasi)")
+        return
+    print(f"Duplikat    : {totals['duplicates'] + totals['existing']} (seq {totals['duplicates']}, "
+          f"tanpa seq {totals['existing']})")
+    print(f"Tersimpan   : {totals['stored']} dalam {elapsed:.1f}s "
+          f"= {totals['stored'] / elapsed if elapsed else 0:,.0f} rows/s "
+          f"({totals['stored'] * 60 / elapsed / 1e6 if elapsed else 0:.2f} juta baris/menit)")
+
+
+# ==============================================================================
+# RECORD: rekam topic MQTT ke file capture
+# ==============================================================================
+
+def cmd_record(options):
+    import paho.mqtt.client as mqtt
+
+    out = open(options.out, "a", buffering=1024 * 1024)
+    lock = threading.Lock()
+    counts = {"messages": 0}
+
+    def on_connect(client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(options.topic, qos=options.qos)
+            print(f"[RECORD] {options.broker}:{options.port} topic {options.topic} -> {options.out}")
+
+    def on_message(client, userdata, msg):
+        with lock:
+            out.write(f"{time.time():.6f} {msg.topic} {msg.payload.hex()}\n")
+            counts["messages"] += 1
+
+    client = mqtt.Client(client_id=f"smartbox-recorder-{os.getpid()}-{int(time.time())}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect_async(options.broker, options.port, 60)
+    client.loop_start()
+    try:
+        while True:
+            time.sleep(5)
+            with lock:
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.disconnect()
+        client.loop_stop()
+        with lock:
+            out.close()
+    print(f"[RECORD] {counts['messages']} pesan direkam")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SmartBox bulk import (NDJSON / CSV / rekaman MQTT)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser(
+        "load", help="Import file ke database",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="Deduplikasi: reading ber-seq disaring (box_id, seq) seperti ingest live. Reading tanpa seq\n"
+               "(mis. CSV /api/export) dibuang jika (box_id, timestamp)-nya sudah ada di database (tabel data\n"
+               "dan partisi bulanan yang belum dikompres), jadi import ulang file yang sama tidak menggandakan\n"
+               "riwayat. File yang checkpoint-nya sudah selesai dilewati kecuali dengan --restart.",
+    )
+    load.add_argument("files", nargs="+")
+    load.add_argument("--format", choices=FORMATS, help="Paksa format (default: dari ekstensi)")
+    load.add_argument("--box-id", help="box_id untuk CSV tanpa kolom box_id")
+    load.add_argument("--batch-rows", type=int, default=20000, help="Baris per transaksi")
+    load.add_argument("--defer-indexes", action="store_true",
+                      help="Drop index sekunder selama import lalu bangun ulang (untuk migrasi besar)")
+    load.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    load.add_argument("--restart", action="store_true", help="Abaikan checkpoint, mulai dari awal file (baris yang sudah ada tetap dibuang dedup)")
+    load.add_argument("--dry-run", action="store_true", help="Parse & validasi saja")
+    load.add_argument("--pause", type=float, default=0.0, help="Jeda antar batch (detik)")
+    load.add_argument("--progress", type=float, default=5.0, help="Interval laporan progres (detik)")
+    load.set_defaults(run=cmd_load)
+
+    record = commands.add_parser("record", help="Rekam pesan MQTT ke file capture")
+    record.add_argument("--out", required=True)
+    record.add_argument("--broker", default=backend.MQTT_BROKER)
+    record.add_argument("--port", type=int, default=backend.MQTT_PORT)
+    record.add_argument("--topic", default=backend.MQTT_TOPIC)
+    record.add_argument("--qos", type=int, choices=[0, 1, 2], default=1)
+    record.set_defaults(run=cmd_record)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.command == "record":
+        options.run(options)
+        return
+    backend.initialize_database()
+    try:
+        options.run(options)
+    finally:
+        backend.shard_router.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from app_logging import get_logger
+
+log = get_logger("ingest")
+
+# ==============================================================================
+# INGEST PIPELINE (WRITE-BEHIND)
+# ==============================================================================
+# Callback MQTT hanya memasukkan payload ke antrian; satu thread writer
+# mengosongkan antrian dan menulis ke database per batch (satu transaksi).
+
+_STOP = object()
+
+# Lock, pool koneksi habis ("Timed out waiting for a database connection"),
+# disk penuh / I/O: database sementara tidak bisa ditulis, datanya tidak salah.
+# Batch diulang utuh dengan backoff, bukan dipecah per baris lalu dibuang.
+TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+
+def is_transient_error(error) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class PartialWriteError(Exception):
+    """
+    write_batch gagal setelah sebagian batch ter-commit (mis. satu dari
+    beberapa shard). `stored` = hasil yang sudah tersimpan, `failed_boxes` =
+    box_id yang payload-nya belum tersimpan dan boleh diulang.
+    """
+
+    def __init__(self, error, stored, failed_boxes):
+        super().__init__(str(error))
+        self.error = error
+        self.stored = stored
+        self.failed_boxes = failed_boxes
+
+
+class ReorderBuffer:
+    """
+    Buffer urutan per box untuk reading yang membawa 'seq'. Reading yang
+    datang mendahului seq yang hilang ditahan (maks. `window` detik atau
+    `max_pending` reading per box) menunggu celahnya terisi, lalu dilepas
+    urut seq. Reading tanpa seq, box yang belum dikenal, dan reading lama
+    (seq < yang ditunggu: terlambat setelah putus koneksi atau duplikat)
+    langsung diteruskan; duplikat disaring saat insert di database.
+    Seq yang turun lebih dari `restart_gap` di bawah yang ditunggu dianggap
+    counter perangkat mulai ulang (reboot / reflash / wrap): urutan box
+    dimulai lagi dari seq tersebut.
+
+    Item = (waktu masuk monotonic, payload), sama dengan isi antrian pipeline.
+    Hanya dipakai dari writer thread, jadi tanpa lock.
+    """
+
+    def __init__(self, window=2.0, max_pending=256, restart_gap=1000):
+        self.window = window
+        self.max_pending = max_pending
+        self.restart_gap = restart_gap
+        # box_id -> seq berikutnya yang ditunggu
+        self._expected = {}
+        # box_id -> {seq: item}, hanya box yang sedang menahan reading
+        self._pending = {}
+        self._stats = {"held": 0, "released": 0, "late": 0, "gaps_skipped": 0, "duplicates": 0, "restarts": 0}
+
+    def push(self, item) -> list:
+        """Return item yang siap ditulis (urut), bisa kosong jika ditahan."""
+        payload = item[1]
+        seq = payload.get("seq")
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            return [item]
+        box_id = payload.get("box_id")
+        expected = self._expected.get(box_id)
+        if expected is None or seq == expected:
+            self._expected[box_id] = seq + 1
+            return [item] + self._release(box_id)
+        if seq < expected:
+            if expected - seq > self.restart_gap:
+                # Reading counter lama yang masih ditahan dilepas lebih dulu
+                self._stats["restarts"] += 1
+                pending = self._pending.pop(box_id, {})
+                self._expected[box_id] = seq + 1
+                return [pending[s] for s in sorted(pending)] + [item]
+            self._stats["late"] += 1
+            return [item]
+        pending = self._pending.setdefault(box_id, {})
+        if seq in pending:
+            self._stats["duplicates"] += 1
+            return []
+        pending[seq] = item
+        self._stats["held"] += 1
+        if len(pending) <= self.max_pending:
+            return []
+        # Buffer box penuh: celah dianggap hilang
+        return self._skip_gap(box_id)
+
+    def _release(self, box_id):
+        """Lepas reading yang ditahan selama seq-nya menyambung."""
+        pending = self._pending.get(box_id)
+        if not pending:
+            return []
+        expected = self._expected[box_id]
+        ready = []
+        while expected in pending:
+            ready.append(pending.pop(expected))
+            expected += 1
+        self._expected[box_id] = expected
+        if not pending:
+            del self._pending[box_id]
+        self._stats["released"] += len(ready)
+        return ready
+
+    def _skip_gap(self, box_id):
+        self._stats["gaps_skipped"] += 1
+        self._expected[box_id] = min(self._pending[box_id])
+        return self._release(box_id)
+
+    def next_expiry(self):
+        """Waktu monotonic paling awal saat reading yang ditahan harus dilepas."""
+        oldest = None
+        for pending in self._pending.values():
+            for enqueued, _ in pending.values():
+                if oldest is None or enqueued < oldest:
+                    oldest = enqueued
+        return None if oldest is None else oldest + self.window
+
+    def expire(self, now) -> list:
+        """Lepas reading yang ditahan lebih dari `window` (celah seq tidak datang)."""
+        ready = []
+        for box_id in list(self._pending):
+            while box_id in self._pending and \
+                    min(item[0] for item in self._pending[box_id].values()) + self.window <= now:
+                ready.extend(self._skip_gap(box_id))
+        return ready
+
+    def drain(self) -> list:
+        """Lepas semua reading yang ditahan (shutdown), urut seq per box."""
+        ready = []
+        for box_id, pending in self._pending.items():
+            seqs = sorted(pending)
+            ready.extend(pending[seq] for seq in seqs)
+            self._expected[box_id] = max(self._expected[box_id], seqs[-1] + 1)
+        self._pending = {}
+        return ready
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data["pending"] = sum(len(pending) for pending in list(self._pending.values()))
+        data["boxes"] = len(self._expected)
+        return data
+
+
+class IngestPipeline:
+    """Antrian terbatas + writer thread yang menulis data sensor per batch."""
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=500,
+                 flush_interval=0.5, put_timeout=0.05, on_batch=None, reorder=None,
+                 retry_backoff=0.5, max_retry_backoff=30.0):
+        # write_batch(list_of_payloads) dipanggil dari writer thread
+        self._write_batch = write_batch
+        # on_batch(write_seconds, ages) setelah batch tersimpan; ages = detik
+        # sejak tiap payload masuk antrian sampai commit (untuk metrics)
+        self._on_batch = on_batch
+        # ReorderBuffer opsional: reading ber-seq diurutkan sebelum ditulis
+        self._reorder = reorder
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        # Backoff (detik, dikali dua per percobaan) saat error sementara
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._thread = None
+        # Di-set stop(): backoff berhenti menunggu, batch dicoba sekali lagi lalu dibuang
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0,
+            "backpressure_waits": 0,
+        }
+
+    # --- PRODUCER SIDE (thread MQTT) ---
+
+    def submit(self, payload) -> bool:
+        """Masukkan payload ke antrian. Return False jika antrian penuh (drop)."""
+        item = (time.monotonic(), payload)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Backpressure: tahan sebentar thread MQTT, lalu drop jika masih penuh
+            self._count("backpressure_waits")
+            try:
+                self._queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        self._count("enqueued")
+        return True
+
+    # --- LIFECYCLE ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Flush semua data yang tersisa di antrian lalu hentikan writer."""
+        if not self._thread:
+            return
+        # timeout None = tunggu sampai semua data tertulis
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stopping.set()
+        # Antrian bisa penuh (writer sedang backoff / sudah mati): jangan blok selamanya
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        self._thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            log.error("ingest writer did not stop in time", queue_depth=self._queue.qsize())
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["queue_depth"] = self._queue.qsize()
+        data["queue_capacity"] = self._queue.maxsize
+        if self._reorder is not None:
+            # Dibaca dari thread lain tanpa lock: cukup untuk statistik
+            data["reorder"] = self._reorder.stats()
+        return data
+
+    # --- WRITER SIDE ---
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        delay = self.retry_backoff
+        while True:
+            started = time.monotonic()
+            try:
+                self._write_batch([payload for _, payload in batch])
+                break
+            except PartialWriteError as e:
+                # Payload shard yang sudah commit tidak boleh ditulis ulang (baris
+                # tanpa seq & rollup-nya akan ganda): hanya yang gagal diulang
+                failed = [item for item in batch if item[1].get("box_id") in e.failed_boxes]
+                self._count("written", len(batch) - len(failed))
+                log.warning("ingest batch partially written, retrying failed rows", rows=len(failed), error=str(e))
+                self._flush(failed)
+                return
+            except Exception as e:
+                if is_transient_error(e):
+                    if self._stopping.is_set() and delay > self.retry_backoff:
+                        # Shutdown & database masih belum bisa ditulis: jangan tahan proses
+                        self._count("failed", len(batch))
+                        log.error("ingest batch dropped at shutdown", rows=len(batch), error=str(e))
+                        return
+                    # Database sibuk / pool habis: batch yang sama diulang utuh
+                    self._count("retries")
+                    log.warning("ingest batch write failed, retrying batch", rows=len(batch),
+                                retry_in=delay, error=str(e))
+                    self._stopping.wait(delay)
+                    delay = min(delay * 2, self.max_retry_backoff)
+                    continue
+                if len(batch) == 1:
+                    self._count("failed")
+                    log.warning("ingest write failed", error=str(e))
+                    return
+                # Satu payload rusak (IntegrityError, ValueError, ...) tidak boleh
+                # membuang satu batch penuh: ulangi per baris agar hanya payload
+                # yang gagal yang dibuang
+                log.warning("ingest batch write failed, retrying per row", rows=len(batch), error=str(e))
+                for item in batch:
+                    self._flush([item])
+                return
+        self._count("written", len(batch))
+        self._count("batches")
+        if self._on_batch is not None:
+            now = time.monotonic()
+            try:
+                self._on_batch(now - started, [now - enqueued for enqueued, _ in batch])
+            except Exception:
+                # Batch sudah tersimpan: error metrics tidak boleh membuat batch diulang
+                log.exception("ingest on_batch callback failed", rows=len(batch))
+
+    def _take(self, item, batch):
+        if self._reorder is None:
+            batch.append(item)
+            return
+        try:
+            batch.extend(self._reorder.push(item))
+        except Exception:
+            # Reorder buffer bermasalah: reading tetap ditulis, hanya tanpa diurutkan
+            log.exception("ingest reorder failed", box_id=item[1].get("box_id"))
+            batch.append(item)
+
+    def _expire(self, batch):
+        try:
+            batch.extend(self._reorder.expire(time.monotonic()))
+        except Exception:
+            log.exception("ingest reorder expire failed")
+
+    def _drain(self, batch):
+        # Ambil sisa item yang masih ada di antrian (+ yang ditahan reorder
+        # buffer), lalu flush semuanya
+        while True:
+            try:
+                rest = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if rest is _STOP:
+                continue
+            self._take(rest, batch)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if self._reorder is not None:
+            try:
+                batch.extend(self._reorder.drain())
+            except Exception:
+                log.exception("ingest reorder drain failed")
+        for i in range(0, len(batch), self.batch_size):
+            self._flush(batch[i:i + self.batch_size])
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException:
+            # Jangan mati diam-diam: antrian berhenti dikosongkan, submit mulai drop
+            log.exception("ingest writer stopped unexpectedly", queue_depth=self._queue.qsize())
+            raise
+
+    def _loop(self):
+        batch = []
+        deadline = None
+        while True:
+            now = time.monotonic()
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - now)
+            if self._reorder is not None:
+                # Bangun juga saat reading yang ditahan sudah melewati window
+                try:
+                    expiry = self._reorder.next_expiry()
+                except Exception:
+                    log.exception("ingest reorder expiry check failed")
+                    expiry = None
+                if expiry is not None:
+                    timeout = min(timeout, max(0.0, expiry - now))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._drain(batch)
+                return
+
+            if item is not None:
+                self._take(item, batch)
+                # Ambil sebanyak mungkin tanpa blocking sampai batas batch
+                while len(batch) < self.batch_size:
+                    try:
+                        nxt = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is _STOP:
+                        self._drain(batch)
+                        return
+                    self._take(nxt, batch)
+
+            if self._reorder is not None:
+                self._expire(batch)
+            if batch and deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+
+class IngestFollower:
+    """
+    Mode ingest eksternal (ingest_service.py): API server tidak menerima MQTT,
+    tetapi membaca baris baru dari database (id > cursor) secara berkala dan
+    meneruskannya ke cache / stream / alert di proses API.
+
+    Cursor disimpan per partisi (shard): {partisi: id terakhir}. Id hanya
+    berurutan sesuai commit di dalam satu partisi, jadi satu cursor global
+    bisa melewati baris ber-id kecil yang di-commit belakangan di shard lain.
+    """
+
+    def __init__(self, fetch_after, handle_rows, interval=0.5, batch_size=2000):
+        # fetch_after({partisi: last_id}, limit) -> {partisi: list baris (dict) urut id}
+        self._fetch_after = fetch_after
+        self._handle_rows = handle_rows
+        self.interval = interval
+        self.batch_size = batch_size
+        self.cursor = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"polls": 0, "rows": 0, "errors": 0}
+
+    def start(self, cursor):
+        if self._thread and self._thread.is_alive():
+            return
+        self.cursor = dict(cursor)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def poll_once(self) -> int:
+        """Return jumlah baris dari partisi yang paling banyak tertinggal."""
+        parts = self._fetch_after(dict(self.cursor), self.batch_size)
+        rows = sorted((row for part in parts.values() for row in part), key=lambda row: row["id"])
+        if rows:
+            self._handle_rows(rows)
+            for key, part in parts.items():
+                if part:
+                    self.cursor[key] = part[-1]["id"]
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["rows"] += len(rows)
+        return max(map(len, parts.values()), default=0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["cursor"] = dict(self.cursor)
+        return data
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Batch penuh -> masih ada backlog, langsung baca lagi
+                if self.poll_once() >= self.batch_size:
+                    continue
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                log.warning("ingest follower error", error=str(e))
+            self._stop.wait(self.interval)
@@ -0,0 +1,264 @@
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from app_logging import get_logger
+
+log = get_logger("ingest_guard")
+
+# ==============================================================================
+# INGEST GUARD: VALIDASI, BOX TERDAFTAR & RATE LIMIT PER BOX
+# ==============================================================================
+# Topic MQTT default ada di broker publik, jadi siapa pun bisa publish.
+# Setiap reading hasil decode_payload diperiksa di sini sebelum masuk antrian
+# ingest (belum ada query / transaksi DB sama sekali):
+#
+#   1. validator : skema & rentang nilai, dikompilasi sekali menjadi satu
+#                  fungsi Python dengan batas sebagai konstanta (tanpa loop
+#                  field / lookup konfigurasi per reading)
+#   2. known box : box_id harus ada di box_ownership; set box_id di-cache di
+#                  memori dan dimuat ulang per TTL, bukan per pesan
+#   3. rate limit: token bucket per box (1 token = 1 reading), burst cukup
+#                  untuk firmware yang mengirim ulang buffer setelah offline
+#
+# Reading yang ditolak tidak disimpan; hanya dihitung per alasan, ditambah
+# tabel kecil (LRU) box_id yang dikarantina agar admin bisa melihat box yang
+# belum didaftarkan atau yang membanjiri topic.
+
+# Batas default: rentang sensor DHT22 & koordinat WGS84
+DEFAULT_RANGES = {
+    "temperature": (-40.0, 80.0),
+    "humidity": (0.0, 100.0),
+    "latitude": (-90.0, 90.0),
+    "longitude": (-180.0, 180.0),
+}
+BOX_ID_PATTERN = r"[A-Za-z0-9][A-Za-z0-9_.:-]{0,63}"
+
+# Alasan penolakan (label metrics smartbox_ingest_rejected_total)
+REASONS = ("invalid_box_id", "invalid_type", "out_of_range", "invalid_seq",
+           "unknown_box", "rate_limited", "too_many_readings", "oversize")
+# Alasan yang dicatat per box di tabel karantina (box_id-nya valid)
+BOX_REASONS = ("unknown_box", "rate_limited")
+
+
+def compile_validator(ranges=None, box_id_pattern=BOX_ID_PATTERN):
+    """
+    Bangun validate(payload) -> alasan penolakan (str) atau None.
+    Field numerik boleh tidak dikirim / None (sama seperti sentinel biner),
+    bool tidak dianggap angka, NaN/inf selalu di luar rentang.
+    """
+    lines = [
+        "def validate(payload):",
+        "    get = payload.get",
+        "    box_id = get('box_id')",
+        "    if type(box_id) is not str or match(box_id) is None:",
+        "        return 'invalid_box_id'",
+    ]
+    for field, (low, high) in (ranges or DEFAULT_RANGES).items():
+        lines += [
+            f"    value = get({field!r})",
+            "    if value is not None:",
+            "        kind = type(value)",
+            "        if kind is not float and kind is not int:",
+            "            return 'invalid_type'",
+            f"        if not {float(low)!r} <= value <= {float(high)!r}:",
+            "            return 'out_of_range'",
+        ]
+    lines += [
+        "    seq = get('seq')",
+        f"    if seq is not None and (type(seq) is not int or not 0 <= seq < {2 ** 63}):",
+        "        return 'invalid_seq'",
+        "    return None",
+    ]
+    namespace = {"match": re.compile(box_id_pattern).fullmatch}
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
+
+class KnownBoxes:
+    """Set box_id terdaftar, dimuat ulang dari DB paling sering sekali per TTL."""
+
+    def __init__(self, load, ttl=30.0):
+        # load() -> iterable box_id (SELECT box_id FROM box_ownership)
+        self._load = load
+        self.ttl = ttl
+        self._boxes = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._reloads = 0
+        self._errors = 0
+
+    def _refresh(self, now):
+        # Hanya satu thread yang memuat ulang; thread lain memakai set lama
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now < self._expires_at:
+                return
+            try:
+                self._boxes = frozenset(self._load())
+                self._reloads += 1
+            except Exception as e:
+                # DB sedang bermasalah: pakai set lama, coba lagi setelah TTL
+                self._errors += 1
+                log.warning("known boxes reload failed", error=str(e))
+            self._expires_at = now + self.ttl
+        finally:
+            self._lock.release()
+
+    def __contains__(self, box_id) -> bool:
+        now = time.monotonic()
+        if now >= self._expires_at:
+            self._refresh(now)
+        boxes = self._boxes
+        # Belum pernah berhasil dimuat: jangan buang data perangkat yang sah
+        return boxes is None or box_id in boxes
+
+    def add(self, box_id):
+        """Dipanggil register_box: box baru langsung diterima tanpa menunggu TTL."""
+        with self._lock:
+            if self._boxes is not None:
+                self._boxes = self._boxes | {box_id}
+
+    def stats(self) -> dict:
+        return {
+            "boxes": len(self._boxes) if self._boxes is not None else None,
+            "ttl_seconds": self.ttl,
+            "reloads": self._reloads,
+            "reload_errors": self._errors,
+        }
+
+
+class IngestGuard:
+    """
+    filter(readings) -> (reading yang lolos, Counter alasan penolakan).
+    Dipanggil dari thread MQTT (on_message) / worker ingest_service;
+    stats() boleh dibaca dari thread request.
+    """
+
+    def __init__(self, validate, known_boxes=None, rate=5.0, burst=2000.0,
+                 max_readings=2000, max_payload_bytes=256 * 1024, quarantine_size=1000, max_buckets=100000):
+        self._validate = validate
+        self.known_boxes = known_boxes  # None = semua box_id valid diterima
+        self.rate = rate                # reading/detik per box, 0 = tanpa rate limit
+        self.burst = float(burst)
+        self.max_readings = max_readings
+        self.max_payload_bytes = max_payload_bytes
+        self.quarantine_size = quarantine_size
+        self.max_buckets = max_buckets
+        # box_id -> [token tersisa, waktu isi ulang terakhir]
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._rejected = Counter()
+        # box_id -> {"unknown_box": n, "rate_limited": n, "last_seen": epoch}
+        self._quarantine = OrderedDict()
+        self._quarantine_evicted = 0
+
+    def check_size(self, size: int):
+        """Cek sebelum decode: payload raksasa ditolak tanpa json.loads."""
+        if self.max_payload_bytes and size > self.max_payload_bytes:
+            self._count({"oversize": 1})
+            return "oversize"
+        return None
+
+    def filter(self, readings: list):
+        rejected = Counter()
+        if self.max_readings and len(readings) > self.max_readings:
+            rejected["too_many_readings"] = len(readings)
+            self._count(rejected)
+            return [], rejected
+
+        validate = self._validate
+        known = self.known_boxes
+        per_box = {}
+        quarantined = []
+        for payload in readings:
+            reason = validate(payload)
+            if reason is None:
+                box_id = payload["box_id"]
+                if known is None or box_id in known:
+                    per_box.setdefault(box_id, []).append(payload)
+                    continue
+                reason = "unknown_box"
+                quarantined.append((box_id, reason, 1))
+            rejected[reason] += 1
+
+        accepted = []
+        if self.rate > 0 and per_box:
+            now = time.monotonic()
+            with self._lock:
+                for box_id, items in per_box.items():
+                    allowed = self._take(box_id, len(items), now)
+                    accepted.extend(items[:allowed])
+                    if allowed < len(items):
+                        rejected["rate_limited"] += len(items) - allowed
+                        quarantined.append((box_id, "rate_limited", len(items) - allowed))
+        else:
+            for items in per_box.values():
+                accepted.extend(items)
+
+        self._count(rejected, len(accepted), quarantined)
+        return accepted, rejected
+
+    def _take(self, box_id, wanted: int, now: float) -> int:
+        """Ambil token untuk `wanted` reading; return jumlah yang diizinkan."""
+        bucket = self._buckets.get(box_id)
+        if bucket is None:
+            bucket = self._buckets[box_id] = [self.burst, now]
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        allowed = min(wanted, int(bucket[0]))
+        bucket[0] -= allowed
+        return allowed
+
+    def _prune(self, now):
+        # Bucket yang sudah penuh lagi sama dengan bucket baru: aman dibuang.
+        # Hanya relevan jika known box dimatikan (box_id acak tanpa batas).
+        idle = self.burst / self.rate
+        for box_id in [b for b, (_, last) in self._buckets.items() if now - last >= idle]:
+            del self._buckets[box_id]
+
+    def _count(self, rejected, accepted=0, quarantined=()):
+        with self._lock:
+            self._accepted += accepted
+            self._rejected.update(rejected)
+            if not quarantined:
+                return
+            now = time.time()
+            for box_id, reason, count in quarantined:
+                entry = self._quarantine.get(box_id)
+                if entry is None:
+                    entry = self._quarantine[box_id] = {reason: 0 for reason in BOX_REASONS}
+                    while len(self._quarantine) > self.quarantine_size:
+                        self._quarantine.popitem(last=False)
+                        self._quarantine_evicted += 1
+                else:
+                    self._quarantine.move_to_end(box_id)
+                entry[reason] += count
+                entry["last_seen"] = now
+
+    def quarantine(self, limit=100) -> list:
+        """Box yang paling baru dikarantina lebih dulu."""
+        with self._lock:
+            items = list(self._quarantine.items())[-limit:] if limit else []
+        return [{"box_id": box_id, **entry} for box_id, entry in reversed(items)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = {
+                "accepted": self._accepted,
+                "rejected": sum(self._rejected.values()),
+                "rejected_by_reason": {reason: self._rejected.get(reason, 0) for reason in REASONS},
+                "rate_per_box": self.rate,
+                "burst_per_box": self.burst,
+                "tracked_boxes": len(self._buckets),
+                "quarantined_boxes": len(self._quarantine),
+                "quarantine_evicted": self._quarantine_evicted,
+            }
+        data["known_boxes"] = self.known_boxes.stats() if self.known_boxes is not None else None
+        return data
@@ -0,0 +1,329 @@
+"""
+SmartBox Ingest Service (standalone, multi-proses)
+
+Menerima data MQTT di luar proses Flask, dengan N worker process sehingga
+decode JSON + tulis ke SQLite tidak berbagi GIL dengan API server.
+
+Mode:
+  shared   (default) setiap worker punya client MQTT v5 sendiri dan subscribe
+           ke $share/<group>/<topic>; broker yang membagi pesan ke worker.
+  dispatch untuk broker tanpa shared subscription (MQTT 3.1.1): satu client
+           di proses utama, payload mentah dibagikan round-robin ke worker.
+
+Cara menjalankan (dari folder backend):
+    python ingest_service.py --workers 4
+    python ingest_service.py --workers 4 --tenant 11 --tenant 12
+    python ingest_service.py --workers 2 --mode dispatch --broker localhost
+
+API server dijalankan dengan INGEST_MODE=external agar tidak ikut subscribe
+MQTT; cache, stream SSE dan alert diisi dari database.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+
+from app_logging import get_logger
+from payload_codec import PayloadError, decode_payload
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(script_dir, '..', '.env'))
+
+MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.hivemq.com")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "smartbox/11/secret45582/data")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_SHARE_GROUP = os.getenv("INGEST_SHARE_GROUP", "smartbox-ingest")
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 0.5))
+
+# Jumlah payload mentah per pesan antar-proses (mode dispatch)
+DISPATCH_BATCH = 200
+
+# Handler logging dipasang saat backend di-import (proses utama & tiap worker)
+log = get_logger("ingest_service")
+
+
+def tenant_topic(tenant) -> str:
+    """Semua box milik satu tenant: smartbox/<tenant>/<secret>/data."""
+    return f"smartbox/{tenant}/+/data"
+
+
+def shared_topic(group, topic) -> str:
+    return f"$share/{group}/{topic}"
+
+
+def make_client(client_id, protocol):
+    kwargs = {"client_id": client_id, "protocol": protocol}
+    # paho-mqtt 2.x: callback API versi 2 (signature on_connect sama dengan
+    # MQTT v5 di paho 1.x)
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        kwargs["callback_api_version"] = mqtt.CallbackAPIVersion.VERSION2
+    return mqtt.Client(**kwargs)
+
+
+# ==============================================================================
+# WORKER PROCESS
+# ==============================================================================
+
+def worker_main(index, options, inbox, results, stop_event):
+    # Ctrl+C ditangani proses utama; worker berhenti lewat stop_event / None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Import di dalam worker: pool koneksi SQLite milik proses ini sendiri
+    import backend
+    from ingest import IngestPipeline
+
+    pipeline = IngestPipeline(
+        backend.store_sensor_batch,
+        max_queue=options.queue_size,
+        batch_size=options.batch_size,
+        flush_interval=options.flush_interval
+    )
+    pipeline.start()
+    counters = {"received": 0, "invalid": 0}
+    # Validasi, box terdaftar & rate limit sama dengan on_message (per worker;
+    # pada mode shared, satu box bisa dibagi broker ke beberapa worker)
+    guard = backend.ingest_guard
+
+    def submit_raw(raw):
+        counters["received"] += 1
+        if guard.check_size(len(raw)):
+            return
+        try:
+            readings = decode_payload(raw)
+        except PayloadError:
+            counters["invalid"] += 1
+            return
+        readings, _ = guard.filter(readings)
+        for payload in readings:
+            pipeline.submit(payload)
+
+    def report(final=False):
+        results.put((index, {**pipeline.stats(), **counters, "rejected": guard.stats()["rejected"], "final": final}))
+
+    if inbox is None:
+        client = make_client(f"{options.client_prefix}-{index}-{os.getpid()}", mqtt.MQTTv5)
+
+        def on_connect(client, userdata, flags, reason_code, properties=None):
+            if reason_code == 0:
+                log.info("worker connected to mqtt broker", worker=index, broker=options.broker)
+                for topic in options.topics:
+                    client.subscribe(shared_topic(options.share_group, topic), qos=options.qos)
+            else:
+                log.error("worker mqtt connect failed", worker=index, reason=str(reason_code))
+
+        def on_disconnect(client, userdata, flags, reason_code, properties=None):
+            if reason_code != 0:
+                log.warning("worker mqtt connection lost, reconnecting", worker=index, reason=str(reason_code))
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_message = lambda client, userdata, msg: submit_raw(msg.payload)
+        # connect_async: broker mati saat start tidak mematikan worker, paho terus mencoba
+        client.connect_async(options.broker, options.port, 60)
+        client.loop_start()
+        while not stop_event.wait(options.stats_interval):
+            report()
+        client.disconnect()
+        client.loop_stop()
+    else:
+        next_report = time.monotonic() + options.stats_interval
+        while True:
+            try:
+                batch = inbox.get(timeout=0.5)
+            except queue.Empty:
+                batch = []
+            if batch is None:
+                break
+            for raw in batch:
+                submit_raw(raw)
+            if time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + options.stats_interval
+
+    # Flush sisa antrian sebelum keluar
+    pipeline.stop(timeout=None)
+    backend.shard_router.close()
+    report(final=True)
+
+
+# ==============================================================================
+# PROSES UTAMA
+# ==============================================================================
+
+def run_dispatcher(options, inboxes, stop_event):
+    """Mode dispatch: satu client MQTT 3.1.1, payload dibagi round-robin per batch."""
+    local = queue.Queue(maxsize=options.queue_size)
+    dropped = [0]
+    client = make_client(f"{options.client_prefix}-dispatch-{os.getpid()}", mqtt.MQTTv311)
+
+    def on_connect(client, userdata, flags, reason_code, properties=None):
+        if reason_code == 0:
+            log.info("dispatcher connected to mqtt broker", broker=options.broker, topics=options.topics)
+            for topic in options.topics:
+                client.subscribe(topic, qos=options.qos)
+        else:
+            log.error("dispatcher mqtt connect failed", reason=str(reason_code))
+
+    def on_disconnect(client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            log.warning("dispatcher mqtt connection lost, reconnecting", reason=str(reason_code))
+
+    def on_message(client, userdata, msg):
+        try:
+            local.put(msg.payload, timeout=0.05)
+        except queue.Full:
+            dropped[0] += 1
+
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    client.connect_async(options.broker, options.port, 60)
+    client.loop_start()
+
+    turn = 0
+    draining = False
+    while True:
+        if stop_event.is_set() and not draining:
+            client.disconnect()
+            client.loop_stop()
+            draining = True
+        try:
+            batch = [local.get(timeout=0.2)]
+        except queue.Empty:
+            if draining:
+                break
+            continue
+        while len(batch) < DISPATCH_BATCH:
+            try:
+                batch.append(local.get_nowait())
+            except queue.Empty:
+                break
+        inboxes[turn % len(inboxes)].put(batch)
+        turn += 1
+
+    for inbox in inboxes:
+        inbox.put(None)
+    if dropped[0]:
+        log.warning("dispatcher dropped messages, queue full", dropped=dropped[0])
+
+
+def report_loop(results, workers, stop_event, interval):
+    """Gabungkan statistik semua worker dan cetak secara berkala."""
+    latest = {}
+    last_written = 0
+    last_time = time.monotonic()
+    next_print = last_time + interval
+
+    def summary():
+        return {key: sum(s.get(key, 0) for s in latest.values())
+                for key in ("received", "written", "dropped", "failed", "invalid", "rejected", "queue_depth")}
+
+    while any(p.is_alive() for p in workers) or not results.empty():
+        try:
+            index, stats = results.get(timeout=0.5)
+            latest[index] = stats
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        if now >= next_print and latest and not stop_event.is_set():
+            total = summary()
+            rate = (total["written"] - last_written) / (now - last_time)
+            print(f"Ingest: {len(workers)} workers, {rate:.0f} msg/s, written={total['written']} "
+                  f"queue={total['queue_depth']} dropped={total['dropped']} "
+                  f"failed={total['failed']} invalid={total['invalid']} rejected={total['rejected']}")
+            last_written, last_time = total["written"], now
+            next_print = now + interval
+
+    total = summary()
+    print(f"Ingest service stopped: received={total['received']} written={total['written']} "
+          f"dropped={total['dropped']} failed={total['failed']} invalid={total['invalid']} "
+          f"rejected={total['rejected']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SmartBox ingest service (multi-proses)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--mode", choices=["shared", "dispatch"], default="shared")
+    parser.add_argument("--broker", default=MQTT_BROKER)
+    parser.add_argument("--port", type=int, default=MQTT_PORT)
+    parser.add_argument("--topic", action="append", dest="topics",
+                        help="Topic (boleh wildcard), bisa diulang. Default: MQTT_TOPIC")
+    parser.add_argument("--tenant", action="append", dest="tenants",
+                        help="Subscribe smartbox/<tenant>/+/data, bisa diulang")
+    parser.add_argument("--share-group", default=INGEST_SHARE_GROUP)
+    parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=0)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=INGEST_FLUSH_INTERVAL)
+    parser.add_argument("--queue-size", type=int, default=INGEST_QUEUE_SIZE)
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=0,
+                        help="Berhenti otomatis setelah N detik (0 = jalan terus)")
+    parser.add_argument("--client-prefix", default="smartbox-ingest")
+    options = parser.parse_args(argv)
+    options.topics = (options.topics or []) + [tenant_topic(t) for t in options.tenants or []]
+    if not options.topics:
+        options.topics = [MQTT_TOPIC]
+    options.workers = max(1, options.workers)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    # Skema dibuat sekali di proses utama sebelum worker mulai menulis
+    import backend
+    backend.initialize_database()
+    backend.shard_router.close()
+
+    # spawn: worker tidak mewarisi thread / koneksi dari proses utama
+    ctx = mp.get_context("spawn")
+    stop_event = ctx.Event()
+    results = ctx.Queue()
+    inboxes = [ctx.Queue(maxsize=64) for _ in range(options.workers)] if options.mode == "dispatch" else None
+
+    workers = [
+        ctx.Process(target=worker_main, name=f"ingest-worker-{i}",
+                    args=(i, options, inboxes[i] if inboxes else None, results, stop_event))
+        for i in range(options.workers)
+    ]
+    for process in workers:
+        process.start()
+
+    def shutdown(signum=None, frame=None):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    if options.duration:
+        timer = threading.Timer(options.duration, shutdown)
+        timer.daemon = True
+        timer.start()
+
+    print(f"Ingest service: {options.workers} workers, mode={options.mode}, "
+          f"topics={options.topics}, broker={options.broker}:{options.port}")
+    reporter = threading.Thread(target=report_loop, name="ingest-report",
+                                args=(results, workers, stop_event, options.stats_interval))
+    reporter.start()
+
+    if options.mode == "dispatch":
+        run_dispatcher(options, inboxes, stop_event)
+    else:
+        while not stop_event.wait(0.5):
+            pass
+
+    for process in workers:
+        process.join()
+    reporter.join()
+
+
+if __name__ == "__main__":
+    main()
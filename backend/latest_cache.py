@@ -0,0 +1,113 @@
+import threading
+
+# ==============================================================================
+# LATEST READING CACHE
+# ==============================================================================
+# Tabel in-memory: box_id -> baris terakhir (dict dengan kolom yang sama
+# seperti smartbox_data). Diperbarui oleh writer ingest setiap batch commit,
+# sehingga polling dashboard (limit=1) dan daftar device tidak perlu ke SQLite.
+#
+# "Terakhir" = timestamp terbaru (waktu ukur perangkat), lalu id terbesar.
+# Data yang terlambat datang (backfill setelah putus koneksi) mendapat id
+# baru tetapi timestamp lama, jadi tidak menggantikan reading terkini.
+
+WARM_QUERY = """
+    SELECT d.* FROM (SELECT DISTINCT box_id FROM smartbox_data) b
+    JOIN smartbox_data d ON d.id = (
+        SELECT id FROM smartbox_data
+        WHERE box_id = b.box_id
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    )
+"""
+
+
+def _order_key(row):
+    return (row["timestamp"] or "", row["id"])
+
+
+class LatestReadingCache:
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._warm = False
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def is_warm(self) -> bool:
+        return self._warm
+
+    def warm(self, conn):
+        """Isi cache dari database (baris terakhir per box)."""
+        rows = [dict(row) for row in conn.execute(WARM_QUERY).fetchall()]
+        with self._lock:
+            for row in rows:
+                self._put(row)
+            self._warm = True
+        return len(rows)
+
+    def _put(self, row) -> bool:
+        current = self._rows.get(row["box_id"])
+        # Jangan timpa dengan baris yang lebih lama
+        if current is None or _order_key(row) >= _order_key(current):
+            self._rows[row["box_id"]] = row
+            return True
+        return False
+
+    def update_many(self, rows) -> list:
+        """Return baris yang tidak lebih lama dari data terakhir box-nya (bukan backfill)."""
+        fresh = []
+        with self._lock:
+            for row in rows:
+                if self._put(dict(row)):
+                    fresh.append(row)
+        return fresh
+
+    def get(self, box_id):
+        """Return salinan baris terakhir, atau None (miss)."""
+        with self._lock:
+            row = self._rows.get(box_id)
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return dict(row)
+
+    def box_ids(self):
+        with self._lock:
+            self._hits += 1
+            return sorted(self._rows)
+
+    def version(self, box_ids=None):
+        """
+        (id terbesar, timestamp terbaru, jumlah box) dari baris terakhir box
+        tersebut (None = semua box). Untuk ETag; tidak menyalin baris.
+        """
+        with self._lock:
+            rows = self._rows.values() if box_ids is None else [self._rows.get(b) for b in box_ids]
+            max_id, latest, count = 0, None, 0
+            for row in rows:
+                if row is None:
+                    continue
+                count += 1
+                if row["id"] > max_id:
+                    max_id = row["id"]
+                if row["timestamp"] and (latest is None or row["timestamp"] > latest):
+                    latest = row["timestamp"]
+        return max_id, latest, count
+
+    def count_miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "boxes": len(self._rows),
+                "warm": self._warm,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
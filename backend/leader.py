@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from app_logging import get_logger
+
+log = get_logger("leader")
+
+# ==============================================================================
+# LEADER ELECTION ANTAR WORKER (FILE LOCK)
+# ==============================================================================
+# Server WSGI multi-worker (gunicorn) menjalankan beberapa proses API. Tugas
+# yang hanya boleh jalan sekali (subscribe MQTT + writer ingest, evaluasi &
+# penyimpanan alert, retention) dipegang satu worker: pemegang lock file
+# eksklusif. Lock dilepas otomatis oleh OS saat proses mati, lalu worker lain
+# yang masih mencoba akan mengambil alih.
+
+
+class LeaderLock:
+    def __init__(self, path, retry_interval=5.0, on_elected=None):
+        self.path = path
+        self.retry_interval = retry_interval
+        # on_elected() dipanggil sekali dari thread retry saat lock didapat
+        self.on_elected = on_elected
+        self._fd = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"attempts": 0, "elected_at": None}
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Coba ambil lock tanpa menunggu. Return True jika proses ini leader."""
+        with self._lock:
+            if self._fd is not None:
+                return True
+            self._stats["attempts"] += 1
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                os.close(fd)
+                return False
+            # Isi file = pid leader (informasi untuk operator saja)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+            self._fd = fd
+            self._stats["elected_at"] = int(time.time())
+            return True
+
+    def start(self):
+        """Follower: coba ambil alih lock secara berkala di background."""
+        if self.is_leader or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leader-retry", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def release(self):
+        self.stop()
+        with self._lock:
+            if self._fd is None:
+                return
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    def _run(self):
+        while not self._stop.wait(self.retry_interval):
+            try:
+                elected = self.try_acquire()
+            except OSError as e:
+                log.warning("leader lock error", path=self.path, error=str(e))
+                continue
+            if elected:
+                log.info("elected as leader", path=self.path, pid=os.getpid())
+                if self.on_elected is not None:
+                    try:
+                        self.on_elected()
+                    except Exception:
+                        log.exception("leader takeover failed", path=self.path)
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["leader"] = self.is_leader
+        data["path"] = self.path
+        return data
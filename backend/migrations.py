@@ -0,0 +1,166 @@
+import sqlite3
+
+from alerts import create_alert_tables
+from app_logging import get_logger
+from rollups import CREATE_TABLE_SQL as CREATE_ROLLUP_TABLE_SQL, add_last_ts, backfill_rollups
+from spatial import backfill_positions, create_spatial_tables
+
+log = get_logger("migrations")
+
+# ==============================================================================
+# SCHEMA MIGRATIONS
+# ==============================================================================
+# Versi skema disimpan di PRAGMA user_version. Setiap migrasi dijalankan
+# sekali, berurutan, di dalam transaksinya sendiri; file database lama yang
+# belum punya versi (user_version = 0) akan di-upgrade otomatis saat start.
+#
+# Tambahkan migrasi baru di akhir list MIGRATIONS, jangan mengubah yang lama.
+# Perubahan tabel data sensor (smartbox_data, smartbox_rollup, box_positions)
+# juga perlu ditambahkan ke SHARD_MIGRATIONS untuk file shard (shards.py).
+
+# Kunci dedup reading ber-seq (lihat migrasi 9)
+SEQ_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_smartbox_data_box_seq_ts ON smartbox_data (box_id, seq, timestamp) "
+    "WHERE seq IS NOT NULL"
+)
+
+MIGRATIONS = [
+    (1, "index smartbox_data (box_id, timestamp)", [
+        # WHERE box_id = ? ORDER BY timestamp DESC LIMIT ?, IN (...),
+        # SELECT DISTINCT box_id dan export per box
+        "CREATE INDEX IF NOT EXISTS idx_smartbox_data_box_ts ON smartbox_data (box_id, timestamp)",
+    ]),
+    (2, "index smartbox_data (timestamp)", [
+        # Query lintas box yang hanya mengurutkan berdasarkan waktu
+        "CREATE INDEX IF NOT EXISTS idx_smartbox_data_ts ON smartbox_data (timestamp)",
+    ]),
+    (3, "index box_ownership (user_id)", [
+        "CREATE INDEX IF NOT EXISTS idx_box_ownership_user ON box_ownership (user_id)",
+    ]),
+    (4, "rollup table smartbox_rollup (1m/15m/1h/1d)", [
+        # Membuat tabel dan mengisi dari data mentah yang sudah ada
+        backfill_rollups,
+    ]),
+    (5, "alert tables (alert_rules, alert_events)", [
+        create_alert_tables,
+    ]),
+    (6, "spatial index box_positions (R*Tree)", [
+        # Posisi terakhir per box diisi dari data mentah yang sudah ada
+        backfill_positions,
+    ]),
+    (7, "device seq & received_at on smartbox_data", [
+        # timestamp = waktu ukur perangkat (jika dikirim), received_at = waktu diterima server
+        "ALTER TABLE smartbox_data ADD COLUMN seq INTEGER",
+        "ALTER TABLE smartbox_data ADD COLUMN received_at DATETIME",
+        # Kunci idempotensi: redelivery MQTT / kiriman ulang firmware tidak menggandakan data.
+        # Partial index: baris lama / firmware tanpa seq tidak ikut di-index
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_smartbox_data_box_seq ON smartbox_data (box_id, seq) WHERE seq IS NOT NULL",
+    ]),
+    (8, "shard directory box_shards", [
+        """
+        CREATE TABLE IF NOT EXISTS box_shards (
+            box_id TEXT PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            assigned_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        """,
+        # Data yang sudah ada tetap di database utama (shard 0)
+        "INSERT OR IGNORE INTO box_shards (box_id, shard) SELECT DISTINCT box_id, 0 FROM smartbox_data",
+        # Journal pemindahan box antar shard (shard_tool.py), agar bisa dilanjutkan setelah terhenti
+        """
+        CREATE TABLE IF NOT EXISTS shard_moves (
+            box_id TEXT PRIMARY KEY,
+            source INTEGER NOT NULL,
+            target INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            copied_max INTEGER,
+            switched_at REAL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (9, "dedup (box_id, seq) within a timestamp window", [
+        # Counter seq perangkat bisa mulai ulang (reboot / reflash / wrap u32), jadi
+        # (box_id, seq) tidak unik sepanjang riwayat. Duplikat = seq sama dengan
+        # timestamp dalam INGEST_DEDUP_WINDOW (dicek store_shard_rows lewat index ini)
+        "DROP INDEX IF EXISTS idx_smartbox_data_box_seq",
+        SEQ_INDEX_SQL,
+    ]),
+    (10, "rollup last position by (timestamp, id)", [
+        add_last_ts,
+    ]),
+]
+
+# Index sekunder smartbox_data yang boleh di-drop sementara saat bulk import
+# (import_tool.py --defer-indexes) lalu dibangun ulang sekali di akhir.
+# Index (box_id, seq, timestamp) tidak termasuk: dipakai untuk deduplikasi.
+DEFERRABLE_INDEXES = {
+    "idx_smartbox_data_box_ts": "CREATE INDEX IF NOT EXISTS idx_smartbox_data_box_ts ON smartbox_data (box_id, timestamp)",
+    "idx_smartbox_data_ts": "CREATE INDEX IF NOT EXISTS idx_smartbox_data_ts ON smartbox_data (timestamp)",
+}
+
+# Skema file shard 1..N-1: hanya tabel data sensor, sudah dalam bentuk terbaru
+SHARD_MIGRATIONS = [
+    (1, "sensor data tables", [
+        """
+        CREATE TABLE IF NOT EXISTS smartbox_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            box_id TEXT NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            latitude REAL,
+            longitude REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            seq INTEGER,
+            received_at DATETIME
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_smartbox_data_box_ts ON smartbox_data (box_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_smartbox_data_ts ON smartbox_data (timestamp)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_smartbox_data_box_seq ON smartbox_data (box_id, seq) WHERE seq IS NOT NULL",
+        CREATE_ROLLUP_TABLE_SQL,
+        create_spatial_tables,
+    ]),
+    (2, "dedup (box_id, seq) within a timestamp window", [
+        "DROP INDEX IF EXISTS idx_smartbox_data_box_seq",
+        SEQ_INDEX_SQL,
+    ]),
+    (3, "rollup last position by (timestamp, id)", [
+        add_last_ts,
+    ]),
+]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn, target=None, migrations=MIGRATIONS) -> int:
+    """Jalankan semua migrasi yang belum diterapkan. Return versi skema akhir."""
+    current = get_schema_version(conn)
+    for version, name, statements in migrations:
+        if version <= current or (target is not None and version > target):
+            continue
+        try:
+            # BEGIN IMMEDIATE: ambil write lock sebelum DDL agar dua proses
+            # yang start bersamaan tidak menjalankan migrasi yang sama
+            conn.execute("BEGIN IMMEDIATE")
+            if get_schema_version(conn) >= version:
+                conn.execute("COMMIT")
+                current = version
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        current = version
+        log.info("migration applied", version=version, name=name)
+    # Perbarui statistik planner setelah index baru dibuat
+    conn.execute("PRAGMA optimize")
+    return current
@@ -1,8 +1,18 @@
 import paho.mqtt.client as mqtt
-import time
-import random
+import argparse
+import bisect
 import json
+import multiprocessing as mp
+import os
+import random
+import sqlite3
 import sys
+import threading
+import time
+from array import array
+
+from payload_codec import encode_readings
+from shards import existing_shard_count, shard_path
 
 # ================= KONFIGURASI =================
 BROKER = "broker.hivemq.com"
@@ -11,9 +21,50 @@ TOPIC = "smartbox/11/secret45582/data"
 
 # ================= LOGIKA SIMULATOR =================
 
-# Dictionary untuk menyimpan posisi terakhir setiap armada
-# Agar pergerakan terlihat realistis (tidak teleport)
-fleet_memory = {} 
+# Batas Koordinat Kasar Jabodetabek
+# Utara (Ancol) ~ -6.1, Selatan (Bogor) ~ -6.6
+# Barat (Tangerang) ~ 106.5, Timur (Bekasi) ~ 107.1
+LAT_MIN, LAT_MAX = -6.65, -6.10
+LON_MIN, LON_MAX = 106.50, 107.15
+
+
+class FleetState:
+    """
+    Posisi terakhir setiap armada dalam array double (16 byte per box),
+    bukan dict per box, agar simulasi 10k+ box tetap ringan.
+    Agar pergerakan terlihat realistis (tidak teleport).
+    """
+
+    def __init__(self, size=0):
+        self.lat = array("d")
+        self.lon = array("d")
+        self.ensure(size)
+
+    def ensure(self, size):
+        # Box baru diberi posisi acak
+        while len(self.lat) < size:
+            self.lat.append(random.uniform(LAT_MIN, LAT_MAX))
+            self.lon.append(random.uniform(LON_MIN, LON_MAX))
+
+    def step(self, i):
+        # Simulasi pergerakan kendaraan (bergeser sekitar 10-100 meter)
+        # Arah acak (-0.0005 s/d 0.0005 derajat)
+        move_lat = random.uniform(-0.0005, 0.0005)
+        move_lon = random.uniform(-0.0005, 0.0005)
+        new_lat = self.lat[i] + move_lat
+        new_lon = self.lon[i] + move_lon
+        # Jaga agar tidak keluar batas peta (pantulkan balik jika keluar)
+        if new_lat < LAT_MIN or new_lat > LAT_MAX:
+            new_lat = self.lat[i] - move_lat
+        if new_lon < LON_MIN or new_lon > LON_MAX:
+            new_lon = self.lon[i] - move_lon
+        self.lat[i] = new_lat
+        self.lon[i] = new_lon
+        return new_lat, new_lon
+
+
+# Posisi semua armada (index 0 = SMARTBOX-001)
+fleet_memory = FleetState()
 
 def get_next_position(box_index):
     """
@@ -21,39 +72,8 @@ def get_next_position(box_index):
     Jika box baru, beri posisi acak.
     Jika box lama, geser sedikit dari posisi terakhir (simulasi jalan).
     """
-    
-    # Batas Koordinat Kasar Jabodetabek
-    # Utara (Ancol) ~ -6.1, Selatan (Bogor) ~ -6.6
-    # Barat (Tangerang) ~ 106.5, Timur (Bekasi) ~ 107.1
-    lat_min, lat_max = -6.65, -6.10
-    lon_min, lon_max = 106.50, 107.15
-
-    # Jika box ini belum punya posisi (awal simulasi)
-    if box_index not in fleet_memory:
-        start_lat = random.uniform(lat_min, lat_max)
-        start_lon = random.uniform(lon_min, lon_max)
-        fleet_memory[box_index] = {'lat': start_lat, 'lon': start_lon}
-    
-    # Ambil posisi terakhir
-    current_pos = fleet_memory[box_index]
-    
-    # Simulasi pergerakan kendaraan (bergeser sekitar 10-100 meter)
-    # Arah acak (-0.0005 s/d 0.0005 derajat)
-    move_lat = random.uniform(-0.0005, 0.0005)
-    move_lon = random.uniform(-0.0005, 0.0005)
-    
-    # Update posisi di memori
-    new_lat = current_pos['lat'] + move_lat
-    new_lon = current_pos['lon'] + move_lon
-    
-    # Jaga agar tidak keluar batas peta (pantulkan balik jika keluar)
-    if new_lat < lat_min or new_lat > lat_max: move_lat *= -1
-    if new_lon < lon_min or new_lon > lon_max: move_lon *= -1
-    
-    fleet_memory[box_index]['lat'] = new_lat
-    fleet_memory[box_index]['lon'] = new_lon
-    
-    return new_lat, new_lon
+    fleet_memory.ensure(box_index)
+    return fleet_memory.step(box_index - 1)
 
 def generate_sensor_data(box_index):
     box_id = f"SMARTBOX-{box_index:03d}"
@@ -123,5 +143,336 @@ def main():
         print("\n[STOP] Simulasi dihentikan.")
         client.disconnect()
 
+# ================= MODE LOAD TEST (NON-INTERAKTIF) =================
+# python mqtt_simulator.py --broker localhost --boxes 10000 --rate 5000 --duration 60
+#
+# Publisher berjalan di beberapa proses; setiap proses mengirim sesuai jadwal
+# (rate / jumlah proses) tanpa sleep per box. Latency = waktu dari publish()
+# sampai callback on_publish (PUBACK untuk QoS 1, PUBCOMP untuk QoS 2).
+# Dengan --db, lag ingest end-to-end diukur dari jumlah baris baru di database
+# backend, dijumlah dari database utama dan semua file shard (--shard-dir).
+# Anggap hanya load test ini yang menulis ke database tersebut.
+
+PAYLOAD_KINDS = ("normal", "alert", "partial", "malformed")
+DEFAULT_MIX = "normal=90,alert=8,partial=1,malformed=1"
+
+
+def parse_mix(spec):
+    """'normal=90,alert=10' -> (kinds, cumulative weights)."""
+    kinds, cumulative, total = [], [], 0.0
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in PAYLOAD_KINDS:
+            raise ValueError(f"Jenis payload tidak dikenal: {name} (pilihan: {', '.join(PAYLOAD_KINDS)})")
+        total += float(weight or 1)
+        kinds.append(name)
+        cumulative.append(total)
+    return kinds, [c / total for c in cumulative]
+
+
+def make_payload(kind, box_id, lat, lon, fmt="json", seq=None):
+    """seq diisi -> payload membawa timestamp perangkat ('ts') dan nomor urut per box."""
+    if kind == "malformed":
+        if fmt == "binary":
+            return encode_readings(box_id, [{"latitude": lat, "longitude": lon}])[:-3]
+        return b'{"box_id": "' + box_id.encode() + b'", "temperature": '
+    data = {"box_id": box_id, "latitude": lat, "longitude": lon}
+    if kind == "alert":
+        data["temperature"] = round(random.uniform(8.0, 12.0), 2)
+        data["humidity"] = round(random.uniform(65.0, 80.0), 2)
+    elif kind == "partial":
+        data["temperature"] = round(random.uniform(2.0, 4.0), 2)
+    else:
+        data["temperature"] = round(random.uniform(2.0, 9.0), 2)
+        data["humidity"] = round(random.uniform(45.0, 65.0), 2)
+    if seq is not None:
+        data["ts"] = int(time.time())
+        data["seq"] = seq
+    if fmt == "binary":
+        if seq is not None:
+            return encode_readings(box_id, [data], base_ts=data["ts"], base_seq=seq)
+        return encode_readings(box_id, [data])
+    return json.dumps(data, separators=(",", ":"))
+
+
+def make_client(client_id):
+    # paho-mqtt 2.x butuh callback_api_version; 1.x tidak mengenalnya
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    return mqtt.Client(client_id=client_id)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def publisher_main(index, opts, first_box, box_count, rate, published, results, start_at):
+    """Satu proses publisher: box [first_box, first_box + box_count)."""
+    fleet = FleetState(box_count)
+    kinds, weights = parse_mix(opts.mix)
+    box_ids = [f"{opts.prefix}-{first_box + i + 1:03d}" for i in range(box_count)]
+    # Nomor urut per box, mulai dari detik sekarang agar run berikutnya tidak
+    # mengulang seq run sebelumnya. Dibatasi u32 (base_seq payload biner)
+    seqs = [int(time.time()) & 0x7FFFFFFF] * box_count if opts.seq else None
+
+    client = make_client(f"sim-load-{os.getpid()}-{index}")
+    client.max_inflight_messages_set(opts.inflight)
+    lock = threading.Lock()
+    sent_at = {}
+    early = {}
+    latencies = array("d")
+
+    def on_publish(client, userdata, mid, reason_code=None, properties=None):
+        now = time.perf_counter()
+        with lock:
+            t0 = sent_at.pop(mid, None)
+            if t0 is None:
+                early[mid] = now  # callback datang sebelum publish() return
+            else:
+                latencies.append(now - t0)
+
+    client.on_publish = on_publish
+    client.connect(opts.broker, opts.port, 60)
+    client.loop_start()
+
+    # Semua proses mulai bersamaan
+    time.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    end = start + opts.duration
+    sent = errors = malformed = 0
+    box = 0
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        # Jumlah pesan yang seharusnya sudah terkirim sampai saat ini
+        due = int((now - start) * rate) - sent
+        if due <= 0:
+            time.sleep(min(0.005, end - now))
+            continue
+        for _ in range(min(due, 1000)):
+            lat, lon = fleet.step(box)
+            kind = kinds[bisect.bisect_left(weights, random.random())]
+            seq = None
+            if seqs is not None:
+                seq = seqs[box]
+                # Wrap di batas u32 (base_seq + 1 reading maks. 0xFFFFFFFE)
+                seqs[box] = (seqs[box] + 1) % 0xFFFFFFFF
+            payload = make_payload(kind, box_ids[box], lat, lon, opts.format, seq)
+            box = box + 1 if box + 1 < box_count else 0
+            t0 = time.perf_counter()
+            info = client.publish(opts.topic, payload, qos=opts.qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                errors += 1
+                continue
+            with lock:
+                acked = early.pop(info.mid, None)
+                if acked is None:
+                    sent_at[info.mid] = t0
+                else:
+                    latencies.append(acked - t0)
+            sent += 1
+            malformed += kind == "malformed"
+            with published.get_lock():
+                published.value += 1
+    elapsed = time.perf_counter() - start
+
+    # Tunggu ack yang masih in-flight
+    deadline = time.perf_counter() + opts.ack_timeout
+    while sent_at and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    client.disconnect()
+    client.loop_stop()
+    with lock:
+        unacked = len(sent_at)
+        data = latencies.tobytes()
+    results.put((index, sent, errors, unacked, elapsed, data, malformed))
+
+
+def ingest_db_files(db_file, shard_dir=None):
+    """Database utama + file shard smartbox_shard_NN.db (default folder shards di sebelah db_file)."""
+    if shard_dir is None:
+        shard_dir = os.path.join(os.path.dirname(os.path.abspath(db_file)), "shards")
+    paths = [shard_path(shard_dir, i) for i in range(1, existing_shard_count(shard_dir))]
+    return [db_file] + [path for path in paths if os.path.exists(path)]
+
+
+def sample_ingest(db_files, published, stop, samples, interval=0.2):
+    """Catat (waktu, jumlah terkirim, jumlah tersimpan di semua shard) secara berkala."""
+    conns = [sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30) for path in db_files]
+    try:
+        # Baris baru dihitung per file dari id awalnya: benar untuk id per
+        # file maupun id global lintas shard (shards/sequence.db)
+        bases = [conn.execute("SELECT IFNULL(MAX(id), 0) FROM smartbox_data").fetchone()[0] for conn in conns]
+        while not stop.is_set():
+            stored = sum(
+                conn.execute("SELECT COUNT(*) FROM smartbox_data WHERE id > ?", (base,)).fetchone()[0]
+                for conn, base in zip(conns, bases)
+            )
+            samples.append((time.time(), published.value, stored))
+            stop.wait(interval)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def ingest_lags(samples):
+    """
+    Lag tiap sample = waktu sampai data ke-N tersimpan - waktu data ke-N terkirim
+    (waktu kirim diinterpolasi dari sample counter publish).
+    """
+    lags = []
+    last_stored = 0
+    j = 0  # kedua counter naik monoton, jadi pencarian cukup maju terus
+    for t, _, stored in samples:
+        if stored <= last_stored:
+            continue
+        last_stored = stored
+        while j < len(samples) and samples[j][1] < stored:
+            j += 1
+        if j == len(samples):
+            break
+        pt, published, _ = samples[j]
+        if j == 0 or published == samples[j - 1][1]:
+            sent_t = pt
+        else:
+            prev_t, prev_p = samples[j - 1][0], samples[j - 1][1]
+            sent_t = prev_t + (pt - prev_t) * (stored - prev_p) / (published - prev_p)
+        lags.append(max(0.0, t - sent_t))
+    return sorted(lags)
+
+
+def run_load_test(opts):
+    processes = max(1, min(opts.processes, opts.boxes))
+    per_proc = opts.boxes // processes
+    ctx = mp.get_context("spawn")
+    published = ctx.Value("q", 0)
+    results = ctx.Queue()
+    start_at = time.time() + 2.0
+
+    workers = []
+    for i in range(processes):
+        first = i * per_proc
+        count = per_proc if i < processes - 1 else opts.boxes - first
+        p = ctx.Process(target=publisher_main, name=f"sim-publisher-{i}",
+                        args=(i, opts, first, count, opts.rate / processes, published, results, start_at))
+        p.start()
+        workers.append(p)
+
+    samples = []
+    stop = threading.Event()
+    sampler = None
+    if opts.db:
+        db_files = ingest_db_files(opts.db, opts.shard_dir)
+        sampler = threading.Thread(target=sample_ingest, args=(db_files, published, stop, samples), daemon=True)
+        sampler.start()
+
+    print(f"[INFO] {opts.boxes} box, target {opts.rate} msg/s, {processes} proses, "
+          f"QoS {opts.qos}, {opts.duration}s -> {opts.broker}:{opts.port} '{opts.topic}'",
+          file=sys.stderr if opts.json else sys.stdout)
+
+    collected = [results.get() for _ in workers]
+    for p in workers:
+        p.join()
+
+    if sampler:
+        # Tunggu backend menyelesaikan antrian ingest (payload rusak tidak disimpan)
+        expected = sum(r[1] - r[6] for r in collected)
+        deadline = time.time() + opts.drain_timeout
+        while time.time() < deadline and (not samples or samples[-1][2] < expected):
+            time.sleep(0.2)
+        stop.set()
+        sampler.join()
+
+    sent = sum(r[1] for r in collected)
+    errors = sum(r[2] for r in collected)
+    unacked = sum(r[3] for r in collected)
+    elapsed = max(r[4] for r in collected)
+    latencies = array("d")
+    for r in collected:
+        latencies.frombytes(r[5])
+    latencies = sorted(latencies)
+
+    report = {
+        "boxes": opts.boxes,
+        "processes": processes,
+        "qos": opts.qos,
+        "target_rate": opts.rate,
+        "sent": sent,
+        "malformed": sum(r[6] for r in collected),
+        "errors": errors,
+        "unacked": unacked,
+        "duration_s": round(elapsed, 3),
+        "achieved_rate": round(sent / elapsed) if elapsed else 0,
+        "publish_latency_ms": {
+            f"p{pct}": round(percentile(latencies, pct) * 1000, 2) if latencies else None
+            for pct in (50, 90, 99)
+        },
+    }
+    if latencies:
+        report["publish_latency_ms"]["max"] = round(latencies[-1] * 1000, 2)
+    if opts.db:
+        lags = ingest_lags(samples)
+        report["stored"] = samples[-1][2] if samples else 0
+        report["ingest_lag_ms"] = {
+            f"p{pct}": round(percentile(lags, pct) * 1000, 1) if lags else None
+            for pct in (50, 90, 99)
+        }
+    return report
+
+
+def parse_load_args(argv=None):
+    parser = argparse.ArgumentParser(description="SmartBox MQTT simulator - mode load test")
+    parser.add_argument("--broker", default=BROKER)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--topic", default=TOPIC)
+    parser.add_argument("--boxes", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=1000, help="Target total msg/detik")
+    parser.add_argument("--duration", type=float, default=30, help="Lama pengiriman (detik)")
+    parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Campuran payload, mis. '{DEFAULT_MIX}'")
+    parser.add_argument("--format", choices=["json", "binary"], default="json",
+                        help="Encoding payload (binary = format ringkas payload_codec.py)")
+    parser.add_argument("--seq", action="store_true",
+                        help="Sertakan timestamp perangkat (ts) dan nomor urut per box (seq)")
+    parser.add_argument("--prefix", default="SMARTBOX", help="Prefix box_id")
+    parser.add_argument("--inflight", type=int, default=1000, help="Maks pesan QoS>0 in-flight per proses")
+    parser.add_argument("--ack-timeout", type=float, default=10.0)
+    parser.add_argument("--db", help="Path database backend untuk mengukur lag ingest")
+    parser.add_argument("--shard-dir",
+                        help="Folder file shard backend (SHARD_DIR); default folder shards di sebelah --db")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--json", action="store_true", help="Cetak hasil sebagai JSON")
+    opts = parser.parse_args(argv)
+    parse_mix(opts.mix)  # validasi lebih awal
+    return opts
+
+
+def load_main(argv=None):
+    opts = parse_load_args(argv)
+    report = run_load_test(opts)
+    if opts.json:
+        print(json.dumps(report, indent=2))
+        return
+    lat = report["publish_latency_ms"]
+    print(f"[RESULT] terkirim {report['sent']} pesan dalam {report['duration_s']}s "
+          f"-> {report['achieved_rate']} msg/s (target {opts.rate:.0f}), error {report['errors']}, "
+          f"belum di-ack {report['unacked']}")
+    print(f"[RESULT] latency publish p50={lat['p50']}ms p90={lat['p90']}ms p99={lat['p99']}ms max={lat.get('max')}ms")
+    if "ingest_lag_ms" in report:
+        lag = report["ingest_lag_ms"]
+        print(f"[RESULT] tersimpan {report['stored']} baris, lag ingest p50={lag['p50']}ms "
+              f"p90={lag['p90']}ms p99={lag['p99']}ms")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Tanpa argumen: mode interaktif seperti biasa; dengan argumen: load test
+    if len(sys.argv) > 1:
+        load_main()
+    else:
+        main()
@@ -0,0 +1,188 @@
+import json
+import struct
+
+# ==============================================================================
+# PAYLOAD TELEMETRI: JSON & BINER RINGKAS
+# ==============================================================================
+# Firmware boleh mengirim JSON (format lama) atau format biner di bawah ini.
+# Jenis payload dideteksi dari byte pertama: JSON selalu diawali '{', '['
+# atau spasi, sedangkan payload biner diawali byte versi (0x01).
+#
+# Format biner versi 1 (little-endian):
+#
+#   header   : version u8 | flags u8 | count u16 | box_id_len u8 | box_id (utf-8)
+#              [base_ts u32, jika FLAG_TIMESTAMP]
+#              [base_seq u32, jika FLAG_SEQ]
+#   reading  : [dt u16, jika FLAG_TIMESTAMP]
+#              temperature i16 (x100) | humidity u16 (x100)
+#              latitude i32 (x1e7)    | longitude i32 (x1e7)
+#
+# Satu pesan MQTT bisa membawa `count` reading dari box yang sama (batch).
+# Nilai kosong ditandai sentinel (MISSING_*), sama seperti field yang tidak
+# dikirim di JSON. Satu reading = 12 byte (14 dengan timestamp) dibanding
+# ~100 byte JSON.
+#
+# FLAG_SEQ: nomor urut per box untuk deduplikasi ingest. Reading dalam satu
+# pesan selalu berurutan, jadi cukup base_seq di header (reading ke-i =
+# base_seq + i), tanpa tambahan byte per reading.
+
+VERSION = 1
+FLAG_TIMESTAMP = 0x01
+FLAG_SEQ = 0x02
+KNOWN_FLAGS = FLAG_TIMESTAMP | FLAG_SEQ
+
+HEADER = struct.Struct("<BBHB")
+BASE_TS = struct.Struct("<I")
+BASE_SEQ = struct.Struct("<I")
+RECORD = struct.Struct("<hHii")
+RECORD_TS = struct.Struct("<HhHii")
+
+TEMP_SCALE = 100
+HUM_SCALE = 100
+COORD_SCALE = 10_000_000
+
+MISSING_I16 = -0x8000
+MISSING_U16 = 0xFFFF
+MISSING_I32 = -0x80000000
+
+MAX_READINGS = 0xFFFF
+
+# Byte pertama payload JSON yang valid (objek/array, boleh diawali spasi)
+JSON_LEADING_BYTES = frozenset(b"{[ \t\r\n")
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def is_binary(raw: bytes) -> bool:
+    return bool(raw) and raw[0] not in JSON_LEADING_BYTES
+
+
+# --- ENCODE (firmware / simulator / benchmark) ---
+
+def _scaled(value, scale, missing, low, high):
+    if value is None:
+        return missing
+    scaled = int(round(value * scale))
+    if not low <= scaled <= high or scaled == missing:
+        raise PayloadError(f"Nilai di luar jangkauan format biner: {value}")
+    return scaled
+
+
+def encode_readings(box_id: str, readings: list, base_ts=None, base_seq=None) -> bytes:
+    """
+    Encode satu atau lebih reading (dict temperature/humidity/latitude/
+    longitude, opsional 'ts' epoch detik) milik satu box ke format biner.
+    base_ts diisi -> tiap reading membawa selisih detik dari base_ts.
+    base_seq diisi -> reading ke-i mendapat seq base_seq + i.
+    """
+    name = box_id.encode("utf-8")
+    if not 0 < len(name) <= 0xFF:
+        raise PayloadError("box_id harus 1-255 byte")
+    if not 0 < len(readings) <= MAX_READINGS:
+        raise PayloadError(f"Jumlah reading harus 1-{MAX_READINGS}")
+
+    flags = (FLAG_TIMESTAMP if base_ts is not None else 0) | (FLAG_SEQ if base_seq is not None else 0)
+    parts = [HEADER.pack(VERSION, flags, len(readings), len(name)), name]
+    if base_ts is not None:
+        parts.append(BASE_TS.pack(int(base_ts)))
+    if base_seq is not None:
+        if not 0 <= int(base_seq) <= 0xFFFFFFFF - len(readings):
+            raise PayloadError("base_seq di luar jangkauan u32")
+        parts.append(BASE_SEQ.pack(int(base_seq)))
+    for reading in readings:
+        values = (
+            _scaled(reading.get("temperature"), TEMP_SCALE, MISSING_I16, -0x8000, 0x7FFF),
+            _scaled(reading.get("humidity"), HUM_SCALE, MISSING_U16, 0, 0xFFFF),
+            _scaled(reading.get("latitude"), COORD_SCALE, MISSING_I32, -0x80000000, 0x7FFFFFFF),
+            _scaled(reading.get("longitude"), COORD_SCALE, MISSING_I32, -0x80000000, 0x7FFFFFFF),
+        )
+        if base_ts is None:
+            parts.append(RECORD.pack(*values))
+        else:
+            dt = int(reading.get("ts", base_ts)) - int(base_ts)
+            if not 0 <= dt <= 0xFFFF:
+                raise PayloadError("ts harus dalam 0-65535 detik setelah base_ts")
+            parts.append(RECORD_TS.pack(dt, *values))
+    return b"".join(parts)
+
+
+# --- DECODE (backend) ---
+
+def decode_binary(raw: bytes) -> list:
+    if len(raw) < HEADER.size:
+        raise PayloadError("Payload biner terlalu pendek")
+    version, flags, count, name_len = HEADER.unpack_from(raw)
+    if version != VERSION:
+        raise PayloadError(f"Versi payload biner tidak didukung: {version}")
+    if flags & ~KNOWN_FLAGS:
+        raise PayloadError(f"Flag payload biner tidak dikenal: {flags:#04x}")
+    offset = HEADER.size + name_len
+    try:
+        box_id = raw[HEADER.size:offset].decode("utf-8")
+    except UnicodeDecodeError:
+        raise PayloadError("box_id bukan utf-8") from None
+
+    with_ts = bool(flags & FLAG_TIMESTAMP)
+    if with_ts:
+        if len(raw) < offset + BASE_TS.size:
+            raise PayloadError("Payload biner terpotong")
+        (base_ts,) = BASE_TS.unpack_from(raw, offset)
+        offset += BASE_TS.size
+    base_seq = None
+    if flags & FLAG_SEQ:
+        if len(raw) < offset + BASE_SEQ.size:
+            raise PayloadError("Payload biner terpotong")
+        (base_seq,) = BASE_SEQ.unpack_from(raw, offset)
+        offset += BASE_SEQ.size
+    record = RECORD_TS if with_ts else RECORD
+    if len(raw) - offset != count * record.size:
+        raise PayloadError(f"Ukuran payload tidak cocok dengan count={count}")
+
+    # Seluruh blok reading di-unpack sekaligus (iter_unpack), tanpa slicing
+    # per reading; sentinel -> None, skala -> float
+    body = memoryview(raw)[offset:]
+    readings = []
+    append = readings.append
+    if with_ts:
+        for dt, temp, hum, lat, lon in record.iter_unpack(body):
+            append({
+                "box_id": box_id,
+                "temperature": None if temp == MISSING_I16 else temp / TEMP_SCALE,
+                "humidity": None if hum == MISSING_U16 else hum / HUM_SCALE,
+                "latitude": None if lat == MISSING_I32 else lat / COORD_SCALE,
+                "longitude": None if lon == MISSING_I32 else lon / COORD_SCALE,
+                "ts": base_ts + dt,
+            })
+    else:
+        for temp, hum, lat, lon in record.iter_unpack(body):
+            append({
+                "box_id": box_id,
+                "temperature": None if temp == MISSING_I16 else temp / TEMP_SCALE,
+                "humidity": None if hum == MISSING_U16 else hum / HUM_SCALE,
+                "latitude": None if lat == MISSING_I32 else lat / COORD_SCALE,
+                "longitude": None if lon == MISSING_I32 else lon / COORD_SCALE,
+            })
+    if base_seq is not None:
+        for i, reading in enumerate(readings):
+            reading["seq"] = base_seq + i
+    return readings
+
+
+def decode_payload(raw: bytes) -> list:
+    """
+    Payload MQTT mentah -> list reading (dict). JSON objek = 1 reading,
+    JSON array = batch; payload biner dideteksi dari byte versinya.
+    """
+    if is_binary(raw):
+        return decode_binary(bytes(raw))
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise PayloadError(f"JSON tidak valid: {e}") from None
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list) and data and all(isinstance(item, dict) for item in data):
+        return data
+    raise PayloadError("Payload JSON harus objek atau array objek")
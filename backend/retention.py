@@ -0,0 +1,324 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from app_logging import get_logger
+from rollups import format_timestamp
+
+log = get_logger("retention")
+
+# ==============================================================================
+# RETENTION & PARTISI BULANAN
+# ==============================================================================
+# smartbox_data hanya menyimpan data mentah "panas" (N hari terakhir). Data
+# yang lebih lama dipindah per bulan ke file SQLite terpisah
+# (partitions/smartbox_YYYY_MM.db) dengan id yang sama, dalam transaksi kecil
+# agar writer ingest tidak terblokir lama. Partisi yang sudah sangat tua
+# dikompres (.db.gz); riwayatnya tetap tersedia lewat tabel rollup.
+#
+# Catatan: transaksi lintas file yang di-ATTACH tidak atomik di mode WAL.
+# Jika proses mati di tengah chunk, chunk yang sama diulang pada run berikutnya
+# (INSERT OR IGNORE), jadi tidak ada data yang hilang.
+
+PARTITION_RE = re.compile(r"^smartbox_(\d{4})_(\d{2})\.db(\.gz)?$")
+
+
+def month_key(timestamp: str) -> str:
+    return timestamp[:7].replace("-", "_")
+
+
+def next_month(key: str) -> str:
+    year, month = int(key[:4]), int(key[5:7])
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}_{month:02d}"
+
+
+def month_start(key: str) -> str:
+    return f"{key[:4]}-{key[5:7]}-01 00:00:00"
+
+
+class PartitionStore:
+    """Daftar file partisi bulanan + koneksi read-only untuk membacanya."""
+
+    def __init__(self, directory, max_age=60.0):
+        self.directory = directory
+        # Daftar file dibaca ulang setelah max_age detik: partisi bisa dibuat
+        # proses lain (retention di worker leader, shard_tool.py)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._cache = None
+        self._listed_at = 0.0
+
+    def path_for(self, key, compressed=False) -> str:
+        return os.path.join(self.directory, f"smartbox_{key}.db" + (".gz" if compressed else ""))
+
+    def refresh(self):
+        with self._lock:
+            self._cache = None
+
+    def list_partitions(self, compressed=False):
+        """[(key, path)] urut dari bulan terbaru. compressed=True untuk arsip .gz."""
+        with self._lock:
+            if self._cache is None or time.monotonic() - self._listed_at > self.max_age:
+                found = {"db": [], "gz": []}
+                if os.path.isdir(self.directory):
+                    for name in os.listdir(self.directory):
+                        match = PARTITION_RE.match(name)
+                        if match:
+                            key = f"{match.group(1)}_{match.group(2)}"
+                            kind = "gz" if match.group(3) else "db"
+                            found[kind].append((key, os.path.join(self.directory, name)))
+                for items in found.values():
+                    items.sort(reverse=True)
+                self._cache = found
+                self._listed_at = time.monotonic()
+            return list(self._cache["gz" if compressed else "db"])
+
+    def has_partitions(self) -> bool:
+        return bool(self.list_partitions())
+
+    def connect(self, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def query_newest_first(self, sql, params, limit):
+        """
+        Jalankan query (harus punya 'LIMIT ?' sebagai parameter terakhir) ke
+        partisi dari yang terbaru sampai `limit` baris terpenuhi.
+        """
+        rows = []
+        for _, path in self.list_partitions():
+            if len(rows) >= limit:
+                break
+            conn = self.connect(path)
+            try:
+                rows.extend(dict(r) for r in conn.execute(sql, (*params, limit - len(rows))).fetchall())
+            except sqlite3.OperationalError:
+                continue  # partisi sedang dikompres / dihapus
+            finally:
+                conn.close()
+        return rows
+
+    def cursor_factories(self, sql, params, newest_first=True):
+        """Factory cursor per partisi (untuk ChainedCursor)."""
+        partitions = self.list_partitions()
+        if not newest_first:
+            partitions = list(reversed(partitions))
+        factories = []
+        for _, path in partitions:
+            def make(path=path):
+                conn = self.connect(path)
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                return cursor, conn
+            factories.append(make)
+        return factories
+
+
+class ChainedCursor:
+    """Gabungkan beberapa cursor menjadi satu sumber fetchmany (hot + partisi)."""
+
+    def __init__(self, factories, row_factory=sqlite3.Row):
+        self._factories = list(factories)
+        self._row_factory = row_factory
+        self._current = None
+        self._conn = None
+
+    def _advance(self):
+        self._close_current()
+        if not self._factories:
+            return False
+        cursor, conn = self._factories.pop(0)()
+        cursor.row_factory = self._row_factory
+        self._current, self._conn = cursor, conn
+        return True
+
+    def _close_current(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._current = None
+        self._conn = None
+
+    def fetchmany(self, size):
+        while True:
+            if self._current is None and not self._advance():
+                return []
+            rows = self._current.fetchmany(size)
+            if rows:
+                return rows
+            self._current = None
+
+    def close(self):
+        self._close_current()
+        self._factories = []
+
+
+class RetentionWorker:
+    """Background job: pindahkan data lama ke partisi bulanan, kompres partisi tua."""
+
+    def __init__(self, db_file, store, raw_days=30, interval=3600,
+                 chunk_rows=5000, compress_after_months=12, pause=0.05):
+        self.db_file = db_file
+        self.store = store
+        self.raw_days = raw_days
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.compress_after_months = compress_after_months
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "rows_moved": 0,
+            "partitions_compressed": 0,
+            "last_run": None,
+            "last_duration_s": None,
+            "last_error": None,
+        }
+
+    # --- LIFECYCLE ---
+
+    def start(self):
+        if self.raw_days <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats["last_error"] = str(e)
+                log.error("retention job failed", error=str(e))
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["raw_days"] = self.raw_days
+        data["partitions"] = [key for key, _ in self.store.list_partitions()]
+        data["archived"] = [key for key, _ in self.store.list_partitions(compressed=True)]
+        return data
+
+    # --- JOB ---
+
+    def run_once(self, now=None):
+        started = time.time()
+        now = now or started
+        cutoff = format_timestamp(int(now) - self.raw_days * 86400)
+        moved = self.move_old_rows(cutoff)
+        compressed = self.compress_old_partitions(now)
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["rows_moved"] += moved
+            self._stats["partitions_compressed"] += compressed
+            self._stats["last_run"] = format_timestamp(int(started))
+            self._stats["last_duration_s"] = round(time.time() - started, 3)
+            self._stats["last_error"] = None
+        if moved or compressed:
+            log.info("retention run finished", rows_moved=moved, partitions_compressed=compressed)
+        return moved
+
+    def _connect(self):
+        # Koneksi khusus (bukan dari pool) karena memakai ATTACH
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def move_old_rows(self, cutoff) -> int:
+        os.makedirs(self.store.directory, exist_ok=True)
+        conn = self._connect()
+        total = 0
+        try:
+            oldest = conn.execute(
+                "SELECT MIN(timestamp) FROM smartbox_data WHERE timestamp < ?", (cutoff,)
+            ).fetchone()[0]
+            if oldest is None:
+                return 0
+            main_columns = [r[1] for r in conn.execute("PRAGMA main.table_info(smartbox_data)")]
+            key = month_key(oldest)
+            while month_start(key) < cutoff and not self._stop.is_set():
+                upper = min(month_start(next_month(key)), cutoff)
+                total += self._move_month(conn, key, month_start(key), upper, main_columns)
+                key = next_month(key)
+        finally:
+            conn.close()
+        if total:
+            self.store.refresh()
+        return total
+
+    def _move_month(self, conn, key, lower, upper, main_columns) -> int:
+        path = self.store.path_for(key)
+        conn.execute("ATTACH DATABASE ? AS part", (path,))
+        moved = 0
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS part.smartbox_data AS SELECT * FROM main.smartbox_data WHERE 0")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS part.idx_part_id ON smartbox_data (id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS part.idx_part_box_ts ON smartbox_data (box_id, timestamp)")
+            conn.commit()
+            part_columns = {r[1] for r in conn.execute("PRAGMA part.table_info(smartbox_data)")}
+            columns = ", ".join(c for c in main_columns if c in part_columns)
+
+            while not self._stop.is_set():
+                conn.execute("BEGIN IMMEDIATE")
+                ids = [r[0] for r in conn.execute(
+                    "SELECT id FROM main.smartbox_data WHERE timestamp >= ? AND timestamp < ? LIMIT ?",
+                    (lower, upper, self.chunk_rows)
+                )]
+                if not ids:
+                    conn.execute("COMMIT")
+                    break
+                id_list = json.dumps(ids)
+                conn.execute(
+                    f"INSERT OR IGNORE INTO part.smartbox_data ({columns}) "
+                    f"SELECT {columns} FROM main.smartbox_data WHERE id IN (SELECT value FROM json_each(?))",
+                    (id_list,)
+                )
+                conn.execute("DELETE FROM main.smartbox_data WHERE id IN (SELECT value FROM json_each(?))", (id_list,))
+                conn.execute("COMMIT")
+                moved += len(ids)
+                # Beri kesempatan writer ingest mengambil write lock
+                time.sleep(self.pause)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DETACH DATABASE part")
+        return moved
+
+    def compress_old_partitions(self, now) -> int:
+        if self.compress_after_months <= 0:
+            return 0
+        limit_key = month_key(format_timestamp(int(now)))
+        for _ in range(self.compress_after_months):
+            year, month = int(limit_key[:4]), int(limit_key[5:7])
+            year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+            limit_key = f"{year:04d}_{month:02d}"
+        count = 0
+        for key, path in self.store.list_partitions():
+            if key >= limit_key:
+                continue
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(path)
+            count += 1
+        if count:
+            self.store.refresh()
+        return count
@@ -0,0 +1,267 @@
+import calendar
+import time
+
+# ==============================================================================
+# ROLLUP (DOWNSAMPLING) PER BUCKET WAKTU
+# ==============================================================================
+# Tabel smartbox_rollup menyimpan agregat per (box, resolusi, awal bucket):
+# count/min/max/sum suhu & kelembapan plus posisi terakhir. Diperbarui di
+# transaksi yang sama dengan insert batch, jadi query riwayat jangka panjang
+# cukup membaca baris agregat, bukan data mentah.
+#
+# "Posisi terakhir" = reading dengan (timestamp, id) terbesar di bucket, sama
+# seperti spatial.py: reading terlambat / backfill mendapat id baru tetapi
+# timestamp perangkat lama, jadi tidak boleh menimpa posisi terkini.
+# Kolom last_ts (epoch) ditambahkan migrasi 10, di akhir tabel.
+
+RESOLUTIONS = {
+    "1m": 60,
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS smartbox_rollup (
+    box_id TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    reading_count INTEGER NOT NULL DEFAULT 0,
+    temp_count INTEGER NOT NULL DEFAULT 0,
+    temp_min REAL,
+    temp_max REAL,
+    temp_sum REAL NOT NULL DEFAULT 0,
+    hum_count INTEGER NOT NULL DEFAULT 0,
+    hum_min REAL,
+    hum_max REAL,
+    hum_sum REAL NOT NULL DEFAULT 0,
+    last_id INTEGER NOT NULL,
+    last_latitude REAL,
+    last_longitude REAL,
+    PRIMARY KEY (box_id, resolution, bucket_start)
+) WITHOUT ROWID
+"""
+
+# min()/max() skalar SQLite menghasilkan NULL jika salah satu argumennya
+# NULL, jadi kedua sisi dibungkus COALESCE. Semua ekspresi SET membaca nilai
+# lama baris, jadi last_ts / last_id diperbarui dengan CASE yang sama.
+# last_ts NULL (bucket lama yang data mentahnya sudah dipindah) = paling lama.
+_NEWER = "(excluded.last_ts, excluded.last_id) > (COALESCE(last_ts, -1), last_id)"
+UPSERT_SQL = f"""
+INSERT INTO smartbox_rollup (
+    box_id, resolution, bucket_start, reading_count,
+    temp_count, temp_min, temp_max, temp_sum,
+    hum_count, hum_min, hum_max, hum_sum,
+    last_id, last_latitude, last_longitude, last_ts
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (box_id, resolution, bucket_start) DO UPDATE SET
+    reading_count = reading_count + excluded.reading_count,
+    temp_count = temp_count + excluded.temp_count,
+    temp_min = min(COALESCE(temp_min, excluded.temp_min), COALESCE(excluded.temp_min, temp_min)),
+    temp_max = max(COALESCE(temp_max, excluded.temp_max), COALESCE(excluded.temp_max, temp_max)),
+    temp_sum = temp_sum + excluded.temp_sum,
+    hum_count = hum_count + excluded.hum_count,
+    hum_min = min(COALESCE(hum_min, excluded.hum_min), COALESCE(excluded.hum_min, hum_min)),
+    hum_max = max(COALESCE(hum_max, excluded.hum_max), COALESCE(excluded.hum_max, hum_max)),
+    hum_sum = hum_sum + excluded.hum_sum,
+    last_latitude = CASE WHEN {_NEWER} THEN excluded.last_latitude ELSE last_latitude END,
+    last_longitude = CASE WHEN {_NEWER} THEN excluded.last_longitude ELSE last_longitude END,
+    last_ts = CASE WHEN {_NEWER} THEN excluded.last_ts ELSE last_ts END,
+    last_id = CASE WHEN {_NEWER} THEN excluded.last_id ELSE last_id END
+"""
+
+
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+
+def parse_timestamp(value) -> int:
+    """'YYYY-MM-DD[ HH:MM[:SS]]' (UTC, format SQLite) atau epoch -> epoch detik."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().replace("T", " ").rstrip("Z")
+    if value.isdigit():
+        return int(value)
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(value[:19], fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid timestamp: {value}")
+
+
+def format_timestamp(epoch) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def _merge(agg, value, kind):
+    if value is None:
+        return
+    agg[kind + "_count"] += 1
+    agg[kind + "_sum"] += value
+    current_min = agg[kind + "_min"]
+    current_max = agg[kind + "_max"]
+    agg[kind + "_min"] = value if current_min is None or value < current_min else current_min
+    agg[kind + "_max"] = value if current_max is None or value > current_max else current_max
+
+
+def _merge_bucket(agg, other):
+    """Gabungkan agregat bucket halus ke bucket yang lebih kasar."""
+    agg["count"] += other["count"]
+    for kind in ("temp", "hum"):
+        if not other[kind + "_count"]:
+            continue
+        agg[kind + "_count"] += other[kind + "_count"]
+        agg[kind + "_sum"] += other[kind + "_sum"]
+        low, high = other[kind + "_min"], other[kind + "_max"]
+        if agg[kind + "_min"] is None or low < agg[kind + "_min"]:
+            agg[kind + "_min"] = low
+        if agg[kind + "_max"] is None or high > agg[kind + "_max"]:
+            agg[kind + "_max"] = high
+    if (other["last_ts"], other["last_id"]) >= (agg["last_ts"], agg["last_id"]):
+        agg["last_ts"] = other["last_ts"]
+        agg["last_id"] = other["last_id"]
+        agg["lat"] = other["lat"]
+        agg["lon"] = other["lon"]
+
+
+def aggregate_rows(rows):
+    """
+    Pra-agregasi satu batch di Python -> parameter UPSERT_SQL (satu per bucket).
+    Baris hanya diagregasi di resolusi terhalus; resolusi yang lebih kasar
+    digabung dari bucket resolusi sebelumnya (setiap resolusi habis dibagi
+    resolusi sebelumnya), jadi biaya per baris tidak bertambah per resolusi.
+    """
+    resolutions = sorted(RESOLUTIONS.values())
+    finest = resolutions[0]
+    levels = [{}]
+    buckets = levels[0]
+    parsed = {}
+    for row in rows:
+        ts = row["timestamp"]
+        epoch = parsed.get(ts)
+        if epoch is None:
+            epoch = parsed[ts] = parse_timestamp(ts)
+        key = (row["box_id"], epoch - epoch % finest)
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = {
+                "count": 0,
+                "temp_count": 0, "temp_min": None, "temp_max": None, "temp_sum": 0.0,
+                "hum_count": 0, "hum_min": None, "hum_max": None, "hum_sum": 0.0,
+                "last_ts": epoch, "last_id": row["id"], "lat": row["latitude"], "lon": row["longitude"],
+            }
+        agg["count"] += 1
+        _merge(agg, row["temperature"], "temp")
+        _merge(agg, row["humidity"], "hum")
+        if (epoch, row["id"]) >= (agg["last_ts"], agg["last_id"]):
+            agg["last_ts"] = epoch
+            agg["last_id"] = row["id"]
+            agg["lat"] = row["latitude"]
+            agg["lon"] = row["longitude"]
+
+    for seconds in resolutions[1:]:
+        coarser = {}
+        for (box_id, bucket), other in levels[-1].items():
+            key = (box_id, bucket - bucket % seconds)
+            agg = coarser.get(key)
+            if agg is None:
+                coarser[key] = dict(other)
+            else:
+                _merge_bucket(agg, other)
+        levels.append(coarser)
+
+    return [(
+        box_id, seconds, bucket, a["count"],
+        a["temp_count"], a["temp_min"], a["temp_max"], a["temp_sum"],
+        a["hum_count"], a["hum_min"], a["hum_max"], a["hum_sum"],
+        a["last_id"], a["lat"], a["lon"], a["last_ts"]
+    ) for seconds, level in zip(resolutions, levels) for (box_id, bucket), a in level.items()]
+
+
+def apply_rollups(conn, rows):
+    """Perbarui rollup untuk baris yang baru di-insert (dalam transaksi pemanggil)."""
+    params = aggregate_rows(rows)
+    if params:
+        conn.executemany(UPSERT_SQL, params)
+
+
+def backfill_rollups(conn):
+    """Bangun ulang rollup dari seluruh isi smartbox_data (dipakai migrasi)."""
+    conn.execute(CREATE_TABLE_SQL)
+    conn.execute("DELETE FROM smartbox_rollup")
+    for seconds in RESOLUTIONS.values():
+        conn.execute("""
+            INSERT INTO smartbox_rollup (
+                box_id, resolution, bucket_start, reading_count,
+                temp_count, temp_min, temp_max, temp_sum,
+                hum_count, hum_min, hum_max, hum_sum, last_id
+            )
+            SELECT box_id, ?, (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ?, COUNT(*),
+                   COUNT(temperature), MIN(temperature), MAX(temperature), TOTAL(temperature),
+                   COUNT(humidity), MIN(humidity), MAX(humidity), TOTAL(humidity), MAX(id)
+            FROM smartbox_data
+            GROUP BY box_id, 3
+        """, (seconds, seconds, seconds))
+    # Reading terakhir per bucket menurut (timestamp, id), lewat index (box_id, timestamp)
+    conn.execute("""
+        UPDATE smartbox_rollup SET last_id = COALESCE((
+            SELECT id FROM smartbox_data
+            WHERE box_id = smartbox_rollup.box_id
+              AND timestamp >= datetime(smartbox_rollup.bucket_start, 'unixepoch')
+              AND timestamp < datetime(smartbox_rollup.bucket_start + smartbox_rollup.resolution, 'unixepoch')
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ), last_id)
+    """)
+    conn.execute("""
+        UPDATE smartbox_rollup SET
+            last_latitude = (SELECT latitude FROM smartbox_data WHERE id = smartbox_rollup.last_id),
+            last_longitude = (SELECT longitude FROM smartbox_data WHERE id = smartbox_rollup.last_id)
+    """)
+    # Dipanggil juga oleh migrasi 4 (sebelum kolom last_ts ada)
+    if "last_ts" in {row[1] for row in conn.execute("PRAGMA table_info(smartbox_rollup)")}:
+        conn.execute(FILL_LAST_TS_SQL)
+
+
+# last_ts dari baris last_id; NULL jika baris mentahnya sudah dipindah ke partisi
+FILL_LAST_TS_SQL = """
+    UPDATE smartbox_rollup SET last_ts = (
+        SELECT CAST(strftime('%s', timestamp) AS INTEGER) FROM smartbox_data WHERE id = smartbox_rollup.last_id
+    )
+"""
+
+
+def add_last_ts(conn):
+    """Migrasi 10: kolom last_ts untuk memilih posisi terakhir per (timestamp, id)."""
+    conn.execute("ALTER TABLE smartbox_rollup ADD COLUMN last_ts INTEGER")
+    # Sebelum timestamp perangkat (migrasi 7) urutan id = urutan waktu, jadi
+    # last_id lama tetap benar; cukup isi timestamp-nya
+    conn.execute(FILL_LAST_TS_SQL)
+
+
+def query_rollups(conn, box_id, resolution, start, end):
+    """Agregat per bucket untuk satu box pada rentang [start, end) (epoch detik)."""
+    seconds = RESOLUTIONS[resolution]
+    cursor = conn.execute("""
+        SELECT bucket_start, temp_count, temp_min, temp_max, temp_sum,
+               hum_count, hum_min, hum_max, hum_sum, last_latitude, last_longitude,
+               reading_count
+        FROM smartbox_rollup
+        WHERE box_id = ? AND resolution = ? AND bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+    """, (box_id, seconds, start - start % seconds, end))
+    result = []
+    for row in cursor:
+        result.append({
+            "bucket_start": format_timestamp(row[0]),
+            "temperature_min": row[2],
+            "temperature_max": row[3],
+            "temperature_avg": row[4] / row[1] if row[1] else None,
+            "humidity_min": row[6],
+            "humidity_max": row[7],
+            "humidity_avg": row[8] / row[5] if row[5] else None,
+            "latitude": row[9],
+            "longitude": row[10],
+            "count": row[11],
+        })
+    return result
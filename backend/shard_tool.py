@@ -0,0 +1,395 @@
+"""
+SmartBox Shard Tool
+
+Lihat sebaran box per shard dan pindahkan box antar shard: data mentah,
+partisi bulanan, rollup, posisi terakhir dan entry direktori box_shards.
+
+Cara menjalankan (dari folder backend, dengan SHARD_COUNT / SHARD_KEY /
+SHARD_DIR yang sama dengan server):
+    python shard_tool.py status
+    python shard_tool.py move SMARTBOX-001 SMARTBOX-002 --to 2
+    python shard_tool.py rebalance --dry-run
+    python shard_tool.py rebalance                   # semua box ke shard menurut SHARD_KEY
+    python shard_tool.py rebalance --target-count 1  # kosongkan shard 1..N-1 sebelum SHARD_COUNT diturunkan
+
+Server boleh tetap berjalan. Urutan pemindahan:
+  1. salin data box ke shard tujuan (chunk kecil; shard asal tetap dipakai)
+  2. ubah box_shards ke shard tujuan
+  3. tunggu --settle detik (default SHARD_DIRECTORY_TTL + 5) sampai cache
+     direktori di semua proses kedaluwarsa
+  4. salin baris yang masih sempat masuk ke shard asal, lalu hapus box dari shard asal
+Setiap langkah dicatat di tabel shard_moves. Jika tool terhenti, jalankan
+lagi perintah apa pun: pemindahan yang belum selesai dilanjutkan lebih dulu.
+Partisi yang sudah dikompres (.db.gz) tidak dipindah; riwayatnya tetap ada di rollup.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+# Konfigurasi (DB_FILE, SHARD_*) dan daftar shard sama persis dengan server
+import backend
+from rollups import apply_rollups
+from spatial import apply_positions
+
+DATA_COLUMNS = ("id", "box_id", "temperature", "humidity", "latitude", "longitude", "timestamp", "seq", "received_at")
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def in_transaction(conn, work):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = work()
+        conn.execute("COMMIT")
+        return result
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# ==============================================================================
+# LANGKAH PEMINDAHAN
+# ==============================================================================
+
+def copy_box(source, target, box_id, options) -> int:
+    """Langkah 1: salin data panas, rollup & posisi. Return id terbesar yang disalin."""
+    columns = ", ".join(DATA_COLUMNS)
+    conn = connect(target.path)
+    conn.execute("ATTACH DATABASE ? AS src", (source.path,))
+    copied = {"max_id": 0, "done": False}
+
+    def chunk():
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM src.smartbox_data WHERE box_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (box_id, copied["max_id"], options.chunk_rows)
+        )]
+        if ids:
+            conn.execute(
+                f"INSERT OR IGNORE INTO main.smartbox_data ({columns}) "
+                f"SELECT {columns} FROM src.smartbox_data WHERE box_id = ? AND id > ? AND id <= ?",
+                (box_id, copied["max_id"], ids[-1])
+            )
+            copied["max_id"] = ids[-1]
+        if len(ids) < options.chunk_rows:
+            # Potongan terakhir: rollup & posisi dibaca dari snapshot yang sama
+            # dengan baris terakhir yang disalin, jadi baris sesudahnya (langkah 4)
+            # tidak terhitung dua kali
+            conn.execute("DELETE FROM main.smartbox_rollup WHERE box_id = ?", (box_id,))
+            conn.execute("INSERT INTO main.smartbox_rollup SELECT * FROM src.smartbox_rollup WHERE box_id = ?", (box_id,))
+            position = conn.execute(
+                "SELECT box_id, reading_id AS id, latitude, longitude, timestamp FROM src.box_positions WHERE box_id = ?",
+                (box_id,)
+            ).fetchone()
+            if position is not None:
+                apply_positions(conn, [dict(position)])
+            copied["done"] = True
+
+    try:
+        while not copied["done"]:
+            in_transaction(conn, chunk)
+            # Beri kesempatan writer ingest di kedua shard
+            time.sleep(options.pause)
+    finally:
+        conn.close()
+    return copied["max_id"]
+
+
+def copy_partitions(source, target, box_id) -> int:
+    """Langkah 1 (arsip): salin baris box dari partisi bulanan shard asal ke partisi shard tujuan."""
+    copied = 0
+    for key, path in source.partitions.list_partitions():
+        part = connect(path)
+        try:
+            found = part.execute("SELECT 1 FROM smartbox_data WHERE box_id = ? LIMIT 1", (box_id,)).fetchone()
+        finally:
+            part.close()
+        if found is None:
+            # Jangan buat file partisi kosong di shard tujuan
+            continue
+        os.makedirs(target.partitions.directory, exist_ok=True)
+        conn = connect(target.partitions.path_for(key))
+        try:
+            conn.execute("ATTACH DATABASE ? AS src", (path,))
+            conn.execute("CREATE TABLE IF NOT EXISTS main.smartbox_data AS SELECT * FROM src.smartbox_data WHERE 0")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS main.idx_part_id ON smartbox_data (id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS main.idx_part_box_ts ON smartbox_data (box_id, timestamp)")
+            # Partisi lama bisa belum punya kolom baru (seq, received_at)
+            target_columns = {r[1] for r in conn.execute("PRAGMA main.table_info(smartbox_data)")}
+            columns = ", ".join(r[1] for r in conn.execute("PRAGMA src.table_info(smartbox_data)")
+                                if r[1] in target_columns)
+            copied += in_transaction(conn, lambda: conn.execute(
+                f"INSERT OR IGNORE INTO main.smartbox_data ({columns}) "
+                f"SELECT {columns} FROM src.smartbox_data WHERE box_id = ?", (box_id,)
+            ).rowcount)
+        finally:
+            conn.close()
+    target.partitions.refresh()
+    return copied
+
+
+SWEEP_DUPLICATE_QUERY = """
+    SELECT 1 FROM main.smartbox_data
+    WHERE box_id = :box_id AND seq = :seq
+      AND timestamp BETWEEN datetime(:timestamp, :before) AND datetime(:timestamp, :after)
+    LIMIT 1
+"""
+
+
+def sweep_box(source, target, box_id, after_id) -> int:
+    """Langkah 4: baris yang masuk ke shard asal setelah langkah 1 (cache direktori lama)."""
+    columns = ", ".join(DATA_COLUMNS)
+    placeholders = ", ".join("?" for _ in DATA_COLUMNS)
+    conn = connect(target.path)
+    conn.execute("ATTACH DATABASE ? AS src", (source.path,))
+
+    def work():
+        rows = [dict(row) for row in conn.execute(
+            f"SELECT {columns} FROM src.smartbox_data WHERE box_id = ? AND id > ? ORDER BY id", (box_id, after_id)
+        )]
+        inserted = []
+        for row in rows:
+            # Redelivery yang sempat ditulis ke kedua shard: duplikat (box_id, seq)
+            # dalam jendela dedup yang sudah ada di tujuan tidak disalin
+            if row["seq"] is not None and conn.execute(SWEEP_DUPLICATE_QUERY, {
+                "box_id": box_id, "seq": row["seq"], "timestamp": row["timestamp"],
+                "before": f"-{backend.INGEST_DEDUP_WINDOW} seconds",
+                "after": f"+{backend.INGEST_DEDUP_WINDOW} seconds",
+            }).fetchone():
+                continue
+            cursor = conn.execute(f"INSERT OR IGNORE INTO main.smartbox_data ({columns}) VALUES ({placeholders})",
+                                  [row[c] for c in DATA_COLUMNS])
+            # Baris yang sudah tersalin (id sama) tidak ikut dihitung rollup
+            if cursor.rowcount:
+                inserted.append(row)
+        apply_rollups(conn, inserted)
+        apply_positions(conn, inserted)
+        return max([after_id] + [row["id"] for row in rows])
+
+    try:
+        return in_transaction(conn, work)
+    finally:
+        conn.close()
+
+
+def delete_from_source(source, box_id, max_id, options) -> int:
+    """Langkah 4: hapus box dari shard asal. Return jumlah baris yang tersisa (id > max_id)."""
+    conn = connect(source.path)
+    try:
+        while in_transaction(conn, lambda: conn.execute(
+            "DELETE FROM smartbox_data WHERE id IN "
+            "(SELECT id FROM smartbox_data WHERE box_id = ? AND id <= ? LIMIT ?)",
+            (box_id, max_id, options.chunk_rows)
+        ).rowcount) >= options.chunk_rows:
+            time.sleep(options.pause)
+        remaining = conn.execute("SELECT COUNT(*) FROM smartbox_data WHERE box_id = ?", (box_id,)).fetchone()[0]
+        if remaining:
+            return remaining
+
+        def drop_summary():
+            conn.execute("DELETE FROM smartbox_rollup WHERE box_id = ?", (box_id,))
+            position = conn.execute("SELECT rid FROM box_positions WHERE box_id = ?", (box_id,)).fetchone()
+            if position is not None:
+                conn.execute("DELETE FROM box_positions_rtree WHERE rid = ?", (position[0],))
+                conn.execute("DELETE FROM box_positions WHERE rid = ?", (position[0],))
+        in_transaction(conn, drop_summary)
+    finally:
+        conn.close()
+
+    for _, path in source.partitions.list_partitions():
+        part = connect(path)
+        try:
+            in_transaction(part, lambda: part.execute("DELETE FROM smartbox_data WHERE box_id = ?", (box_id,)))
+        finally:
+            part.close()
+    return 0
+
+
+# ==============================================================================
+# JOURNAL & ALUR
+# ==============================================================================
+
+def pending_moves(main):
+    return [dict(row) for row in main.execute("SELECT * FROM shard_moves ORDER BY box_id")]
+
+
+def run_moves(moves, options):
+    """moves: [(box_id, shard asal, shard tujuan)]. Pemindahan lama di journal dilanjutkan dulu."""
+    router = backend.shard_router
+    main = connect(backend.DB_FILE)
+    try:
+        queued = {move["box_id"] for move in pending_moves(main)}
+        in_transaction(main, lambda: main.executemany(
+            "INSERT INTO shard_moves (box_id, source, target, state) VALUES (?, ?, ?, 'copying')",
+            [(box_id, source, target) for box_id, source, target in moves if box_id not in queued]
+        ))
+        journal = pending_moves(main)
+        if not journal:
+            print("Tidak ada box yang perlu dipindah.")
+            return
+
+        # 1-2. Salin lalu alihkan direktori
+        for move in journal:
+            if move["state"] != "copying":
+                continue
+            source, target = router.shards[move["source"]], router.shards[move["target"]]
+            started = time.monotonic()
+            copied_max = copy_box(source, target, move["box_id"], options)
+            archived = copy_partitions(source, target, move["box_id"])
+
+            def switch():
+                main.execute("UPDATE box_shards SET shard = ?, assigned_at = CURRENT_TIMESTAMP WHERE box_id = ?",
+                             (move["target"], move["box_id"]))
+                main.execute("UPDATE shard_moves SET state = 'switched', copied_max = ?, switched_at = ? "
+                             "WHERE box_id = ?", (copied_max, time.time(), move["box_id"]))
+            in_transaction(main, switch)
+            print(f"[COPY] {move['box_id']}: shard {move['source']} -> {move['target']} "
+                  f"(sampai id {copied_max}, {archived} baris partisi, {time.monotonic() - started:.1f}s)")
+
+        # 3. Tunggu cache direktori semua proses kedaluwarsa
+        journal = pending_moves(main)
+        wait = max(move["switched_at"] + options.settle - time.time() for move in journal)
+        if wait > 0:
+            print(f"[WAIT] {wait:.0f}s sampai cache direktori shard di semua proses kedaluwarsa...")
+            time.sleep(wait)
+
+        # 4. Sapu sisa di shard asal lalu hapus
+        leftover = 0
+        for move in journal:
+            source, target = router.shards[move["source"]], router.shards[move["target"]]
+            swept_max = sweep_box(source, target, move["box_id"], move["copied_max"])
+            remaining = delete_from_source(source, move["box_id"], swept_max, options)
+            if remaining:
+                leftover += 1
+                in_transaction(main, lambda: main.execute(
+                    "UPDATE shard_moves SET copied_max = ?, switched_at = ? WHERE box_id = ?",
+                    (swept_max, time.time(), move["box_id"])))
+                print(f"[WARN] {move['box_id']}: {remaining} baris baru masih masuk ke shard {move['source']}, "
+                      f"jalankan ulang tool ini")
+                continue
+            in_transaction(main, lambda: main.execute("DELETE FROM shard_moves WHERE box_id = ?", (move["box_id"],)))
+            print(f"[DONE] {move['box_id']} sekarang di shard {move['target']}")
+        print(f"Selesai: {len(journal) - leftover} box dipindah, {leftover} perlu dijalankan ulang.")
+    finally:
+        main.close()
+
+
+# ==============================================================================
+# PERINTAH
+# ==============================================================================
+
+def cmd_status(options):
+    router = backend.shard_router
+    main = connect(backend.DB_FILE)
+    try:
+        directory = dict(main.execute("SELECT shard, COUNT(*) FROM box_shards GROUP BY shard").fetchall())
+        pending = pending_moves(main)
+    finally:
+        main.close()
+    print(f"SHARD_COUNT={backend.SHARD_COUNT} SHARD_KEY={router.key} file shard={router.count}")
+    print(f"{'Shard':>5} {'Box':>7} {'Baris':>12} {'MB':>9}  Path")
+    for shard in router.shards:
+        conn = connect(shard.path)
+        try:
+            rows = conn.execute("SELECT COUNT(*) FROM smartbox_data").fetchone()[0]
+        finally:
+            conn.close()
+        size = sum(os.path.getsize(p) for p in (shard.path, shard.path + "-wal") if os.path.exists(p))
+        print(f"{shard.index:>5} {directory.get(shard.index, 0):>7} {rows:>12} {size / 1e6:>9.1f}  {shard.path}")
+    for move in pending:
+        print(f"[PENDING] {move['box_id']}: shard {move['source']} -> {move['target']} ({move['state']})")
+
+
+def cmd_move(options):
+    router = backend.shard_router
+    if not 0 <= options.to < router.count:
+        raise SystemExit(f"Shard tujuan harus 0..{router.count - 1}")
+    main = connect(backend.DB_FILE)
+    try:
+        current = dict(main.execute(
+            "SELECT box_id, shard FROM box_shards WHERE box_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(options.box_ids),)
+        ).fetchall())
+    finally:
+        main.close()
+    for box_id in options.box_ids:
+        if box_id not in current:
+            print(f"[SKIP] {box_id}: belum tercatat di box_shards (belum pernah ada data)")
+    run_moves([(box_id, shard, options.to) for box_id, shard in current.items() if shard != options.to], options)
+
+
+def cmd_rebalance(options):
+    router = backend.shard_router
+    target_count = options.target_count or router.count
+    if not 1 <= target_count <= router.count:
+        raise SystemExit(f"--target-count harus 1..{router.count} (naikkan SHARD_COUNT dulu untuk menambah shard)")
+    main = connect(backend.DB_FILE)
+    try:
+        rows = main.execute("""
+            SELECT s.box_id, s.shard, o.user_id FROM box_shards s
+            LEFT JOIN box_ownership o ON o.box_id = s.box_id
+            ORDER BY s.box_id
+        """).fetchall()
+    finally:
+        main.close()
+    moves = []
+    for row in rows:
+        target = router.policy_shard(row["box_id"], row["user_id"], target_count)
+        if target != row["shard"]:
+            moves.append((row["box_id"], row["shard"], target))
+    if options.limit:
+        moves = moves[:options.limit]
+
+    plan = {}
+    for _, source, target in moves:
+        plan[(source, target)] = plan.get((source, target), 0) + 1
+    for (source, target), count in sorted(plan.items()):
+        print(f"[PLAN] shard {source} -> {target}: {count} box")
+    if options.dry_run:
+        print(f"Dry run: {len(moves)} dari {len(rows)} box akan dipindah.")
+        return
+    run_moves(moves, options)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SmartBox shard tool (status & pemindahan box antar shard)")
+    parser.add_argument("--settle", type=float, default=backend.SHARD_DIRECTORY_TTL + 5,
+                        help="Detik menunggu cache direktori proses lain kedaluwarsa (0 jika server mati)")
+    parser.add_argument("--chunk-rows", type=int, default=backend.RETENTION_CHUNK_ROWS)
+    parser.add_argument("--pause", type=float, default=0.05, help="Jeda antar chunk (detik)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    status = commands.add_parser("status", help="Jumlah box, baris & ukuran file per shard")
+    status.set_defaults(run=cmd_status)
+
+    move = commands.add_parser("move", help="Pindahkan box tertentu ke satu shard")
+    move.add_argument("box_ids", nargs="+")
+    move.add_argument("--to", type=int, required=True)
+    move.set_defaults(run=cmd_move)
+
+    rebalance = commands.add_parser("rebalance", help="Pindahkan box ke shard menurut SHARD_KEY")
+    rebalance.add_argument("--target-count", type=int, help="Hitung tujuan untuk N shard (default: semua file shard)")
+    rebalance.add_argument("--limit", type=int, default=0, help="Maks box yang dipindah dalam satu run")
+    rebalance.add_argument("--dry-run", action="store_true")
+    rebalance.set_defaults(run=cmd_rebalance)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    # Skema (box_shards, shard_moves, file shard) dibuat / dimigrasi dulu
+    backend.initialize_database()
+    try:
+        options.run(options)
+    finally:
+        backend.shard_router.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import heapq
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from app_logging import get_logger
+
+log = get_logger("shards")
+
+# ==============================================================================
+# SHARDING DATA SENSOR (BEBERAPA FILE SQLITE)
+# ==============================================================================
+# Data mentah, rollup dan posisi terakhir box disimpan di salah satu dari
+# SHARD_COUNT file SQLite. Shard 0 selalu database utama (yang juga memegang
+# users, box_ownership, alert_*), shard 1..N-1 ada di folder shards/. Setiap
+# shard punya write lock sendiri, jadi ingest & export satu mitra tidak
+# mengantri di lock yang sama dengan mitra lain.
+#
+# Box -> shard dicatat di tabel box_shards (database utama) saat box pertama
+# kali ditulis, dan di-cache di memori dengan TTL. Shard ditentukan dari owner
+# box (semua box satu mitra di satu shard) atau hash box_id jika box belum
+# terdaftar / SHARD_KEY=box. Entry yang sudah ada tidak pernah berubah sendiri:
+# memindah box antar shard dilakukan shard_tool.py.
+#
+# Id smartbox_data tetap unik & naik lintas shard: dengan lebih dari satu
+# shard, id dialokasikan per batch dari file kecil shards/sequence.db (di dalam
+# write lock shard, jadi urutan commit per shard = urutan id).
+
+SHARD_KEYS = ("owner", "box")
+
+SHARD_FILE_RE = re.compile(r"^smartbox_shard_(\d+)\.db$")
+
+# id terbesar yang pernah dipakai, termasuk baris yang sudah dipindah ke partisi
+LAST_ID_QUERY = """
+    SELECT MAX(IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'smartbox_data'), 0),
+               IFNULL((SELECT MAX(id) FROM smartbox_data), 0))
+"""
+
+# Shard yang tercatat + owner box (untuk tebakan shard box yang belum pernah ditulis)
+LOOKUP_QUERY = """
+    SELECT b.value AS box_id, s.shard, o.user_id
+    FROM json_each(?) b
+    LEFT JOIN box_shards s ON s.box_id = b.value
+    LEFT JOIN box_ownership o ON o.box_id = b.value
+"""
+
+
+def shard_path(directory, index) -> str:
+    return os.path.join(directory, f"smartbox_shard_{index:02d}.db")
+
+
+def existing_shard_count(directory) -> int:
+    """1 + index file shard tertinggi yang ada di folder (0 jika tidak ada)."""
+    highest = 0
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = SHARD_FILE_RE.match(name)
+            if match:
+                highest = max(highest, int(match.group(1)) + 1)
+    return highest
+
+
+def hash_shard(key, count) -> int:
+    # crc32: stabil antar proses & versi Python (hash() str di-random per proses)
+    return zlib.crc32(str(key).encode()) % count if count > 1 else 0
+
+
+class Shard:
+    def __init__(self, index, path, pool, partitions, export_pool=None):
+        self.index = index
+        self.path = path
+        self.pool = pool
+        # Pool read-only kecil untuk export yang di-stream lama: client lambat
+        # tidak menghabiskan koneksi writer ingest & request API
+        self.export_pool = export_pool or pool
+        # PartitionStore partisi bulanan milik shard ini
+        self.partitions = partitions
+
+
+class IdSequence:
+    """Alokasi blok id smartbox_data lintas shard (transaksi sangat pendek)."""
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS id_sequence (
+                    name TEXT PRIMARY KEY,
+                    next_id INTEGER NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO id_sequence (name, next_id) VALUES ('smartbox_data', 1)")
+            self._conn = conn
+        return self._conn
+
+    def ensure_at_least(self, next_id):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE id_sequence SET next_id = MAX(next_id, ?) WHERE name = 'smartbox_data'", (next_id,)
+            )
+
+    def allocate(self, count) -> int:
+        """Pesan `count` id berurutan. Return id terakhir SEBELUM blok (seperti last_id)."""
+        with self._lock:
+            next_id = self._connect().execute(
+                "UPDATE id_sequence SET next_id = next_id + ? WHERE name = 'smartbox_data' RETURNING next_id",
+                (count,)
+            ).fetchone()[0]
+        return next_id - count - 1
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class MergedCursor:
+    """
+    Gabungkan cursor dari beberapa shard yang masing-masing sudah urut
+    (default kolom pertama = id) menjadi satu sumber fetchmany yang tetap urut.
+    """
+
+    def __init__(self, cursors, key=lambda row: row[0], chunk_rows=5000):
+        self._cursors = list(cursors)
+        self._merged = heapq.merge(*(self._iterate(cursor, chunk_rows) for cursor in self._cursors), key=key)
+
+    @staticmethod
+    def _iterate(cursor, chunk_rows):
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield from rows
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._merged, size))
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor.close()
+        self._cursors = []
+
+
+class ShardRouter:
+    def __init__(self, shards, main_pool, key="owner", directory_ttl=60.0,
+                 fanout_threads=0, sequence=None):
+        if key not in SHARD_KEYS:
+            raise ValueError(f"Invalid shard key: {key}")
+        self.shards = list(shards)
+        self.main_pool = main_pool
+        self.key = key
+        self.directory_ttl = directory_ttl
+        self.fanout_threads = fanout_threads or len(self.shards)
+        # None = satu shard: id dari AUTOINCREMENT database utama seperti biasa
+        self.sequence = sequence
+        # box_id -> (shard, berlaku sampai, tercatat di box_shards)
+        self._directory = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {"hits": 0, "misses": 0, "assigned": 0, "fan_outs": 0}
+
+    @property
+    def count(self) -> int:
+        return len(self.shards)
+
+    def policy_shard(self, box_id, owner_id=None, count=None) -> int:
+        """Shard tujuan box baru menurut SHARD_KEY (count: jumlah shard lain, untuk rebalance)."""
+        count = count or self.count
+        if self.key == "owner" and owner_id is not None:
+            return hash_shard(f"owner:{owner_id}", count)
+        return hash_shard(box_id, count)
+
+    # --- DIREKTORI BOX -> SHARD ---
+
+    def _cached(self, box_ids, now, recorded_only):
+        found, missing = {}, []
+        with self._lock:
+            for box_id in box_ids:
+                item = self._directory.get(box_id)
+                if item is not None and item[1] > now and (item[2] or not recorded_only):
+                    found[box_id] = item[0]
+                else:
+                    missing.append(box_id)
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(missing)
+        return found, missing
+
+    def _load(self, conn, box_ids, now):
+        """Baca direktori untuk box_ids; box yang belum tercatat diberi tebakan shard policy."""
+        found, owners = {}, {}
+        expires_at = now + self.directory_ttl
+        with self._lock:
+            for row in conn.execute(LOOKUP_QUERY, (json.dumps(box_ids),)):
+                recorded = row["shard"] is not None
+                shard = row["shard"] if recorded else self.policy_shard(row["box_id"], row["user_id"])
+                self._directory[row["box_id"]] = (shard, expires_at, recorded)
+                if recorded:
+                    found[row["box_id"]] = shard
+                else:
+                    owners[row["box_id"]] = row["user_id"]
+        return found, owners
+
+    def shards_for(self, box_ids) -> dict:
+        """box_id -> shard untuk dibaca. Box yang belum pernah ditulis -> shard policy-nya."""
+        box_ids = list(dict.fromkeys(box_ids))
+        if self.count == 1:
+            return {box_id: 0 for box_id in box_ids}
+        now = time.monotonic()
+        found, missing = self._cached(box_ids, now, recorded_only=False)
+        if missing:
+            conn = self.main_pool.connection()
+            try:
+                recorded, owners = self._load(conn, missing, now)
+            finally:
+                conn.close()
+            found.update(recorded)
+            found.update((box_id, self.policy_shard(box_id, owner)) for box_id, owner in owners.items())
+        return found
+
+    def shard_for(self, box_id) -> int:
+        return self.shards_for([box_id])[box_id]
+
+    def assign(self, box_ids, owner_id=None) -> dict:
+        """
+        box_id -> shard untuk ditulis; box baru dicatat di box_shards.
+        Dengan satu shard tetap dicatat (shard 0) agar SHARD_COUNT bisa dinaikkan
+        nanti tanpa kehilangan jejak data lama. owner_id: owner yang baru
+        didaftarkan (register_box), selain itu dibaca dari box_ownership.
+        """
+        box_ids = list(dict.fromkeys(box_ids))
+        now = time.monotonic()
+        found, missing = self._cached(box_ids, now, recorded_only=True)
+        if not missing:
+            return found
+        conn = self.main_pool.connection()
+        try:
+            recorded, owners = self._load(conn, missing, now)
+            found.update(recorded)
+            if owners:
+                if owner_id is not None:
+                    owners = {box_id: owner_id for box_id in owners}
+                conn.executemany(
+                    "INSERT OR IGNORE INTO box_shards (box_id, shard) VALUES (?, ?)",
+                    [(box_id, self.policy_shard(box_id, owner)) for box_id, owner in owners.items()]
+                )
+                conn.commit()
+                # Proses lain bisa mencatat box yang sama lebih dulu: pakai isi tabel
+                recorded, _ = self._load(conn, list(owners), now)
+                found.update(recorded)
+                with self._lock:
+                    self._stats["assigned"] += len(owners)
+        finally:
+            conn.close()
+        return found
+
+    def group(self, box_ids) -> dict:
+        """{shard: [box_id]} untuk dibaca (urutan box dipertahankan)."""
+        groups = {}
+        for box_id, shard in self.shards_for(box_ids).items():
+            groups.setdefault(shard, []).append(box_id)
+        return groups
+
+    def invalidate(self, box_ids=None):
+        with self._lock:
+            if box_ids is None:
+                self._directory.clear()
+            else:
+                for box_id in box_ids:
+                    self._directory.pop(box_id, None)
+
+    # --- KONEKSI & FAN-OUT ---
+
+    def connection(self, shard):
+        return self.shards[shard].pool.connection()
+
+    def connection_for(self, box_id):
+        """(koneksi, Shard) untuk data satu box."""
+        shard = self.shards[self.shard_for(box_id)]
+        return shard.pool.connection(), shard
+
+    def fan_out(self, fn, shards=None) -> list:
+        """
+        fn(conn, shard) di setiap shard secara paralel (thread pool; sqlite3
+        melepas GIL selama query). Return hasil per shard, urut index shard.
+        """
+        targets = [self.shards[i] for i in (range(self.count) if shards is None else shards)]
+
+        def run(shard):
+            conn = shard.pool.connection()
+            try:
+                return fn(conn, shard)
+            finally:
+                conn.close()
+
+        if len(targets) <= 1:
+            return [run(shard) for shard in targets]
+        with self._lock:
+            self._stats["fan_outs"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.fanout_threads, thread_name_prefix="shard-fanout")
+            executor = self._executor
+        return list(executor.map(run, targets))
+
+    def fan_out_boxes(self, box_ids, fn) -> list:
+        """fn(conn, shard, box_ids) hanya di shard yang memegang box tersebut."""
+        groups = self.group(box_ids)
+        return self.fan_out(lambda conn, shard: fn(conn, shard, groups[shard.index]), sorted(groups))
+
+    # --- ID ---
+
+    def allocate_ids(self, conn, count) -> int:
+        """Return id terakhir sebelum blok baru; dipanggil di dalam write lock shard."""
+        if self.sequence is None:
+            return conn.execute(LAST_ID_QUERY).fetchone()[0]
+        return self.sequence.allocate(count)
+
+    def sync_sequence(self):
+        """Sequence tidak boleh tertinggal dari id yang sudah ada di shard mana pun."""
+        if self.sequence is None:
+            return
+        last_ids = self.fan_out(lambda conn, shard: conn.execute(LAST_ID_QUERY).fetchone()[0])
+        self.sequence.ensure_at_least(max(last_ids) + 1)
+
+    # --- LIFECYCLE & STATISTIK ---
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.pool.close_all()
+            if shard.export_pool is not shard.pool:
+                shard.export_pool.close_all()
+        if self.sequence is not None:
+            self.sequence.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["directory_entries"] = len(self._directory)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else 0.0
+        data.update({
+            "shards": self.count,
+            "key": self.key,
+            "directory_ttl_seconds": self.directory_ttl,
+            "fanout_threads": self.fanout_threads,
+        })
+        return data
@@ -0,0 +1,210 @@
+import json
+import math
+
+from alerts import distance_m
+
+# ==============================================================================
+# INDEX SPASIAL POSISI TERAKHIR (R*TREE)
+# ==============================================================================
+# box_positions menyimpan posisi terakhir (yang punya koordinat) per box,
+# dan box_positions_rtree adalah index R*Tree di atasnya. Keduanya diperbarui
+# di transaksi yang sama dengan insert batch (seperti rollup), jadi query
+# viewport peta / radius cukup membaca index, bukan memindai smartbox_data.
+#
+# R*Tree SQLite menyimpan koordinat sebagai float32 yang dibulatkan keluar,
+# jadi hasil index selalu dicek ulang dengan lat/lon asli di box_positions.
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG_LAT = 111320.0
+
+CREATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS box_positions (
+        rid INTEGER PRIMARY KEY,
+        box_id TEXT NOT NULL UNIQUE,
+        reading_id INTEGER NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        timestamp DATETIME
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS box_positions_rtree
+    USING rtree(rid, min_lat, max_lat, min_lon, max_lon)
+    """,
+]
+
+# Hanya maju: batch yang datang terlambat / reading lama (timestamp perangkat
+# lebih awal) tidak menimpa posisi yang lebih baru
+UPSERT_SQL = """
+INSERT INTO box_positions (box_id, reading_id, latitude, longitude, timestamp)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (box_id) DO UPDATE SET
+    reading_id = excluded.reading_id,
+    latitude = excluded.latitude,
+    longitude = excluded.longitude,
+    timestamp = excluded.timestamp
+WHERE (IFNULL(excluded.timestamp, ''), excluded.reading_id)
+    > (IFNULL(box_positions.timestamp, ''), box_positions.reading_id)
+RETURNING rid, latitude, longitude
+"""
+
+RTREE_UPSERT_SQL = "INSERT OR REPLACE INTO box_positions_rtree VALUES (?, ?, ?, ?, ?)"
+
+BBOX_QUERY = """
+SELECT p.box_id, p.reading_id, p.latitude, p.longitude, p.timestamp
+FROM box_positions_rtree r
+JOIN box_positions p ON p.rid = r.rid
+WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+  AND p.latitude BETWEEN ? AND ? AND p.longitude BETWEEN ? AND ?
+"""
+
+
+def create_spatial_tables(conn):
+    for statement in CREATE_TABLES_SQL:
+        conn.execute(statement)
+
+
+def backfill_positions(conn):
+    """Buat tabel dan isi posisi terakhir tiap box dari data mentah yang ada."""
+    create_spatial_tables(conn)
+    conn.execute("""
+        INSERT OR IGNORE INTO box_positions (box_id, reading_id, latitude, longitude, timestamp)
+        SELECT d.box_id, d.id, d.latitude, d.longitude, d.timestamp
+        FROM smartbox_data d
+        JOIN (
+            SELECT box_id, MAX(timestamp) AS timestamp FROM smartbox_data
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            GROUP BY box_id
+        ) last ON d.box_id = last.box_id AND d.timestamp = last.timestamp
+        WHERE d.latitude IS NOT NULL AND d.longitude IS NOT NULL
+        ORDER BY d.id DESC
+    """)
+    conn.execute("""
+        INSERT OR REPLACE INTO box_positions_rtree
+        SELECT rid, latitude, latitude, longitude, longitude FROM box_positions
+    """)
+
+
+def apply_positions(conn, rows):
+    """Perbarui posisi terakhir dari baris yang baru disimpan (dalam transaksi pemanggil)."""
+    latest = {}
+    for row in rows:
+        if row.get("latitude") is None or row.get("longitude") is None:
+            continue
+        current = latest.get(row["box_id"])
+        if current is None or (row.get("timestamp") or "", row["id"]) > (current.get("timestamp") or "", current["id"]):
+            latest[row["box_id"]] = row
+    for row in latest.values():
+        updated = conn.execute(UPSERT_SQL, (
+            row["box_id"], row["id"], row["latitude"], row["longitude"], row.get("timestamp")
+        )).fetchone()
+        if updated is not None:
+            rid, lat, lon = updated
+            conn.execute(RTREE_UPSERT_SQL, (rid, lat, lat, lon, lon))
+    return len(latest)
+
+
+# --- QUERY ---
+
+def _filter_clause(allowed, owner_id, params):
+    clause = ""
+    if allowed is not None:
+        params.append(json.dumps(sorted(allowed)))
+        clause += " AND p.box_id IN (SELECT value FROM json_each(?))"
+    if owner_id is not None:
+        # Dicek per kandidat lewat UNIQUE(box_id), tanpa memuat semua box milik user
+        params.append(owner_id)
+        clause += " AND EXISTS (SELECT 1 FROM box_ownership o WHERE o.box_id = p.box_id AND o.user_id = ?)"
+    return clause
+
+
+def query_bbox(conn, min_lat, min_lon, max_lat, max_lon, allowed=None, owner_id=None, limit=None):
+    """
+    Posisi terakhir box di dalam bounding box. allowed = set box_id yang
+    boleh (None = semua), owner_id = hanya box milik user tersebut.
+    """
+    params = [min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon]
+    query = BBOX_QUERY + _filter_clause(allowed, owner_id, params) + " ORDER BY p.box_id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return [dict(row) for row in conn.execute(query, params)]
+
+
+def radius_bbox(lat, lon, radius_m):
+    """Bounding box yang memuat lingkaran radius_m di sekitar (lat, lon)."""
+    dlat = radius_m / METERS_PER_DEG_LAT
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlon = min(180.0, radius_m / (METERS_PER_DEG_LAT * cos_lat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def query_nearby(conn, lat, lon, radius_m, allowed=None, owner_id=None, limit=None):
+    """Box dalam radius_m dari titik, terdekat dulu (kandidat dari R*Tree, lalu haversine)."""
+    items = []
+    for row in query_bbox(conn, *radius_bbox(lat, lon, radius_m), allowed=allowed, owner_id=owner_id):
+        distance = distance_m(lat, lon, row["latitude"], row["longitude"])
+        if distance <= radius_m:
+            row["distance_m"] = round(distance, 1)
+            items.append(row)
+    items.sort(key=lambda r: r["distance_m"])
+    return items[:limit] if limit is not None else items
+
+
+# --- PENYEDERHANAAN TRACK (DOUGLAS-PEUCKER) ---
+
+def _project(points):
+    """Proyeksi equirectangular lokal ke meter (cukup akurat untuk satu track)."""
+    lat0 = math.radians(sum(p[0] for p in points) / len(points))
+    kx = EARTH_RADIUS_M * math.cos(lat0) * math.pi / 180
+    ky = EARTH_RADIUS_M * math.pi / 180
+    return [(p[1] * kx, p[0] * ky) for p in points]
+
+
+def douglas_peucker(points, tolerance_m) -> list:
+    """
+    points: list (lat, lon, ...). Return index titik yang dipertahankan
+    (selalu termasuk titik pertama & terakhir). Iteratif, tanpa rekursi.
+    """
+    n = len(points)
+    if n <= 2:
+        return list(range(n))
+    xy = _project(points)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        max_dist, index = -1.0, None
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq == 0:
+                dist = math.hypot(px - ax, py - ay)
+            else:
+                # Jarak ke segmen (bukan garis tak hingga), agar titik bolak-balik tetap terdeteksi
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+                dist = math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in range(n) if keep[i]]
+
+
+def simplify_track(points, tolerance_m, max_points=None):
+    """
+    Douglas-Peucker dengan toleransi (meter). Jika hasilnya masih lebih dari
+    max_points, toleransi digandakan sampai cukup. Return (points, toleransi akhir).
+    """
+    keep = douglas_peucker(points, tolerance_m)
+    while max_points and len(keep) > max_points and tolerance_m < 1e7:
+        tolerance_m = max(tolerance_m * 2, 1.0)
+        keep = douglas_peucker(points, tolerance_m)
+    return [points[i] for i in keep], tolerance_m
@@ -0,0 +1,167 @@
+import json
+import threading
+from collections import deque
+
+# ==============================================================================
+# TELEMETRY STREAM (SERVER-SENT EVENTS)
+# ==============================================================================
+# Writer ingest mem-publish setiap baris yang sudah di-commit ke broker ini,
+# lalu broker meneruskannya ke buffer setiap client SSE yang berlangganan box
+# tersebut. Event id = cursor: id baris terakhir yang sudah dikirim per
+# partisi (shard), sehingga client bisa resume dengan header Last-Event-ID
+# (dari history di memori, atau dari DB).
+#
+# Id hanya berurutan sesuai commit di dalam satu shard: writer di shard lain
+# bisa commit id yang lebih besar lebih dulu. Karena itu posisi disimpan per
+# shard ("120-97" untuk dua shard); dengan satu partisi cursor tetap satu
+# angka (= id baris) seperti sebelumnya.
+
+
+def parse_cursor(value, partitions):
+    """Token cursor -> list id terakhir per partisi, atau None jika kosong / tidak valid."""
+    parts = str(value).split("-") if value not in (None, "") else []
+    if not parts or not all(part.isdigit() for part in parts):
+        return None
+    ids = [int(part) for part in parts]
+    if len(ids) != partitions:
+        # Cursor lama (satu angka) atau jumlah shard berubah: mulai dari posisi
+        # terkecil, lebih baik ada baris terkirim ulang daripada terlewat
+        ids = [min(ids)] * partitions
+    return ids
+
+
+def format_cursor(ids):
+    return ids[0] if len(ids) == 1 else "-".join(map(str, ids))
+
+
+class Subscriber:
+    def __init__(self, box_ids, max_buffer):
+        # box_ids None = semua box (super admin)
+        self.box_ids = box_ids
+        self.max_buffer = max_buffer
+        self.evicted = False
+        # True saat server shutdown: stream ditutup, client reconnect ke worker lain
+        self.closed = False
+        self._buffer = deque()
+        self._cond = threading.Condition()
+
+    def wants(self, box_id) -> bool:
+        return self.box_ids is None or box_id in self.box_ids
+
+    def offer(self, event) -> bool:
+        """Masukkan event ke buffer. Return False jika client terlalu lambat (evict)."""
+        with self._cond:
+            if self.evicted:
+                return False
+            if len(self._buffer) >= self.max_buffer:
+                # Slow consumer: buang buffer, client harus reconnect + resume
+                self.evicted = True
+                self._buffer.clear()
+                self._cond.notify()
+                return False
+            self._buffer.append(event)
+            self._cond.notify()
+            return True
+
+    def wait(self, timeout):
+        """Tunggu event baru. Return list event (bisa kosong jika timeout)."""
+        with self._cond:
+            if not self._buffer and not self.evicted and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._buffer)
+            self._buffer.clear()
+            return events
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class TelemetryBroker:
+    def __init__(self, history_size=5000, client_buffer=1000, partition=None):
+        self.client_buffer = client_buffer
+        # partition(rows) -> index partisi (shard) per baris; None = satu partisi
+        self._partition = partition
+        # (partisi, baris) urut publish; per partisi urut id
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "delivered": 0, "evicted": 0, "connections": 0}
+
+    def subscribe(self, box_ids=None, cursor=None):
+        """
+        Daftarkan subscriber baru. Return (subscriber, backlog, missing):
+        backlog = event (partisi, baris) dari history setelah cursor (list id
+        per partisi), missing = partisi yang history-nya tidak mencapai cursor
+        sehingga sisanya harus diambil dari DB.
+        """
+        sub = Subscriber(box_ids, self.client_buffer)
+        with self._lock:
+            # Broker sudah ditutup (shutdown): stream langsung selesai setelah backlog
+            sub.closed = self._closed
+            self._subscribers.add(sub)
+            self._stats["connections"] += 1
+            backlog = []
+            missing = []
+            if cursor is not None:
+                covered = set()
+                for key, row in self._history:
+                    if row["id"] <= cursor[key] + 1:
+                        covered.add(key)
+                    if row["id"] > cursor[key] and sub.wants(row["box_id"]):
+                        backlog.append((key, row))
+                missing = [key for key in range(len(cursor)) if key not in covered]
+        return sub, backlog, missing
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+            if sub.evicted:
+                self._stats["evicted"] += 1
+
+    def publish(self, rows):
+        """Dipanggil writer ingest setelah batch di-commit."""
+        keys = self._partition(rows) if self._partition is not None else [0] * len(rows)
+        events = list(zip(keys, rows))
+        with self._lock:
+            self._history.extend(events)
+            self._stats["published"] += len(rows)
+            subscribers = list(self._subscribers)
+        delivered = 0
+        for sub in subscribers:
+            for event in events:
+                if sub.wants(event[1]["box_id"]):
+                    if not sub.offer(event):
+                        break
+                    delivered += 1
+        if delivered:
+            with self._lock:
+                self._stats["delivered"] += delivered
+
+    def close_all(self):
+        """Tutup semua stream aktif (graceful shutdown). Return jumlah subscriber."""
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.close()
+        return len(subscribers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["subscribers"] = len(self._subscribers)
+            data["history"] = len(self._history)
+        return data
+
+
+def format_sse(data, event=None, event_id=None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
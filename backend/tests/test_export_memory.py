@@ -0,0 +1,95 @@
+"""
+Export CSV streaming (export_stream.py): puncak memori Python harus tetap
+datar walaupun jumlah baris export bertambah 10x.
+
+Cara menjalankan (dari folder backend):
+    python -m pytest tests
+"""
+import gzip
+import os
+import sqlite3
+import sys
+import tracemalloc
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from export_stream import csv_blocks, gzip_blocks, iter_rows  # noqa: E402
+
+HEADER = ('Waktu', 'Suhu (°C)', 'Kelembapan (%)', 'Latitude', 'Longitude')
+COLUMNS = ('timestamp', 'temperature', 'humidity', 'latitude', 'longitude')
+QUERY = "SELECT timestamp, temperature, humidity, latitude, longitude FROM smartbox_data ORDER BY id DESC"
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("export") / "export.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE smartbox_data (
+            id INTEGER PRIMARY KEY, timestamp TEXT, temperature REAL,
+            humidity REAL, latitude REAL, longitude REAL
+        )
+    """)
+    # Data dibuat di SQLite (bukan list Python) agar tidak ikut terhitung tracemalloc
+    conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 200000)
+        INSERT INTO smartbox_data (id, timestamp, temperature, humidity, latitude, longitude)
+        SELECT i, datetime(1700000000 + i * 60, 'unixepoch'), 4.0 + (i % 50) / 10.0,
+               50.0 + (i % 30), -6.2 + i * 1e-6, 106.8 - i * 1e-6
+        FROM n
+    """)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def export_peak(path, rows, compress=False):
+    """(jumlah byte export, puncak memori tracemalloc) untuk `rows` baris terbaru."""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        tracemalloc.start()
+        cursor = conn.execute(QUERY + " LIMIT ?", (rows,))
+        blocks = csv_blocks(iter_rows(cursor), HEADER, COLUMNS)
+        if compress:
+            blocks = gzip_blocks(blocks)
+        size = 0
+        last = b""
+        for block in blocks:
+            size += len(block)
+            last = block
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        conn.close()
+    assert last, "export kosong"
+    return size, peak
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_export_peak_memory_stays_flat(database, compress):
+    small_size, small_peak = export_peak(database, 20000, compress)
+    large_size, large_peak = export_peak(database, 200000, compress)
+
+    assert large_size > 5 * small_size
+    # Output 10x lebih besar, puncak memori tidak boleh ikut tumbuh (toleransi
+    # untuk noise alokasi: 25% atau 256 KiB)
+    assert large_peak <= max(small_peak * 1.25, small_peak + 256 * 1024), (small_peak, large_peak)
+    # Puncak dibatasi blok 64 KB + chunk fetchmany, bukan ukuran file
+    # (batas yang sama dengan default --max-peak-mb benchmarks/bench_export.py)
+    assert large_peak < 8 * 1024 * 1024
+
+
+def test_export_gzip_matches_plain(database):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    try:
+        plain = b"".join(csv_blocks(iter_rows(conn.execute(QUERY + " LIMIT 5000")), HEADER, COLUMNS))
+        packed = b"".join(gzip_blocks(csv_blocks(iter_rows(conn.execute(QUERY + " LIMIT 5000")), HEADER, COLUMNS)))
+    finally:
+        conn.close()
+    assert gzip.decompress(packed) == plain
+    assert plain.count(b"\n") == 5001
@@ -0,0 +1,79 @@
+"""
+Rollup (rollups.py): posisi terakhir per bucket dipilih menurut
+(timestamp, id), baik lewat UPSERT per batch maupun backfill migrasi.
+
+Cara menjalankan (dari folder backend):
+    python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from migrations import SHARD_MIGRATIONS, apply_migrations  # noqa: E402
+from rollups import apply_rollups, backfill_rollups  # noqa: E402
+
+
+def open_db(path, target=None):
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    # Skema file shard: smartbox_data + smartbox_rollup tanpa tabel user/box
+    apply_migrations(conn, target=target, migrations=SHARD_MIGRATIONS)
+    return conn
+
+
+def insert(conn, box_id, timestamp, lat, lon):
+    cursor = conn.execute(
+        "INSERT INTO smartbox_data (box_id, timestamp, temperature, humidity, latitude, longitude) "
+        "VALUES (?, ?, 5.0, 60.0, ?, ?)",
+        (box_id, timestamp, lat, lon),
+    )
+    return conn.execute("SELECT * FROM smartbox_data WHERE id = ?", (cursor.lastrowid,)).fetchone()
+
+
+def last_position(conn, box_id, resolution):
+    return tuple(conn.execute(
+        "SELECT last_latitude, last_longitude FROM smartbox_rollup WHERE box_id = ? AND resolution = ?",
+        (box_id, resolution),
+    ).fetchone())
+
+
+def test_late_reading_keeps_latest_position(tmp_path):
+    conn = open_db(tmp_path / "rollup.db")
+    fresh = insert(conn, "BOX-1", "2024-05-01 10:00:50", -6.20, 106.80)
+    apply_rollups(conn, [fresh])
+    # Reading terlambat: id lebih besar, timestamp perangkat lebih lama
+    late = insert(conn, "BOX-1", "2024-05-01 10:00:10", -7.00, 110.00)
+    apply_rollups(conn, [late])
+    for seconds in (60, 3600, 86400):
+        assert last_position(conn, "BOX-1", seconds) == (-6.20, 106.80)
+
+    # Dalam satu batch pun urutan (timestamp, id) yang menentukan
+    newer = insert(conn, "BOX-1", "2024-05-01 10:00:55", -6.30, 106.90)
+    older = insert(conn, "BOX-1", "2024-05-01 10:00:20", -8.00, 112.00)
+    apply_rollups(conn, [newer, older])
+    assert last_position(conn, "BOX-1", 60) == (-6.30, 106.90)
+    conn.close()
+
+
+def test_backfill_and_upgrade_use_timestamp_order(tmp_path):
+    path = tmp_path / "upgrade.db"
+    conn = open_db(path, target=2)
+    insert(conn, "BOX-2", "2024-05-01 10:00:50", -6.20, 106.80)
+    insert(conn, "BOX-2", "2024-05-01 10:00:10", -7.00, 110.00)
+    backfill_rollups(conn)
+    conn.commit()
+    assert last_position(conn, "BOX-2", 60) == (-6.20, 106.80)
+    conn.close()
+
+    conn = open_db(path)
+    row = conn.execute(
+        "SELECT last_ts FROM smartbox_rollup WHERE box_id = 'BOX-2' AND resolution = 60"
+    ).fetchone()
+    assert row["last_ts"] == 1714557650
+    late = insert(conn, "BOX-2", "2024-05-01 10:00:30", -9.00, 115.00)
+    apply_rollups(conn, [late])
+    assert last_position(conn, "BOX-2", 60) == (-6.20, 106.80)
+    conn.close()
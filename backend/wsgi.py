@@ -0,0 +1,13 @@
+"""
+Entry point WSGI untuk produksi (multi-worker, multi-core).
+
+Cara menjalankan (dari folder backend):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Setiap worker meng-import modul ini setelah fork dan memanggil create_app()
+sekali: DB & cache disiapkan, lalu thread background dijalankan sesuai peran
+worker (leader / follower, lihat SECTION 6 di backend.py).
+"""
+from backend import create_app
+
+app = create_app()
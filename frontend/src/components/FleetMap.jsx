@@ -1,9 +1,10 @@
 
 // src/components/FleetMap.jsx
-import React from 'react';
-import { MapContainer, TileLayer, Marker, Popup } from 'react-leaflet';
+import React, { useCallback, useEffect, useState } from 'react';
+import { MapContainer, TileLayer, Marker, Popup, useMap, useMapEvents } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
 import L from 'leaflet';
+import { getFleetPositions } from '../services/api';
 
 // Import logo Anda untuk dijadikan icon
 import SmartBoxLogo from '../assets/smartboxiotlogo.png';
@@ -16,9 +17,29 @@ const smartBoxIcon = new L.Icon({
     popupAnchor: [0, -40] // Posisi popup relatif terhadap icon
 });
 
+// Muat posisi box di dalam viewport dari index spasial backend setiap kali
+// peta selesai digeser / di-zoom (tidak perlu data semua box di browser)
+const ViewportLoader = ({ onPositions }) => {
+    const map = useMap();
+    const load = useCallback(() => {
+        getFleetPositions(map.getBounds().toBBoxString())
+            .then((res) => onPositions(res.data || []))
+            .catch(() => {});
+    }, [map, onPositions]);
+
+    useMapEvents({ moveend: load });
+    useEffect(() => { load(); }, [load]);
+    return null;
+};
+
 const FleetMap = ({ fleetData }) => {
-    // Filter hanya box yang memiliki koordinat valid
-    const validFleets = Object.values(fleetData).filter(
+    const [viewportFleet, setViewportFleet] = useState({});
+    const handlePositions = useCallback((rows) => {
+        setViewportFleet(Object.fromEntries(rows.map((row) => [row.box_id, row])));
+    }, []);
+
+    // Posisi viewport, ditimpa data live dari parent (lebih baru); hanya yang koordinatnya valid
+    const validFleets = Object.values({ ...viewportFleet, ...fleetData }).filter(
         box => box && box.latitude && box.longitude
     );
 
@@ -33,6 +54,8 @@ const FleetMap = ({ fleetData }) => {
                 scrollWheelZoom={false}
                 style={{ height: "400px", width: "100%", borderRadius: "15px", zIndex: 0 }}
             >
+                <ViewportLoader onPositions={handlePositions} />
+
                 {/* Tile Layer dari OpenStreetMap (Gratis) */}
                 <TileLayer
                     attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
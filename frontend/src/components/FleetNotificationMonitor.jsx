@@ -3,7 +3,7 @@
 import { useEffect, useRef } from 'react';
 import toast from 'react-hot-toast';
 import { useAuth } from '../contexts/AuthContext';
-import { getSmartBoxData } from '../services/api';
+import { getAlerts, subscribeAlerts } from '../services/api';
 import { AlertTriangle } from 'lucide-react';
 import { useTranslation } from 'react-i18next';
 
@@ -18,18 +18,20 @@ const FleetNotificationMonitor = () => {
   const { t } = useTranslation();
   
   // Gunakan useRef agar nilainya selalu update di dalam setInterval tanpa re-render
+  // Key: `${box_id}:${kind}` -> id toast
   const activeToastsRef = useRef({}); 
   
   const intervalRef = useRef(null);
+  // Cursor /api/alerts: id event alert terakhir yang sudah diproses
+  const cursorRef = useRef(0);
+  const monitoredKeyRef = useRef('');
+  // Stream SSE alert; selama stream hidup tidak perlu polling
+  const streamCloseRef = useRef(null);
+  const streamOkRef = useRef(false);
   const audioRef = useRef(new Audio(ALERT_SOUND_URL));
 
-  const isDanger = (log) => {
-    if (!log || !log.temperature || !log.humidity) return false;
-    // Logika Bahaya
-    const isTempSafe = log.temperature >= 1.0 && log.temperature <= 4.0;
-    const isHumidSafe = log.humidity >= 20.0 && log.humidity <= 60.0;
-    return !isTempSafe || !isHumidSafe;
-  };
+  // Bahaya dievaluasi di server (alert engine); client hanya menampilkan
+  // perubahan state alert (raised / cleared).
 
   const playAlert = () => {
     if (audioRef.current) {
@@ -38,6 +40,113 @@ const FleetNotificationMonitor = () => {
     }
   };
 
+  const alertKey = (alert) => `${alert.box_id}:${alert.kind}`;
+
+  const showAlert = (alert, silent = false) => {
+    const key = alertKey(alert);
+    // Cek via Ref: Apakah notifikasi SUDAH ada?
+    if (activeToastsRef.current[key]) return;
+
+    // 1. Bunyikan Audio
+    if (!silent) playAlert();
+
+    // 2. Munculkan Toast
+    const toastId = toast.custom((tInstance) => (
+      <div
+        className={`${
+          tInstance.visible ? 'animate-enter' : 'animate-leave'
+        } max-w-md w-full bg-white shadow-lg rounded-lg pointer-events-auto flex ring-1 ring-black ring-opacity-5`}
+        style={{ borderLeft: '6px solid #ef4444', maxWidth: '300px' }}
+        onClick={() => {
+           // User klik manual -> Hapus Toast & Hapus dari Ref
+           toast.dismiss(tInstance.id);
+           delete activeToastsRef.current[key];
+        }}
+      >
+        <div className="flex-1 w-0 p-4 cursor-pointer">
+          <div className="flex items-start">
+            <div className="flex-shrink-0 pt-0.5">
+              <AlertTriangle className="h-10 w-10 text-red-500 animate-pulse" />
+            </div>
+            <div className="ml-3 flex-1">
+              <p className="text-sm font-medium text-gray-900">
+                {t('status.danger', 'BAHAYA!')} - {alert.box_id}
+              </p>
+              <p className="mt-1 text-sm text-gray-500">
+                {alert.message}
+              </p>
+              <p className="mt-2 text-xs text-red-400 font-bold">
+                {t('notification.clickToDismiss', 'Klik untuk menutup')}
+              </p>
+            </div>
+          </div>
+        </div>
+      </div>
+    ), {
+      duration: Infinity, 
+      position: 'bottom-left', // Posisi di kiri bawah agar tidak tabrakan sama notif sukses
+      id: `danger-${key}`,
+    });
+
+    // 3. Simpan ID toast ke Ref (Sync langsung)
+    activeToastsRef.current[key] = toastId;
+    console.log(`[Monitor] Notifikasi Bahaya Dibuat: ${key}`);
+  };
+
+  const dismissAlert = (key) => {
+    if (activeToastsRef.current[key]) {
+      console.log(`[Monitor] Kondisi Aman. Menghapus notifikasi: ${key}`);
+      toast.dismiss(activeToastsRef.current[key]);
+      delete activeToastsRef.current[key];
+    }
+  };
+
+  // Satu event perubahan state dari server
+  const applyAlert = (alert) => {
+    if (alert.id && alert.id > cursorRef.current) cursorRef.current = alert.id;
+    if (alert.state === 'raised') showAlert(alert);
+    else dismissAlert(alertKey(alert));
+  };
+
+  // Samakan toast dengan daftar alert aktif di server (saat mulai / reconnect)
+  const syncActiveAlerts = async (myDevices) => {
+    try {
+      const { data, cursor } = await getAlerts({ active: true, boxIds: myDevices });
+      const activeKeys = new Set(data.map(alertKey));
+      Object.keys(activeToastsRef.current)
+        .filter(key => !activeKeys.has(key))
+        .forEach(dismissAlert);
+      data.forEach(alert => showAlert(alert, true));
+      if (cursor > cursorRef.current) cursorRef.current = cursor;
+    } catch (error) {
+      // Silent error agar console tidak penuh
+    }
+  };
+
+  // Buka (ulang) stream SSE alert untuk daftar device yang dipantau
+  const openStream = (myDevices) => {
+    if (streamCloseRef.current) streamCloseRef.current();
+    streamOkRef.current = false;
+    streamCloseRef.current = subscribeAlerts({
+      boxIds: myDevices,
+      onReady: () => {
+        streamOkRef.current = true;
+        syncActiveAlerts(myDevices);
+      },
+      onAlert: applyAlert,
+      onError: () => {
+        // Stream putus: kembali ke polling sampai reconnect berhasil
+        streamOkRef.current = false;
+      },
+    });
+  };
+
+  const closeStream = () => {
+    if (streamCloseRef.current) streamCloseRef.current();
+    streamCloseRef.current = null;
+    streamOkRef.current = false;
+  };
+
   const checkFleets = async () => {
     // Jangan lanjut jika tidak login
     if (!isAuthenticated) return;
@@ -47,89 +156,29 @@ const FleetNotificationMonitor = () => {
     const savedDevices = localStorage.getItem("my_smartboxes");
     const myDevices = savedDevices ? JSON.parse(savedDevices) : [];
 
-    // Jika tidak ada device yang dipantau, berhenti (hemat resource)
-    if (myDevices.length === 0) return;
-
-    // Loop hanya device milik user (bukan hardcoded)
-    for (const boxId of myDevices) {
-      try {
-        const data = await getSmartBoxData(boxId, 1);
-        const latestLog = data[0];
-
-        // ------------------------------------------
-        // KASUS 1: KONDISI BAHAYA
-        // ------------------------------------------
-        if (latestLog && isDanger(latestLog)) {
-          
-          // Cek via Ref: Apakah notifikasi SUDAH ada?
-          if (!activeToastsRef.current[boxId]) {
-            
-            // 1. Bunyikan Audio
-            playAlert();
-
-            // 2. Munculkan Toast
-            const toastId = toast.custom((tInstance) => (
-              <div
-                className={`${
-                  tInstance.visible ? 'animate-enter' : 'animate-leave'
-                } max-w-md w-full bg-white shadow-lg rounded-lg pointer-events-auto flex ring-1 ring-black ring-opacity-5`}
-                style={{ borderLeft: '6px solid #ef4444', maxWidth: '300px' }}
-                onClick={() => {
-                   // User klik manual -> Hapus Toast & Hapus dari Ref
-                   toast.dismiss(tInstance.id);
-                   delete activeToastsRef.current[boxId];
-                }}
-              >
-                <div className="flex-1 w-0 p-4 cursor-pointer">
-                  <div className="flex items-start">
-                    <div className="flex-shrink-0 pt-0.5">
-                      <AlertTriangle className="h-10 w-10 text-red-500 animate-pulse" />
-                    </div>
-                    <div className="ml-3 flex-1">
-                      <p className="text-sm font-medium text-gray-900">
-                        {t('status.danger', 'BAHAYA!')} - {boxId}
-                      </p>
-                      <p className="mt-1 text-sm text-gray-500">
-                        Temp: {latestLog.temperature}°C | Hum: {latestLog.humidity}%
-                      </p>
-                      <p className="mt-2 text-xs text-red-400 font-bold">
-                        {t('notification.clickToDismiss', 'Klik untuk menutup')}
-                      </p>
-                    </div>
-                  </div>
-                </div>
-              </div>
-            ), {
-              duration: Infinity, 
-              position: 'bottom-left', // Posisi di kiri bawah agar tidak tabrakan sama notif sukses
-              id: `danger-${boxId}`,
-            });
-
-            // 3. Simpan ID toast ke Ref (Sync langsung)
-            activeToastsRef.current[boxId] = toastId;
-            console.log(`[Monitor] Notifikasi Bahaya Dibuat: ${boxId}`);
-          }
-        } 
-        // ------------------------------------------
-        // KASUS 2: KONDISI AMAN (ATAU DATA TIDAK VALID)
-        // ------------------------------------------
-        else {
-          // Cek via Ref: Apakah ada notifikasi yang sedang aktif untuk box ini?
-          if (activeToastsRef.current[boxId]) {
-            
-            console.log(`[Monitor] Kondisi Aman. Menghapus notifikasi: ${boxId}`);
-            
-            // 1. Hapus Toast dari layar
-            toast.dismiss(activeToastsRef.current[boxId]);
-            
-            // 2. Hapus dari Ref agar status kembali bersih
-            delete activeToastsRef.current[boxId];
-          }
-        }
-
-      } catch (error) {
-        // Silent error agar console tidak penuh
+    // Daftar device berubah -> sinkron ulang alert aktif & buka ulang stream
+    const monitoredKey = myDevices.join(',');
+    if (monitoredKey !== monitoredKeyRef.current) {
+      monitoredKeyRef.current = monitoredKey;
+      if (myDevices.length > 0) {
+        await syncActiveAlerts(myDevices);
+        openStream(myDevices);
+      } else {
+        closeStream();
+        Object.keys(activeToastsRef.current).forEach(dismissAlert);
       }
+      return;
+    }
+
+    // Jika tidak ada device, atau stream sedang hidup, tidak perlu polling
+    if (myDevices.length === 0 || streamOkRef.current) return;
+
+    // Fallback: ambil hanya perubahan alert sejak cursor terakhir
+    try {
+      const { data } = await getAlerts({ since: cursorRef.current, boxIds: myDevices });
+      data.forEach(applyAlert);
+    } catch (error) {
+      // Silent error agar console tidak penuh
     }
   };
 
@@ -141,15 +190,18 @@ const FleetNotificationMonitor = () => {
         // Setup Interval
         intervalRef.current = setInterval(() => {
             checkFleets();
-        }, 5000); // Cek setiap 5 detik
+        }, 5000); // Cek setiap 5 detik (polling hanya jika stream putus)
     } else {
         // Jika logout, bersihkan semua
         toast.dismiss(); 
         activeToastsRef.current = {};
+        cursorRef.current = 0;
     }
 
     return () => {
         if (intervalRef.current) clearInterval(intervalRef.current);
+        closeStream();
+        monitoredKeyRef.current = '';
     };
   }, [isAuthenticated]);
 
@@ -4,7 +4,7 @@ import { useTranslation } from 'react-i18next';
 import { useSettings } from '../contexts/SettingsContext';
 // 1. Tambahkan ikon Download
 import { Thermometer, Droplets, MapPin, AlertTriangle, CheckCircle, WifiOff, RefreshCw, Download } from 'lucide-react';
-import { getSmartBoxData } from '../services/api';
+import { getExportUrl, getFleetLatest, subscribeTelemetry } from '../services/api';
 import FleetMap from './FleetMap'; 
 import { Link } from 'react-router-dom';
 import '../App.css';
@@ -16,6 +16,11 @@ const SmartBoxDataDisplay = ({ boxIds }) => {
   const [isRefreshing, setIsRefreshing] = useState(false);
   const [error, setError] = useState(null);
   const containerRef = useRef(null);
+  // Cursor dari /api/fleet/latest: refresh berikutnya hanya menerima box yang berubah
+  const cursorRef = useRef(0);
+  // Box yang sudah menerima update lewat stream (tidak perlu dipolling)
+  const streamedIdsRef = useRef(new Set());
+  const boxKey = boxIds.join(',');
 
   const { temperatureUnit, refreshInterval } = useSettings();
 
@@ -49,37 +54,55 @@ const SmartBoxDataDisplay = ({ boxIds }) => {
   };
 
   // 2. Fungsi Download CSV (Langsung hit endpoint backend)
-  const handleDownloadCSV = (e, boxId) => {
+  const handleDownloadCSV = async (e, boxId) => {
     e.preventDefault(); // Mencegah navigasi Link parent jika ada
-    const BASE_URL = (import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000').replace(/\/$/, '');
-    // Membuka tab baru yang langsung memicu download dari backend
-    window.open(`${BASE_URL}/api/export/${boxId}`, '_blank');
+    // Tab dibuka sebelum await (agar tidak diblokir popup blocker), lalu
+    // diarahkan ke URL download dengan token export berumur pendek
+    const tab = window.open('', '_blank');
+    try {
+      const url = await getExportUrl(boxId);
+      if (tab) tab.location.href = url;
+    } catch (err) {
+      if (tab) tab.close();
+    }
   };
 
-  // Fetch data logika (tidak berubah)
+  // Daftar box berubah -> ambil ulang semua (reset cursor)
+  useEffect(() => {
+    cursorRef.current = 0;
+  }, [boxKey]);
+
+  // Satu request untuk seluruh armada (bukan satu request per box)
   const fetchFleetData = useCallback(async (isBackground = false) => {
+    // Polling background hanya untuk box yang tidak tercakup stream
+    const targetIds = isBackground
+      ? boxIds.filter(id => !streamedIdsRef.current.has(id))
+      : boxIds;
+    if (targetIds.length === 0) return;
+
     if (!isBackground) setIsLoading(true);
     else setIsRefreshing(true);
 
     setError(null);
 
-    const promises = boxIds.map(id =>
-      getSmartBoxData(id, 1)
-        .then(data => ({ id, status: 'fulfilled', data: data[0] }))
-        .catch(error => ({ id, status: 'rejected', error }))
-    );
+    // Refresh manual (bukan background) selalu ambil snapshot penuh
+    const since = isBackground ? cursorRef.current : 0;
 
-    const results = await Promise.allSettled(promises);
+    try {
+      const { data, cursor } = await getFleetLatest(targetIds, since);
 
-    const newFleetStatus = {};
-    results.forEach(result => {
-      if (result.status === 'fulfilled') {
-        const { id, data } = result.value;
-        newFleetStatus[id] = data || { id, timestamp: null };
+      const newFleetStatus = {};
+      if (!since) {
+        // Snapshot penuh: box tanpa data ditandai "no data"
+        targetIds.forEach(id => { newFleetStatus[id] = { id, timestamp: null }; });
       }
-    });
+      data.forEach(log => { newFleetStatus[log.box_id] = log; });
 
-    setFleetStatus(prev => ({ ...prev, ...newFleetStatus }));
+      cursorRef.current = cursor;
+      setFleetStatus(prev => ({ ...prev, ...newFleetStatus }));
+    } catch (err) {
+      setError(err.message);
+    }
 
     setIsLoading(false);
     setIsRefreshing(false);
@@ -96,6 +119,29 @@ const SmartBoxDataDisplay = ({ boxIds }) => {
     }
   }, [fetchFleetData, refreshInterval]);
 
+  // Update live lewat SSE: selama stream aktif, dashboard idle tidak polling
+  useEffect(() => {
+    if (boxIds.length === 0) return;
+    const unsubscribe = subscribeTelemetry({
+      boxIds,
+      onReady: ({ box_ids }) => {
+        streamedIdsRef.current = new Set(box_ids === null ? boxIds : box_ids);
+      },
+      onReading: (log) => {
+        setFleetStatus(prev => ({ ...prev, [log.box_id]: log }));
+      },
+      onError: () => {
+        // Stream putus: kembali ke polling sampai reconnect berhasil
+        streamedIdsRef.current = new Set();
+      },
+    });
+    return () => {
+      unsubscribe();
+      streamedIdsRef.current = new Set();
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [boxKey]);
+
   return (
     <div ref={containerRef} className="fleet-table-container">
       <div className="fleet-table-header">
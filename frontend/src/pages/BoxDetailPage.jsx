@@ -3,7 +3,7 @@ import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, ReferenceLine } from 'recharts';
 import { ArrowLeft, Thermometer, Droplets, Clock, Download } from 'lucide-react'; 
-import { getSmartBoxData } from '../services/api';
+import { getExportUrl, getSmartBoxData, subscribeTelemetry } from '../services/api';
 import { useTranslation } from 'react-i18next';
 import '../App.css';
 
@@ -16,44 +16,49 @@ const BoxDetailPage = () => {
   const [loading, setLoading] = useState(true);
 
   // --- FUNGSI EXPORT CSV ---
-  const handleDownloadCSV = () => {
-    const BASE_URL = (import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000').replace(/\/$/, '');
-    window.open(`${BASE_URL}/api/export/${boxId}`, '_blank');
+  const handleDownloadCSV = async () => {
+    // Tab dibuka sebelum await agar tidak diblokir popup blocker
+    const tab = window.open('', '_blank');
+    try {
+      const url = await getExportUrl(boxId);
+      if (tab) tab.location.href = url;
+    } catch (err) {
+      if (tab) tab.close();
+    }
   };
 
   useEffect(() => {
+    // --- LOGIKA FILTER WAKTU ---
+    // Hanya data yang LEBIH BARU dari "sekarang dikurangi 20 menit"
+    const isRecent = (item) => {
+      const twentyMinutesAgo = new Date(Date.now() - 20 * 60 * 1000);
+      // Konversi timestamp UTC database ke objek Date JS
+      const itemDate = new Date(item.timestamp.replace(" ", "T") + "Z");
+      return itemDate > twentyMinutesAgo;
+    };
+
+    const formatItem = (item) => ({
+      ...item,
+      // Format Jam (Sumbu X)
+      time: new Date(item.timestamp.replace(" ", "T") + "Z").toLocaleTimeString('id-ID', { 
+        timeZone: 'Asia/Jakarta',
+        hour: '2-digit', 
+        minute: '2-digit', 
+        second: '2-digit' 
+      }),
+      // Format Tanggal Lengkap (Tooltip)
+      fullDate: new Date(item.timestamp.replace(" ", "T") + "Z").toLocaleString('id-ID', { 
+        timeZone: 'Asia/Jakarta' 
+      }) 
+    });
+
     const fetchData = async () => {
       try {
         // Ambil data agak banyak (misal 600) untuk memastikan buffer cukup
         const limit = 600; 
         const result = await getSmartBoxData(boxId, limit);
         
-        // --- LOGIKA FILTER WAKTU (BARU) ---
-        // Kita hitung waktu batas: "Sekarang dikurangi 20 menit"
-        const twentyMinutesAgo = new Date(Date.now() - 20 * 60 * 1000);
-
-        // Filter: Hanya ambil data yang LEBIH BARU dari batas tersebut
-        const timeFilteredData = result.filter(item => {
-            // Konversi timestamp UTC database ke objek Date JS
-            const itemDate = new Date(item.timestamp.replace(" ", "T") + "Z");
-            return itemDate > twentyMinutesAgo;
-        });
-        // ----------------------------------
-
-        const formattedData = timeFilteredData.map(item => ({
-          ...item,
-          // Format Jam (Sumbu X)
-          time: new Date(item.timestamp.replace(" ", "T") + "Z").toLocaleTimeString('id-ID', { 
-            timeZone: 'Asia/Jakarta',
-            hour: '2-digit', 
-            minute: '2-digit', 
-            second: '2-digit' 
-          }),
-          // Format Tanggal Lengkap (Tooltip)
-          fullDate: new Date(item.timestamp.replace(" ", "T") + "Z").toLocaleString('id-ID', { 
-            timeZone: 'Asia/Jakarta' 
-          }) 
-        })).reverse();
+        const formattedData = result.filter(isRecent).map(formatItem).reverse();
         
         setData(formattedData);
       } catch (error) {
@@ -63,9 +68,40 @@ const BoxDetailPage = () => {
       }
     };
 
+    // Polling 3 detik hanya dipakai jika stream tidak tersedia untuk box ini
+    let interval = null;
+    const startPolling = () => {
+      if (!interval) interval = setInterval(fetchData, 3000);
+    };
+    const stopPolling = () => {
+      if (interval) clearInterval(interval);
+      interval = null;
+    };
+
     fetchData();
-    const interval = setInterval(fetchData, 3000); 
-    return () => clearInterval(interval);
+    const unsubscribe = subscribeTelemetry({
+      boxIds: [boxId],
+      onReady: ({ box_ids }) => {
+        if (box_ids === null || box_ids.includes(boxId)) {
+          stopPolling();
+          fetchData(); // Isi celah data selama stream belum aktif
+        } else {
+          startPolling();
+        }
+      },
+      onReading: (item) => {
+        setData(prev => {
+          if (prev.some(p => p.id === item.id)) return prev;
+          return [...prev.filter(isRecent), formatItem(item)];
+        });
+      },
+      onError: startPolling,
+    });
+
+    return () => {
+      unsubscribe();
+      stopPolling();
+    };
   }, [boxId]);
 
   if (loading) return <div className="loading-text" style={{padding: '5rem', textAlign:'center'}}>{t('loading', 'Loading...')}</div>;
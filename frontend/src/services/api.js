@@ -9,6 +9,19 @@ const getAuthToken = () => {
   return localStorage.getItem('authToken');
 };
 
+// 3. Cache respons GET terakhir per URL (+ token) untuk conditional request:
+// server membalas 304 tanpa body jika data belum berubah
+const ETAG_CACHE_LIMIT = 200;
+const etagCache = new Map();
+
+const rememberResponse = (key, etag, lastModified, data) => {
+  etagCache.delete(key);
+  etagCache.set(key, { etag, lastModified, data });
+  if (etagCache.size > ETAG_CACHE_LIMIT) {
+    etagCache.delete(etagCache.keys().next().value);
+  }
+};
+
 /**
  * Fungsi inti untuk semua panggilan API.
  */
@@ -26,6 +39,14 @@ const apiFetch = async (endpoint, options = {}) => {
     headers['Authorization'] = `Bearer ${token}`;
   }
 
+  const isGet = !options.method || options.method.toUpperCase() === 'GET';
+  const cacheKey = `${token || ''} ${url}`;
+  const cached = isGet ? etagCache.get(cacheKey) : undefined;
+  if (cached) {
+    if (cached.etag) headers['If-None-Match'] = cached.etag;
+    else if (cached.lastModified) headers['If-Modified-Since'] = cached.lastModified;
+  }
+
   const config = {
     ...options,
     headers,
@@ -33,6 +54,11 @@ const apiFetch = async (endpoint, options = {}) => {
 
   try {
     const response = await fetch(url, config);
+
+    // Data belum berubah sejak request sebelumnya: pakai hasil yang disimpan
+    if (response.status === 304 && cached) {
+      return cached.data;
+    }
     
     const contentType = response.headers.get("content-type");
     if (!contentType || !contentType.includes("application/json")) {
@@ -46,6 +72,12 @@ const apiFetch = async (endpoint, options = {}) => {
       throw new Error(data.error || `HTTP error! status: ${response.status}`);
     }
 
+    const etag = response.headers.get('ETag');
+    const lastModified = response.headers.get('Last-Modified');
+    if (isGet && (etag || lastModified)) {
+      rememberResponse(cacheKey, etag, lastModified, data);
+    }
+
     return data;
   } catch (err) {
     console.error(`API Fetch Error (${endpoint}):`, err.message);
@@ -69,6 +101,19 @@ export const registerUser = (signupData) => {
   });
 };
 
+/**
+ * Token berumur pendek untuk URL yang dibuka tanpa header Authorization
+ * (EventSource, link download). Token sesi tidak pernah masuk query string.
+ * purpose: 'stream' atau 'export' (wajib boxId).
+ */
+const getUrlToken = async (purpose, boxId) => {
+  const { token } = await apiFetch('/api/auth/url-token', {
+    method: 'POST',
+    body: JSON.stringify(boxId ? { purpose, box_id: boxId } : { purpose }),
+  });
+  return token;
+};
+
 // --- FUNGSI DATA ---
 
 export const getSmartBoxData = (boxId, limit = 6) => {
@@ -77,6 +122,149 @@ export const getSmartBoxData = (boxId, limit = 6) => {
   });
 };
 
+/**
+ * Data terakhir banyak box dalam satu request.
+ * `since` = cursor dari response sebelumnya; box yang tidak berubah tidak dikirim.
+ * Response: { data: [...], cursor: <number | string> } (string "id-id" jika backend memakai beberapa shard)
+ */
+export const getFleetLatest = (boxIds = [], since = 0) => {
+  const params = new URLSearchParams();
+  if (boxIds.length > 0) params.set('box_ids', boxIds.join(','));
+  if (since) params.set('since', since);
+  return apiFetch(`/api/fleet/latest?${params.toString()}`, {
+    method: 'GET',
+  });
+};
+
+/**
+ * URL download CSV satu box. Dibuka langsung oleh browser (window.open),
+ * jadi membawa token URL khusus export box ini (berlaku URL_TOKEN_TTL detik).
+ */
+export const getExportUrl = async (boxId) => {
+  const params = new URLSearchParams({ token: await getUrlToken('export', boxId) });
+  return `${BASE_URL}/api/export/${boxId}?${params.toString()}`;
+};
+
+/**
+ * Posisi terakhir box di dalam viewport peta.
+ * `bbox` = "min_lon,min_lat,max_lon,max_lat" (Leaflet: map.getBounds().toBBoxString()).
+ * Response: { data: [...], truncated: <bool> }
+ */
+export const getFleetPositions = (bbox) => {
+  const params = new URLSearchParams({ bbox });
+  return apiFetch(`/api/fleet/positions?${params.toString()}`, {
+    method: 'GET',
+  });
+};
+
+/**
+ * Jejak perjalanan satu box yang sudah disederhanakan server.
+ * Response: { box_id, points: [{ latitude, longitude, timestamp }], raw_points, tolerance_m }
+ */
+export const getTrack = (boxId, { start, end, toleranceM } = {}) => {
+  const params = new URLSearchParams();
+  if (start) params.set('start', start);
+  if (end) params.set('end', end);
+  if (toleranceM) params.set('tolerance_m', toleranceM);
+  return apiFetch(`/api/track/${boxId}?${params.toString()}`, {
+    method: 'GET',
+  });
+};
+
+// --- STREAM TELEMETRI (SERVER-SENT EVENTS) ---
+
+const STREAM_RETRY_MS = 3000;
+
+/**
+ * EventSource dengan token URL baru setiap koneksi. Reconnect bawaan browser
+ * memakai URL lama yang tokennya sudah kedaluwarsa, jadi saat error stream
+ * ditutup lalu dibuka ulang di sini dengan last_event_id (pengganti Last-Event-ID).
+ * handlers: { namaEvent: fn(data) }. Return fungsi untuk menutup stream.
+ */
+const openEventStream = (path, params, handlers, onError) => {
+  let source = null;
+  let retryTimer = null;
+  let closed = false;
+  let lastEventId = null;
+
+  const retry = () => {
+    if (!closed) retryTimer = setTimeout(connect, STREAM_RETRY_MS);
+  };
+
+  async function connect() {
+    let token;
+    try {
+      token = await getUrlToken('stream');
+    } catch (err) {
+      onError?.(err);
+      retry();
+      return;
+    }
+    if (closed) return;
+
+    const query = new URLSearchParams(params);
+    query.set('token', token);
+    if (lastEventId) query.set('last_event_id', lastEventId);
+    source = new EventSource(`${BASE_URL}${path}?${query.toString()}`);
+
+    Object.entries(handlers).forEach(([event, handler]) => {
+      source.addEventListener(event, (e) => {
+        if (e.lastEventId) lastEventId = e.lastEventId;
+        handler?.(JSON.parse(e.data));
+      });
+    });
+    source.onerror = (e) => {
+      source.close();
+      onError?.(e);
+      retry();
+    };
+  }
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(retryTimer);
+    if (source) source.close();
+  };
+};
+
+/**
+ * Berlangganan data baru secara push. EventSource otomatis reconnect dan
+ * mengirim Last-Event-ID, sehingga data yang terlewat dikirim ulang server.
+ * onReady menerima { box_ids }: daftar box yang diizinkan (null = semua).
+ * Return fungsi untuk menutup stream.
+ */
+export const subscribeTelemetry = ({ boxIds = [], onReading, onReady, onError } = {}) => {
+  const params = boxIds.length > 0 ? { box_ids: boxIds.join(',') } : {};
+  return openEventStream('/api/stream/telemetry', params, { ready: onReady, reading: onReading }, onError);
+};
+
+// --- ALERT (DIEVALUASI DI SERVER) ---
+
+/**
+ * Alert milik user. active=true -> alert yang sedang aktif;
+ * selain itu riwayat perubahan state setelah `since`.
+ * Response: { data: [...], cursor: <number> } (id alert_events terakhir; tabel alert tidak di-shard)
+ */
+export const getAlerts = ({ active = false, since = 0, boxIds = [] } = {}) => {
+  const params = new URLSearchParams();
+  if (active) params.set('active', '1');
+  if (since) params.set('since', since);
+  if (boxIds.length > 0) params.set('box_ids', boxIds.join(','));
+  return apiFetch(`/api/alerts?${params.toString()}`, {
+    method: 'GET',
+  });
+};
+
+/**
+ * Berlangganan perubahan state alert (raised / cleared) secara push.
+ * Return fungsi untuk menutup stream.
+ */
+export const subscribeAlerts = ({ boxIds = [], onAlert, onReady, onError } = {}) => {
+  const params = boxIds.length > 0 ? { box_ids: boxIds.join(',') } : {};
+  return openEventStream('/api/stream/alerts', params, { ready: onReady, alert: onAlert }, onError);
+};
+
 // --- FUNGSI SUPER ADMIN (WAJIB ADA UNTUK ADMIN PAGE) ---
 
 export const getPendingUsers = () => {